@@ -0,0 +1,109 @@
+"""
+仪表板接口的Redis响应缓存
+
+统计类接口的结果变化缓慢，使用 @cached 缓存一段时间；写入测试用例或测试结果后
+调用 invalidate_dashboard_cache() 清除缓存。Redis不可用时缓存自动关闭，接口照常查询数据库。
+"""
+
+import functools
+import hashlib
+import logging
+import os
+from typing import Any, Callable, Optional
+
+import orjson
+import redis
+import redis.asyncio as aioredis
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
+
+# 仪表板缓存键的公共前缀，用于整体失效
+DASHBOARD_CACHE_PATTERN = "dashboard:*"
+
+class RedisCache:
+    """基于连接池的异步Redis缓存"""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.client: Optional[aioredis.Redis] = None
+
+    async def connect(self) -> None:
+        """建立连接池，Redis不可用时关闭缓存"""
+        client = aioredis.from_url(self.url, socket_connect_timeout=1, socket_timeout=1)
+        try:
+            await client.ping()
+        except redis.RedisError as e:
+            logger.warning("Redis不可用，仪表板缓存已关闭: %s", e)
+            await client.aclose()
+            return
+        self.client = client
+
+    async def disconnect(self) -> None:
+        """关闭连接池"""
+        if self.client:
+            await self.client.aclose()
+            self.client = None
+
+    async def get(self, key: str) -> Optional[Any]:
+        """读取缓存，未命中或出错时返回None"""
+        if not self.client:
+            return None
+        try:
+            value = await self.client.get(key)
+        except redis.RedisError as e:
+            logger.warning("读取缓存失败: %s", e)
+            return None
+        return orjson.loads(value) if value is not None else None
+
+    async def set(self, key: str, value: Any, ttl: int) -> None:
+        """写入缓存并设置过期时间（秒）"""
+        if not self.client:
+            return
+        try:
+            await self.client.setex(key, ttl, orjson.dumps(value, default=str))
+        except redis.RedisError as e:
+            logger.warning("写入缓存失败: %s", e)
+
+    async def delete_pattern(self, pattern: str) -> None:
+        """删除匹配模式的所有缓存键"""
+        if not self.client:
+            return
+        try:
+            keys = [key async for key in self.client.scan_iter(match=pattern, count=500)]
+            if keys:
+                await self.client.delete(*keys)
+        except redis.RedisError as e:
+            logger.warning("清除缓存失败: %s", e)
+
+cache = RedisCache(REDIS_URL)
+
+def _default_key_builder(prefix: str, kwargs: dict) -> str:
+    """根据查询参数生成缓存键，数据库会话等依赖对象不参与"""
+    params = {k: v for k, v in kwargs.items() if k != "db"}
+    digest = hashlib.blake2b(orjson.dumps(params, option=orjson.OPT_SORT_KEYS), digest_size=8).hexdigest()
+    return f"{prefix}:{digest}"
+
+def cached(prefix: str, ttl: int, key_builder: Callable[[str, dict], str] = _default_key_builder):
+    """缓存异步接口的返回值，接口参数需以关键字参数传入（FastAPI的调用方式）"""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(**kwargs):
+            key = key_builder(prefix, kwargs)
+            value = await cache.get(key)
+            if value is not None:
+                return value
+
+            value = await func(**kwargs)
+            await cache.set(key, value, ttl)
+            return value
+        return wrapper
+    return decorator
+
+async def invalidate_dashboard_cache() -> None:
+    """测试用例或测试结果变化后清除仪表板缓存"""
+    await cache.delete_pattern(DASHBOARD_CACHE_PATTERN)
@@ -1,26 +1,100 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 import os
+import orjson
 from dotenv import load_dotenv
 
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./test_platform.db")
 
+# 同步数据库URL对应的异步驱动
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "mysql": "mysql+aiomysql"
+}
+
+def get_async_database_url(url: str) -> str:
+    """将同步数据库URL转换为异步驱动的URL"""
+    scheme, separator, rest = url.partition("://")
+    dialect = scheme.split("+", 1)[0]
+    return f"{ASYNC_DRIVERS.get(dialect, scheme)}{separator}{rest}"
+
+# 连接池参数（SQLite不使用连接池配置），同步和异步引擎共用
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 20))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+
+POOL_OPTIONS = {} if "sqlite" in DATABASE_URL else {
+    "pool_size": DB_POOL_SIZE,
+    "max_overflow": DB_MAX_OVERFLOW,
+    "pool_timeout": 30,
+    "pool_recycle": DB_POOL_RECYCLE,
+    "pool_pre_ping": True
+}
+
+def _json_serializer(obj) -> str:
+    """JSON列使用orjson编码"""
+    return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY).decode()
+
 engine = create_engine(
     DATABASE_URL,
-    connect_args={"check_same_thread": False} if "sqlite" in DATABASE_URL else {}
+    insertmanyvalues_page_size=1000,
+    json_serializer=_json_serializer,
+    json_deserializer=orjson.loads,
+    connect_args={"check_same_thread": False} if "sqlite" in DATABASE_URL else {},
+    **POOL_OPTIONS
+)
+
+# 提交后不过期对象，避免提交后读取属性（如新插入行的id）时重新查询
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
+
+# 异步引擎，供请求处理使用，避免同步数据库调用阻塞事件循环
+async_engine = create_async_engine(
+    get_async_database_url(DATABASE_URL),
+    echo=False,
+    insertmanyvalues_page_size=1000,
+    json_serializer=_json_serializer,
+    json_deserializer=orjson.loads,
+    **POOL_OPTIONS
 )
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
 
 Base = declarative_base()
 
-def get_db():
-    """获取数据库会话"""
-    db = SessionLocal()
-    try:
+def create_tables():
+    """创建缺少的数据表并迁移旧版表结构，只在部署脚本或单进程启动入口中调用，避免每个worker启动时都检查表结构
+
+    先用一次查询列出已有的表（PostgreSQL上还有物化视图），都已存在时跳过 create_all 的逐表检查。
+    已有的表不会被 create_all 修改，之后总是执行幂等的迁移（见 app.migrations）。
+    """
+    from app.models import test_models  # 注册模型到Base.metadata
+    from app.migrations import run_migrations
+
+    inspector = inspect(engine)
+    existing = set(inspector.get_table_names())
+    if engine.dialect.name == "postgresql":
+        existing.update(inspector.get_materialized_view_names())
+        required = set(Base.metadata.tables) | {test_models.mv_model_performance.name}
+    else:
+        required = set(Base.metadata.tables)
+
+    if not required <= existing:
+        Base.metadata.create_all(bind=engine)
+
+    with SessionLocal() as db:
+        run_migrations(db)
+
+async def get_async_db():
+    """获取异步数据库会话"""
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
\ No newline at end of file
+
+async def warm_up_async_engine():
+    """预热连接池，避免首个请求承担建立连接的开销"""
+    async with async_engine.connect() as conn:
+        await conn.execute(text("SELECT 1"))
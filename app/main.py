@@ -1,26 +1,69 @@
 from fastapi import FastAPI, HTTPException, Depends, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import HTMLResponse
 from fastapi.templating import Jinja2Templates
 from fastapi import Request
+from contextlib import asynccontextmanager
 import os
 from dotenv import load_dotenv
 
-from app.routers import classification, correction, dialogue, rag, agent, dashboard
-from app.database import engine, Base
-from app.models import test_models
+from app.routers import classification, correction, dialogue, rag, agent, dashboard, tasks
+from app.responses import ORJSONResponse
+from app.cache import cache
+from app.database import async_engine, warm_up_async_engine, create_tables
+from app.services.agent_service import AgentService
+from app.services.classification_service import ClassificationService
+from app.services.correction_service import CorrectionService
+from app.services.dialogue_service import DialogueService
+from app.services.rag_service import RAGService
+from app.services.llm_clients import create_llm_clients
+
+# 可选导入：安装了 brotli-asgi 时优先使用Brotli压缩，不支持br的客户端自动回退到gzip
+try:
+    from brotli_asgi import BrotliMiddleware
+    BROTLI_AVAILABLE = True
+except ImportError:
+    BrotliMiddleware = None
+    BROTLI_AVAILABLE = False
 
 # Load environment variables
 load_dotenv()
 
-# Create database tables
-Base.metadata.create_all(bind=engine)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """应用生命周期：启动时预热数据库连接池并创建共享的服务实例，关闭时释放连接"""
+    await warm_up_async_engine()
+    await cache.connect()
+    
+    # 所有服务共用同一组LLM客户端，复用到模型接口的TCP/TLS连接
+    app.state.llm_clients = create_llm_clients()
+    
+    # 服务本身不保存请求状态，所有请求共用同一个实例
+    app.state.agent_service = AgentService(app.state.llm_clients)
+    app.state.classification_service = ClassificationService(app.state.llm_clients)
+    app.state.correction_service = CorrectionService(app.state.llm_clients)
+    # RAG服务的嵌入模型只加载一次，上传的文档在进程内一直可供检索
+    app.state.dialogue_service = DialogueService(app.state.llm_clients)
+    app.state.rag_service = RAGService(app.state.llm_clients)
+    agent._tools_cached.cache_clear()
+    
+    yield
+    await app.state.classification_service.aclose()
+    await app.state.correction_service.aclose()
+    await app.state.dialogue_service.aclose()
+    await app.state.rag_service.aclose()
+    await app.state.llm_clients.aclose()
+    await cache.disconnect()
+    await async_engine.dispose()
 
 app = FastAPI(
     title="AI任务自动化测试平台",
     description="用于测试分类、纠错、对话、RAG、Agent等AI任务的综合平台",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
 # CORS middleware
@@ -32,6 +75,13 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 响应压缩：导出和列表接口的JSON包含大量重复键，压缩后传输量显著减少；
+# 小于1KB的响应不压缩，避免得不偿失
+if BROTLI_AVAILABLE:
+    app.add_middleware(BrotliMiddleware, quality=4, minimum_size=1024)
+else:
+    app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=5)
+
 # Static files and templates
 app.mount("/static", StaticFiles(directory="app/static"), name="static")
 templates = Jinja2Templates(directory="app/templates")
@@ -43,6 +93,7 @@ app.include_router(dialogue.router, prefix="/api/dialogue", tags=["对话任务"
 app.include_router(rag.router, prefix="/api/rag", tags=["RAG任务"])
 app.include_router(agent.router, prefix="/api/agent", tags=["Agent任务"])
 app.include_router(dashboard.router, prefix="/api/dashboard", tags=["仪表板"])
+app.include_router(tasks.router, prefix="/api/tasks", tags=["任务队列"])
 
 @app.get("/", response_class=HTMLResponse)
 async def root(request: Request):
@@ -56,9 +107,28 @@ async def health_check():
 
 if __name__ == "__main__":
     import uvicorn
+
+    # 优先使用uvloop事件循环和httptools解析器，Windows等不支持的平台回退到asyncio和h11
+    try:
+        import uvloop  # noqa: F401
+        loop = "uvloop"
+    except ImportError:
+        loop = "asyncio"
+
+    try:
+        import httptools  # noqa: F401
+        http = "httptools"
+    except ImportError:
+        http = "h11"
+
+    if os.getenv("AUTO_CREATE_TABLES", "1") == "1":
+        create_tables()
+
     uvicorn.run(
         "app.main:app",
         host=os.getenv("HOST", "0.0.0.0"),
         port=int(os.getenv("PORT", 12000)),
-        reload=os.getenv("DEBUG", "False").lower() == "true"
+        reload=os.getenv("DEBUG", "False").lower() == "true",
+        loop=loop,
+        http=http
     )
\ No newline at end of file
@@ -0,0 +1,81 @@
+"""
+旧版数据库的表结构迁移
+
+create_tables 只创建缺少的表，不会修改已有的表；这里的迁移都是幂等的，每次启动时由 create_tables 执行，
+已迁移过的数据库上只有几次表结构查询的开销。
+"""
+
+import json
+import logging
+
+from sqlalchemy import inspect, select, text
+from sqlalchemy.orm import Session
+
+from app.models.test_models import TestCase, TestResult, TestSuiteMember
+
+logger = logging.getLogger(__name__)
+
+def migrate_test_result_task_type(db: Session):
+    """为旧版 test_results 表添加冗余的 task_type 列并回填，同时补建缺失的索引"""
+    bind = db.get_bind()
+    columns = [column["name"] for column in inspect(bind).get_columns("test_results")]
+    if "task_type" not in columns:
+        db.execute(text("ALTER TABLE test_results ADD COLUMN task_type VARCHAR(50)"))
+
+    updated = db.execute(text(
+        "UPDATE test_results SET task_type = "
+        "(SELECT task_type FROM test_cases WHERE test_cases.id = test_results.test_case_id) "
+        "WHERE task_type IS NULL"
+    )).rowcount
+    db.commit()
+
+    # create_all 不会为已存在的表补建索引
+    for index in TestResult.__table__.indexes:
+        index.create(bind, checkfirst=True)
+
+    if updated:
+        logger.info("✅ 已回填 %d 条测试结果的任务类型", updated)
+
+def migrate_test_suite_members(db: Session):
+    """将旧版 test_suites.test_case_ids JSON 列中的测试用例迁移到关联表
+
+    已删除的测试用例会违反关联表的外键（PostgreSQL上整个迁移会失败），迁移时跳过。
+    """
+    columns = [column["name"] for column in inspect(db.get_bind()).get_columns("test_suites")]
+    if "test_case_ids" not in columns:
+        return
+
+    rows = db.execute(text("SELECT id, test_case_ids FROM test_suites WHERE test_case_ids IS NOT NULL")).all()
+    suite_case_ids = []
+    for suite_id, test_case_ids in rows:
+        if isinstance(test_case_ids, str):
+            test_case_ids = json.loads(test_case_ids)
+        suite_case_ids.append((suite_id, list(dict.fromkeys(test_case_ids or []))))
+
+    referenced = {test_case_id for _, test_case_ids in suite_case_ids for test_case_id in test_case_ids}
+    if not referenced:
+        return
+
+    existing_cases = set(db.scalars(select(TestCase.id).where(TestCase.id.in_(referenced))))
+    existing = set(db.query(TestSuiteMember.suite_id, TestSuiteMember.test_case_id).all())
+
+    members = []
+    skipped = 0
+    for suite_id, test_case_ids in suite_case_ids:
+        for test_case_id in test_case_ids:
+            if test_case_id not in existing_cases:
+                skipped += 1
+            elif (suite_id, test_case_id) not in existing:
+                members.append({"suite_id": suite_id, "test_case_id": test_case_id})
+
+    if members:
+        db.bulk_insert_mappings(TestSuiteMember, members)
+        db.commit()
+        logger.info("✅ 已迁移 %d 条测试套件成员", len(members))
+    if skipped:
+        logger.warning("测试套件中有 %d 个已不存在的测试用例，未迁移", skipped)
+
+def run_migrations(db: Session):
+    """依次执行所有迁移"""
+    migrate_test_suite_members(db)
+    migrate_test_result_task_type(db)
@@ -1,7 +1,12 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, Float, Boolean, JSON
+from sqlalchemy import Column, Integer, String, Text, DateTime, Float, Boolean, JSON, Index, ForeignKey, DDL, event, table, column, text
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from app.database import Base
 
+# PostgreSQL上使用JSONB存储，支持GIN索引和服务端按字段投影
+JSONVariant = JSON().with_variant(JSONB(), "postgresql")
+
 class TestCase(Base):
     """测试用例基础模型"""
     __tablename__ = "test_cases"
@@ -15,21 +20,57 @@ class TestCase(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
     is_active = Column(Boolean, default=True)
+    
+    # 关联关系不允许懒加载，需要时通过JOIN显式加载，避免N+1查询
+    results = relationship("TestResult", back_populates="test_case", lazy="raise")
+    
+    __table_args__ = (
+        # 支持按任务类型列出启用的测试用例
+        Index("ix_test_cases_type_active", "task_type", "is_active", "id"),
+        # 支持仪表板概览按启用状态过滤后按任务类型分组计数
+        Index("ix_test_cases_active_type", "is_active", "task_type"),
+    )
 
 class TestResult(Base):
     """测试结果模型"""
     __tablename__ = "test_results"
     
     id = Column(Integer, primary_key=True, index=True)
-    test_case_id = Column(Integer, nullable=False)
+    test_case_id = Column(Integer, ForeignKey("test_cases.id"), nullable=False)
+    task_type = Column(String(50))  # 冗余自测试用例，按任务类型统计时无需关联 test_cases
     model_name = Column(String(255), nullable=False)
-    actual_output = Column(JSON)
+    actual_output = Column(JSONVariant)
     score = Column(Float)
-    metrics = Column(JSON)  # 存储各种评估指标
+    metrics = Column(JSONVariant)  # 存储各种评估指标
     execution_time = Column(Float)  # 执行时间（秒）
     status = Column(String(50), default="completed")  # completed, failed, running
     error_message = Column(Text)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    
+    test_case = relationship("TestCase", back_populates="results", lazy="raise")
+    
+    __table_args__ = (
+        # 支持按测试用例关联后按状态过滤、按模型分组的性能统计
+        Index("ix_test_results_case_status_model", "test_case_id", "status", "model_name"),
+        # 支持按评估指标过滤，如 metrics->>'accuracy'，仅PostgreSQL创建
+        Index("ix_test_results_metrics", "metrics", postgresql_using="gin").ddl_if(dialect="postgresql"),
+        # 支持按任务类型过滤的最近测试、趋势统计和导出
+        Index("ix_test_results_task_type_created", "task_type", text("created_at DESC")),
+        # 支持最近测试列表和趋势统计按创建时间倒序/范围扫描
+        Index("ix_test_results_created_at", text("created_at DESC")),
+        # 支持错误分析只扫描带错误信息的失败记录（部分索引）
+        Index(
+            "ix_test_results_status_created", "status", text("created_at DESC"),
+            sqlite_where=text("error_message IS NOT NULL"),
+            postgresql_where=text("error_message IS NOT NULL")
+        ),
+        # 支持模型性能统计按模型分组聚合分数（部分索引）
+        Index(
+            "ix_test_results_model_score", "model_name", "score",
+            sqlite_where=text("score IS NOT NULL"),
+            postgresql_where=text("score IS NOT NULL")
+        ),
+    )
 
 class TestSuite(Base):
     """测试套件模型"""
@@ -39,10 +80,29 @@ class TestSuite(Base):
     name = Column(String(255), nullable=False)
     description = Column(Text)
     task_type = Column(String(50), nullable=False)
-    test_case_ids = Column(JSON)  # 包含的测试用例ID列表
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
     is_active = Column(Boolean, default=True)
+    
+    # 包含的测试用例，需要时通过 selectinload(TestSuite.members) 显式加载
+    members = relationship("TestSuiteMember", cascade="all, delete-orphan", lazy="raise")
+    
+    @property
+    def test_case_ids(self):
+        """包含的测试用例ID列表，需先加载members"""
+        return [member.test_case_id for member in self.members]
+
+class TestSuiteMember(Base):
+    """测试套件与测试用例的关联"""
+    __tablename__ = "test_suite_members"
+    
+    suite_id = Column(Integer, ForeignKey("test_suites.id", ondelete="CASCADE"), primary_key=True)
+    test_case_id = Column(Integer, ForeignKey("test_cases.id", ondelete="CASCADE"), primary_key=True)
+    
+    __table_args__ = (
+        # 支持查询测试用例所属的测试套件
+        Index("ix_test_suite_members_test_case", "test_case_id"),
+    )
 
 class Model(Base):
     """模型配置"""
@@ -55,4 +115,46 @@ class Model(Base):
     api_endpoint = Column(String(500))
     is_active = Column(Boolean, default=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
-    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
\ No newline at end of file
+    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+
+# ==================== 物化视图（仅PostgreSQL） ====================
+
+# 按模型和任务类型预聚合的测试结果，仪表板模型性能接口直接读取；
+# 保存总和而不是平均值，以便跨任务类型再次汇总
+mv_model_performance = table(
+    "mv_model_performance",
+    column("model_name", String),
+    column("task_type", String),
+    column("total_tests", Integer),
+    column("success_count", Integer),
+    column("score_sum", Float),
+    column("execution_time_sum", Float),
+    column("execution_time_count", Integer),
+)
+
+MV_MODEL_PERFORMANCE_REFRESH = "REFRESH MATERIALIZED VIEW CONCURRENTLY mv_model_performance"
+
+event.listen(Base.metadata, "after_create", DDL("""
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_model_performance AS
+SELECT tr.model_name,
+       tc.task_type,
+       COUNT(*) AS total_tests,
+       SUM(CASE WHEN tr.status = 'completed' THEN 1 ELSE 0 END) AS success_count,
+       SUM(tr.score) AS score_sum,
+       SUM(tr.execution_time) AS execution_time_sum,
+       COUNT(tr.execution_time) AS execution_time_count
+FROM test_results tr
+JOIN test_cases tc ON tc.id = tr.test_case_id
+WHERE tr.score IS NOT NULL
+GROUP BY tr.model_name, tc.task_type
+""").execute_if(dialect="postgresql"))
+
+# REFRESH ... CONCURRENTLY 需要唯一索引
+event.listen(Base.metadata, "after_create", DDL(
+    "CREATE UNIQUE INDEX IF NOT EXISTS ux_mv_model_performance "
+    "ON mv_model_performance (task_type, model_name)"
+).execute_if(dialect="postgresql"))
+
+event.listen(Base.metadata, "before_drop", DDL(
+    "DROP MATERIALIZED VIEW IF EXISTS mv_model_performance"
+).execute_if(dialect="postgresql"))
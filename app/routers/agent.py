@@ -1,24 +1,39 @@
-from fastapi import APIRouter, Depends, HTTPException, Form
-from sqlalchemy.orm import Session
-from typing import List
+from fastapi import APIRouter, Depends, HTTPException, Form, Request, Response
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import load_only
+from typing import List, Optional, Dict, Any, Tuple
+from functools import lru_cache
 import time
+import asyncio
+import hashlib
+import json
 
-from app.database import get_db
+from app.cache import invalidate_dashboard_cache
+from app.database import get_async_db
 from app.models.test_models import TestCase, TestResult
+from app.routers.batch import run_batch_test
 from app.schemas.test_schemas import (
     TestCase as TestCaseSchema,
     TestCaseCreate,
+    TestCaseListItem,
     AgentInput,
     AgentOutput
 )
 from app.services.agent_service import AgentService
+from app.services.cache_scope import llm_cache_scope
+from app.tasks import enqueue_test, run_agent_task
 
 router = APIRouter()
 
+def get_agent_service(request: Request) -> AgentService:
+    """获取应用启动时创建的共享AgentService实例"""
+    return request.app.state.agent_service
+
 @router.post("/test-cases/", response_model=TestCaseSchema)
 async def create_agent_test_case(
     test_case: TestCaseCreate,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """创建Agent任务测试用例"""
     if test_case.task_type != "agent":
@@ -26,48 +41,58 @@ async def create_agent_test_case(
     
     db_test_case = TestCase(**test_case.dict())
     db.add(db_test_case)
-    db.commit()
-    db.refresh(db_test_case)
+    await db.commit()
+    await invalidate_dashboard_cache()
+    await db.refresh(db_test_case)
     return db_test_case
 
-@router.get("/test-cases/", response_model=List[TestCaseSchema])
+@router.get("/test-cases/", response_model=List[TestCaseListItem])
 async def get_agent_test_cases(
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """获取Agent任务测试用例列表"""
-    test_cases = db.query(TestCase).filter(
-        TestCase.task_type == "agent",
-        TestCase.is_active == True
-    ).offset(skip).limit(limit).all()
-    return test_cases
+    result = await db.execute(
+        select(TestCase).options(
+            load_only(TestCase.id, TestCase.name, TestCase.description, TestCase.created_at)
+        ).where(
+            TestCase.task_type == "agent",
+            TestCase.is_active == True
+        ).order_by(TestCase.id).offset(skip).limit(limit)
+    )
+    return result.scalars().all()
 
 @router.post("/test-cases/{test_case_id}/run")
 async def run_agent_test(
     test_case_id: int,
     request_data: dict,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db),
+    agent_service: AgentService = Depends(get_agent_service)
 ):
     """运行Agent任务测试"""
     model_name = request_data.get("model_name")
     execution_mode = request_data.get("execution_mode", "autonomous")
     timeout = request_data.get("timeout", 300)
     verbose_logging = request_data.get("verbose_logging", False)
+    use_cache = request_data.get("use_cache", True)
     
     if not model_name:
         raise HTTPException(status_code=400, detail="缺少model_name参数")
         
-    return await _run_agent_test_internal(test_case_id, model_name, execution_mode, timeout, verbose_logging, db)
+    return await _run_agent_test_internal(test_case_id, model_name, execution_mode, timeout, verbose_logging, db, agent_service, use_cache)
 
-@router.post("/run-test/")
+@router.post("/run-test/", status_code=202)
 async def run_agent_test_form(
     test_case_id: int = Form(...),
     model_name: str = Form(...),
-    db: Session = Depends(get_db)
+    use_cache: bool = Form(True),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """运行Agent任务测试（表单方式）"""
-    return await _run_agent_test_internal(test_case_id, model_name, "autonomous", 300, False, db)
+    """运行Agent任务测试（表单方式），测试进入后台队列，通过 /api/tasks/{task_id} 查询结果"""
+    _validate_test_case(await db.get(TestCase, test_case_id))
+    
+    return {"task_id": await enqueue_test(run_agent_task, test_case_id, model_name, use_cache)}
 
 async def _run_agent_test_internal(
     test_case_id: int,
@@ -75,21 +100,49 @@ async def _run_agent_test_internal(
     execution_mode: str,
     timeout: int,
     verbose_logging: bool,
-    db: Session
+    db: AsyncSession,
+    agent_service: AgentService,
+    use_cache: bool = True
 ):
     """运行Agent任务测试"""
-    test_case = db.query(TestCase).filter(TestCase.id == test_case_id).first()
+    test_case = _validate_test_case(await db.get(TestCase, test_case_id))
+    
+    result_data = await _execute_agent_test(test_case, model_name, execution_mode, timeout, verbose_logging, agent_service, use_cache=use_cache)
+    
+    test_result = TestResult(**result_data)
+    db.add(test_result)
+    await db.commit()
+    await invalidate_dashboard_cache()
+    
+    if result_data["status"] == "failed":
+        raise HTTPException(status_code=500, detail=f"测试执行失败: {result_data['error_message']}")
+    
+    await db.refresh(test_result)
+    return _build_test_response(test_result.id, result_data)
+
+def _validate_test_case(test_case: Optional[TestCase]) -> TestCase:
+    """校验测试用例存在且类型匹配"""
     if not test_case:
         raise HTTPException(status_code=404, detail="测试用例不存在")
     
     if test_case.task_type != "agent":
         raise HTTPException(status_code=400, detail="测试用例类型不匹配")
     
+    return test_case
+
+async def _execute_agent_test(
+    test_case: TestCase,
+    model_name: str,
+    execution_mode: str,
+    timeout: int,
+    verbose_logging: bool,
+    agent_service: AgentService,
+    use_cache: bool = True
+) -> Dict[str, Any]:
+    """执行Agent任务测试，返回待保存的测试结果字段；use_cache=False 时跳过缓存读取"""
+    start_time = time.time()
+    
     try:
-        start_time = time.time()
-        
-        agent_service = AgentService()
-        
         # 适配我们的数据结构
         input_data = AgentInput(
             task=test_case.input_data.get("task_goal"),
@@ -97,14 +150,16 @@ async def _run_agent_test_internal(
             tools=[tool.get("name") for tool in test_case.input_data.get("available_tools", [])]
         )
         
-        result = await agent_service.execute_task(
-            task=input_data.task,
-            model_name=model_name,
-            context=input_data.context,
-            tools=input_data.tools
-        )
+        with llm_cache_scope(use_cache) as cache:
+            result = await agent_service.execute_task(
+                task=input_data.task,
+                model_name=model_name,
+                context=input_data.context,
+                tools=input_data.tools
+            )
         
-        execution_time = time.time() - start_time
+        # 命中缓存的结果不计入执行时间统计
+        execution_time = None if cache.hit else time.time() - start_time
         
         # 适配expected_output结构
         expected_output = AgentOutput(
@@ -112,89 +167,98 @@ async def _run_agent_test_internal(
             actions_taken=[],  # 空的动作列表
             confidence=0.8  # 默认置信度
         )
-        metrics = agent_service.evaluate(result, expected_output)
-        
-        test_result = TestResult(
-            test_case_id=test_case_id,
-            model_name=model_name,
-            actual_output=result.dict(),
-            score=metrics.get("task_completion_score", 0.0),
-            metrics=metrics,
-            execution_time=execution_time,
-            status="completed"
-        )
-        
-        db.add(test_result)
-        db.commit()
-        db.refresh(test_result)
+        # 评估可能需要计算句向量，放到线程池中执行，避免阻塞事件循环
+        metrics = await asyncio.to_thread(agent_service.evaluate, result, expected_output)
+        metrics = {**metrics, "cache_hit": cache.hit}
         
         return {
-            "test_result_id": test_result.id,
-            "result": result,
+            "test_case_id": test_case.id,
+            "task_type": test_case.task_type,
+            "model_name": model_name,
+            "actual_output": result.dict(),
+            "score": metrics.get("task_completion_score", 0.0),
             "metrics": metrics,
-            "execution_time": execution_time
+            "execution_time": execution_time,
+            "status": "completed",
+            "error_message": None
         }
         
     except Exception as e:
-        test_result = TestResult(
-            test_case_id=test_case_id,
-            model_name=model_name,
-            actual_output={},
-            status="failed",
-            error_message=str(e),
-            execution_time=time.time() - start_time
-        )
-        
-        db.add(test_result)
-        db.commit()
-        
-        raise HTTPException(status_code=500, detail=f"测试执行失败: {str(e)}")
+        return {
+            "test_case_id": test_case.id,
+            "task_type": test_case.task_type,
+            "model_name": model_name,
+            "actual_output": {},
+            "score": None,
+            "metrics": None,
+            "execution_time": time.time() - start_time,
+            "status": "failed",
+            "error_message": str(e)
+        }
+
+def _build_test_response(test_result_id: int, result_data: Dict[str, Any]) -> Dict[str, Any]:
+    """构建测试执行的响应数据"""
+    return {
+        "test_result_id": test_result_id,
+        "result": result_data["actual_output"],
+        "metrics": result_data["metrics"],
+        "execution_time": result_data["execution_time"]
+    }
 
 @router.post("/batch-test/")
 async def run_batch_agent_test(
     test_case_ids: List[int],
     model_names: List[str],
-    db: Session = Depends(get_db)
+    use_cache: bool = True,
+    db: AsyncSession = Depends(get_async_db),
+    agent_service: AgentService = Depends(get_agent_service)
 ):
     """批量运行Agent任务测试"""
-    results = []
+    return await run_batch_test(
+        db, test_case_ids, model_names, _validate_test_case,
+        lambda test_case, model_name: _execute_agent_test(
+            test_case, model_name, "autonomous", 300, False, agent_service, use_cache=use_cache
+        ),
+        _build_test_response
+    )
+
+@lru_cache(maxsize=1)
+def _tools_cached(agent_service: AgentService) -> Tuple[bytes, str]:
+    """缓存工具列表的响应体和ETag，同一个服务实例只计算一次"""
+    body = json.dumps({"tools": agent_service.get_available_tools()}, ensure_ascii=False).encode("utf-8")
+    etag = f'"{hashlib.blake2b(body, digest_size=8).hexdigest()}"'
+    return body, etag
+
+@router.get("/available-tools/")
+async def get_available_tools(
+    request: Request,
+    agent_service: AgentService = Depends(get_agent_service)
+):
+    """获取可用的工具列表，支持If-None-Match条件请求"""
+    body, etag = _tools_cached(agent_service)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
     
-    for test_case_id in test_case_ids:
-        for model_name in model_names:
-            try:
-                result = await run_agent_test(test_case_id, model_name, db)
-                results.append({
-                    "test_case_id": test_case_id,
-                    "model_name": model_name,
-                    "status": "success",
-                    "result": result
-                })
-            except Exception as e:
-                results.append({
-                    "test_case_id": test_case_id,
-                    "model_name": model_name,
-                    "status": "failed",
-                    "error": str(e)
-                })
+    if_none_match = request.headers.get("If-None-Match", "")
+    if etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*":
+        return Response(status_code=304, headers=headers)
     
-    return {"batch_results": results}
+    return Response(content=body, media_type="application/json", headers=headers)
 
-@router.get("/available-tools/")
-async def get_available_tools():
-    """获取可用的工具列表"""
-    agent_service = AgentService()
-    return {"tools": agent_service.get_available_tools()}
+@router.post("/available-tools/refresh")
+async def refresh_available_tools():
+    """清除工具列表缓存，工具注册变化后调用"""
+    _tools_cached.cache_clear()
+    return {"message": "工具列表缓存已清除"}
 
 @router.post("/interactive-test/")
 async def interactive_agent_test(
     task: str,
     model_name: str,
     context: dict = None,
-    tools: List[str] = None
+    tools: List[str] = None,
+    agent_service: AgentService = Depends(get_agent_service)
 ):
     """交互式Agent测试"""
-    agent_service = AgentService()
-    
     try:
         result = await agent_service.execute_task(
             task=task,
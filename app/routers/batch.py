@@ -0,0 +1,75 @@
+"""
+各任务类型共用的批量测试执行
+"""
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.cache import invalidate_dashboard_cache
+from app.models.test_models import TestCase, TestResult
+
+# 批量测试中同时进行的模型调用数上限
+MAX_BATCH_CONCURRENCY = 16
+
+async def run_batch_test(
+    db: AsyncSession,
+    test_case_ids: List[int],
+    model_names: List[str],
+    validate: Callable[[Optional[TestCase]], TestCase],
+    execute: Callable[[TestCase, str], Awaitable[Dict[str, Any]]],
+    build_response: Callable[[int, Dict[str, Any]], Dict[str, Any]]
+) -> Dict[str, Any]:
+    """对每个 (测试用例, 模型) 组合执行测试并批量保存结果
+
+    validate 校验测试用例（不通过时抛出 HTTPException），execute 执行一次测试并返回待保存的测试结果字段，
+    build_response 根据测试结果ID和字段构建响应数据。
+    """
+    test_cases = await db.execute(select(TestCase).where(TestCase.id.in_(test_case_ids)))
+    test_case_map = {test_case.id: test_case for test_case in test_cases.scalars()}
+
+    semaphore = asyncio.Semaphore(MAX_BATCH_CONCURRENCY)
+
+    async def run_one(test_case: TestCase, model_name: str) -> Dict[str, Any]:
+        async with semaphore:
+            return await execute(test_case, model_name)
+
+    results = []
+    pending = []  # (批量结果项, 执行协程)
+
+    for test_case_id in test_case_ids:
+        for model_name in model_names:
+            item = {"test_case_id": test_case_id, "model_name": model_name}
+            results.append(item)
+
+            try:
+                test_case = validate(test_case_map.get(test_case_id))
+            except HTTPException as e:
+                item.update({"status": "failed", "error": e.detail})
+                continue
+
+            pending.append((item, run_one(test_case, model_name)))
+
+    # 并发执行所有模型调用，批量耗时取决于最慢的调用而不是所有调用之和
+    result_rows = await asyncio.gather(*(coro for _, coro in pending))
+    executed = [(item, result_data) for (item, _), result_data in zip(pending, result_rows)]
+
+    if executed:
+        # 所有测试结果一次性批量写入，避免逐条INSERT和提交
+        test_result_ids = await db.scalars(
+            insert(TestResult).returning(TestResult.id, sort_by_parameter_order=True),
+            [result_data for _, result_data in executed]
+        )
+        await db.commit()
+        await invalidate_dashboard_cache()
+
+        for (item, result_data), test_result_id in zip(executed, test_result_ids.all()):
+            if result_data["status"] == "completed":
+                item.update({"status": "success", "result": build_response(test_result_id, result_data)})
+            else:
+                item.update({"status": "failed", "error": f"测试执行失败: {result_data['error_message']}"})
+
+    return {"batch_results": results}
@@ -1,26 +1,37 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Form
-from sqlalchemy.orm import Session
-from typing import List, Dict, Any
+from fastapi import APIRouter, Depends, HTTPException, status, Form, Request
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import load_only
+from typing import List, Optional, Dict, Any
 import time
 import json
 
-from app.database import get_db
+from app.cache import invalidate_dashboard_cache
+from app.database import get_async_db
 from app.models.test_models import TestCase, TestResult
+from app.routers.batch import run_batch_test
 from app.schemas.test_schemas import (
     TestCase as TestCaseSchema,
     TestCaseCreate,
+    TestCaseListItem,
     TestResult as TestResultSchema,
     ClassificationInput,
     ClassificationOutput
 )
+from app.services.cache_scope import llm_cache_scope
 from app.services.classification_service import ClassificationService
+from app.tasks import enqueue_test, run_classification_task
 
 router = APIRouter()
 
+def get_classification_service(request: Request) -> ClassificationService:
+    """获取应用启动时创建的共享ClassificationService实例"""
+    return request.app.state.classification_service
+
 @router.post("/test-cases/", response_model=TestCaseSchema)
 async def create_classification_test_case(
     test_case: TestCaseCreate,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """创建分类任务测试用例"""
     if test_case.task_type != "classification":
@@ -31,171 +42,188 @@ async def create_classification_test_case(
     
     db_test_case = TestCase(**test_case.dict())
     db.add(db_test_case)
-    db.commit()
-    db.refresh(db_test_case)
+    await db.commit()
+    await invalidate_dashboard_cache()
+    await db.refresh(db_test_case)
     return db_test_case
 
-@router.get("/test-cases/", response_model=List[TestCaseSchema])
+@router.get("/test-cases/", response_model=List[TestCaseListItem])
 async def get_classification_test_cases(
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """获取分类任务测试用例列表"""
-    test_cases = db.query(TestCase).filter(
-        TestCase.task_type == "classification",
-        TestCase.is_active == True
-    ).offset(skip).limit(limit).all()
-    return test_cases
+    result = await db.execute(
+        select(TestCase).options(
+            load_only(TestCase.id, TestCase.name, TestCase.description, TestCase.created_at)
+        ).where(
+            TestCase.task_type == "classification",
+            TestCase.is_active == True
+        ).order_by(TestCase.id).offset(skip).limit(limit)
+    )
+    return result.scalars().all()
 
-@router.post("/run-test/")
+@router.post("/run-test/", status_code=202)
 async def run_classification_test(
     test_case_id: int = Form(...),
     model_name: str = Form(...),
-    db: Session = Depends(get_db)
+    use_cache: bool = Form(True),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """运行分类任务测试"""
-    # 获取测试用例
-    test_case = db.query(TestCase).filter(TestCase.id == test_case_id).first()
+    """运行分类任务测试，测试进入后台队列，通过 /api/tasks/{task_id} 查询结果"""
+    _validate_test_case(await db.get(TestCase, test_case_id))
+    
+    return {"task_id": await enqueue_test(run_classification_task, test_case_id, model_name, use_cache)}
+
+def _validate_test_case(test_case: Optional[TestCase]) -> TestCase:
+    """校验测试用例存在且类型匹配"""
     if not test_case:
         raise HTTPException(status_code=404, detail="测试用例不存在")
     
     if test_case.task_type != "classification":
         raise HTTPException(status_code=400, detail="测试用例类型不匹配")
     
+    return test_case
+
+async def _execute_classification_test(
+    test_case: TestCase,
+    model_name: str,
+    classification_service: ClassificationService,
+    use_cache: bool = True
+) -> Dict[str, Any]:
+    """执行分类任务测试，返回待保存的测试结果字段；use_cache=False 时跳过缓存读取"""
+    start_time = time.time()
+    
     try:
-        start_time = time.time()
-        
-        # 初始化分类服务
-        classification_service = ClassificationService()
-        
         # 解析输入数据
-        input_data = ClassificationInput(**test_case.input_data)
+        input_data = ClassificationInput.model_validate(test_case.input_data)
         
         # 运行分类任务
-        result = await classification_service.classify(
-            text=input_data.text,
-            model_name=model_name,
-            labels=input_data.labels
-        )
+        with llm_cache_scope(use_cache) as cache:
+            result = await classification_service.classify(
+                text=input_data.text,
+                model_name=model_name,
+                labels=input_data.labels
+            )
         
-        execution_time = time.time() - start_time
+        # 命中缓存的结果不计入执行时间统计
+        execution_time = None if cache.hit else time.time() - start_time
         
         # 计算评估指标
         expected_output = ClassificationOutput(**test_case.expected_output)
-        metrics = classification_service.evaluate(result, expected_output)
-        
-        # 保存测试结果
-        test_result = TestResult(
-            test_case_id=test_case_id,
-            model_name=model_name,
-            actual_output=result.dict(),
-            score=metrics.get("accuracy", 0.0),
-            metrics=metrics,
-            execution_time=execution_time,
-            status="completed"
-        )
-        
-        db.add(test_result)
-        db.commit()
-        db.refresh(test_result)
+        metrics = {**classification_service.evaluate(result, expected_output), "cache_hit": cache.hit}
         
         return {
-            "test_result_id": test_result.id,
-            "result": result,
+            "test_case_id": test_case.id,
+            "task_type": test_case.task_type,
+            "model_name": model_name,
+            "actual_output": result.dict(),
+            "score": metrics.get("accuracy", 0.0),
             "metrics": metrics,
-            "execution_time": execution_time
+            "execution_time": execution_time,
+            "status": "completed",
+            "error_message": None
         }
         
     except Exception as e:
-        # 保存错误结果
-        test_result = TestResult(
-            test_case_id=test_case_id,
-            model_name=model_name,
-            actual_output={},
-            status="failed",
-            error_message=str(e),
-            execution_time=time.time() - start_time
-        )
-        
-        db.add(test_result)
-        db.commit()
-        
-        raise HTTPException(status_code=500, detail=f"测试执行失败: {str(e)}")
+        # 记录错误结果
+        return {
+            "test_case_id": test_case.id,
+            "task_type": test_case.task_type,
+            "model_name": model_name,
+            "actual_output": {},
+            "score": None,
+            "metrics": None,
+            "execution_time": time.time() - start_time,
+            "status": "failed",
+            "error_message": str(e)
+        }
+
+def _build_test_response(test_result_id: int, result_data: Dict[str, Any]) -> Dict[str, Any]:
+    """构建测试执行的响应数据"""
+    return {
+        "test_result_id": test_result_id,
+        "result": result_data["actual_output"],
+        "metrics": result_data["metrics"],
+        "execution_time": result_data["execution_time"]
+    }
 
 @router.post("/batch-test/")
 async def run_batch_classification_test(
     test_case_ids: List[int],
     model_names: List[str],
-    db: Session = Depends(get_db)
+    use_cache: bool = True,
+    db: AsyncSession = Depends(get_async_db),
+    classification_service: ClassificationService = Depends(get_classification_service)
 ):
     """批量运行分类任务测试"""
-    results = []
-    
-    for test_case_id in test_case_ids:
-        for model_name in model_names:
-            try:
-                result = await run_classification_test(test_case_id, model_name, db)
-                results.append({
-                    "test_case_id": test_case_id,
-                    "model_name": model_name,
-                    "status": "success",
-                    "result": result
-                })
-            except Exception as e:
-                results.append({
-                    "test_case_id": test_case_id,
-                    "model_name": model_name,
-                    "status": "failed",
-                    "error": str(e)
-                })
-    
-    return {"batch_results": results}
+    return await run_batch_test(
+        db, test_case_ids, model_names, _validate_test_case,
+        lambda test_case, model_name: _execute_classification_test(
+            test_case, model_name, classification_service, use_cache=use_cache
+        ),
+        _build_test_response
+    )
 
 @router.get("/results/{test_case_id}")
 async def get_classification_results(
     test_case_id: int,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """获取分类任务测试结果"""
-    results = db.query(TestResult).filter(
-        TestResult.test_case_id == test_case_id
-    ).all()
+    """获取分类任务测试结果摘要，只在数据库端取出需要展示的字段"""
+    results = await db.execute(
+        select(
+            TestResult.id,
+            TestResult.model_name,
+            TestResult.status,
+            TestResult.score,
+            TestResult.metrics["accuracy"].as_float().label("accuracy"),
+            TestResult.actual_output["predicted_label"].as_string().label("predicted_label"),
+            TestResult.execution_time,
+            TestResult.error_message,
+            TestResult.created_at
+        ).where(TestResult.test_case_id == test_case_id)
+    )
     
-    return {"test_case_id": test_case_id, "results": results}
+    return {"test_case_id": test_case_id, "results": [row._asdict() for row in results]}
+
+@router.get("/results/{test_case_id}/full")
+async def get_classification_results_full(
+    test_case_id: int,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """获取分类任务完整测试结果，包含模型输出和全部评估指标"""
+    results = await db.execute(
+        select(TestResult).where(TestResult.test_case_id == test_case_id)
+    )
+    
+    return {"test_case_id": test_case_id, "results": results.scalars().all()}
 
 @router.get("/models/performance")
 async def get_model_performance(
     task_type: str = "classification",
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """获取模型性能对比"""
-    # 查询所有分类任务的测试结果
-    results = db.query(TestResult).join(TestCase).filter(
-        TestCase.task_type == task_type,
-        TestResult.status == "completed"
-    ).all()
-    
-    # 按模型聚合性能数据
-    model_performance = {}
-    for result in results:
-        model_name = result.model_name
-        if model_name not in model_performance:
-            model_performance[model_name] = {
-                "total_tests": 0,
-                "avg_score": 0,
-                "avg_execution_time": 0,
-                "scores": []
-            }
-        
-        model_performance[model_name]["total_tests"] += 1
-        model_performance[model_name]["scores"].append(result.score or 0)
-        model_performance[model_name]["avg_execution_time"] += result.execution_time or 0
-    
-    # 计算平均值
-    for model_name, data in model_performance.items():
-        if data["total_tests"] > 0:
-            data["avg_score"] = sum(data["scores"]) / len(data["scores"])
-            data["avg_execution_time"] /= data["total_tests"]
+    # 在数据库中按模型聚合，只返回每个模型一行
+    results = await db.execute(
+        select(
+            TestResult.model_name,
+            func.count().label("total_tests"),
+            func.avg(func.coalesce(TestResult.score, 0)).label("avg_score"),
+            func.avg(func.coalesce(TestResult.execution_time, 0)).label("avg_execution_time")
+        ).where(
+            TestResult.task_type == task_type,
+            TestResult.status == "completed"
+        ).group_by(TestResult.model_name)
+    )
     
-    return model_performance
\ No newline at end of file
+    return {
+        row.model_name: {
+            "total_tests": row.total_tests,
+            "avg_score": row.avg_score,
+            "avg_execution_time": row.avg_execution_time
+        }
+        for row in results
+    }
\ No newline at end of file
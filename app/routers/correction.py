@@ -1,24 +1,35 @@
-from fastapi import APIRouter, Depends, HTTPException, Form
-from sqlalchemy.orm import Session
-from typing import List
+from fastapi import APIRouter, Depends, HTTPException, Form, Request
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import load_only
+from typing import List, Optional, Dict, Any
 import time
 
-from app.database import get_db
+from app.cache import invalidate_dashboard_cache
+from app.database import get_async_db
 from app.models.test_models import TestCase, TestResult
+from app.routers.batch import run_batch_test
 from app.schemas.test_schemas import (
     TestCase as TestCaseSchema,
     TestCaseCreate,
+    TestCaseListItem,
     CorrectionInput,
     CorrectionOutput
 )
+from app.services.cache_scope import llm_cache_scope
 from app.services.correction_service import CorrectionService
+from app.tasks import enqueue_test, run_correction_task
 
 router = APIRouter()
 
+def get_correction_service(request: Request) -> CorrectionService:
+    """获取应用启动时创建的共享CorrectionService实例"""
+    return request.app.state.correction_service
+
 @router.post("/test-cases/", response_model=TestCaseSchema)
 async def create_correction_test_case(
     test_case: TestCaseCreate,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """创建纠错任务测试用例"""
     if test_case.task_type != "correction":
@@ -26,79 +37,116 @@ async def create_correction_test_case(
     
     db_test_case = TestCase(**test_case.dict())
     db.add(db_test_case)
-    db.commit()
-    db.refresh(db_test_case)
+    await db.commit()
+    await invalidate_dashboard_cache()
+    await db.refresh(db_test_case)
     return db_test_case
 
-@router.get("/test-cases/", response_model=List[TestCaseSchema])
+@router.get("/test-cases/", response_model=List[TestCaseListItem])
 async def get_correction_test_cases(
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """获取纠错任务测试用例列表"""
-    test_cases = db.query(TestCase).filter(
-        TestCase.task_type == "correction",
-        TestCase.is_active == True
-    ).offset(skip).limit(limit).all()
-    return test_cases
+    result = await db.execute(
+        select(TestCase).options(
+            load_only(TestCase.id, TestCase.name, TestCase.description, TestCase.created_at)
+        ).where(
+            TestCase.task_type == "correction",
+            TestCase.is_active == True
+        ).order_by(TestCase.id).offset(skip).limit(limit)
+    )
+    return result.scalars().all()
 
 @router.post("/test-cases/{test_case_id}/run")
 async def run_correction_test(
     test_case_id: int,
     request_data: dict,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db),
+    correction_service: CorrectionService = Depends(get_correction_service)
 ):
     """运行纠错任务测试"""
     model_name = request_data.get("model_name")
     correction_mode = request_data.get("correction_mode", "balanced")
+    use_cache = request_data.get("use_cache", True)
     
     if not model_name:
         raise HTTPException(status_code=400, detail="缺少model_name参数")
         
-    return await _run_correction_test_internal(test_case_id, model_name, correction_mode, db)
+    return await _run_correction_test_internal(test_case_id, model_name, correction_mode, db, correction_service, use_cache)
 
-@router.post("/run-test/")
+@router.post("/run-test/", status_code=202)
 async def run_correction_test_form(
     test_case_id: int = Form(...),
     model_name: str = Form(...),
-    db: Session = Depends(get_db)
+    use_cache: bool = Form(True),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """运行纠错任务测试（表单方式）"""
-    return await _run_correction_test_internal(test_case_id, model_name, "balanced", db)
+    """运行纠错任务测试（表单方式），测试进入后台队列，通过 /api/tasks/{task_id} 查询结果"""
+    _validate_test_case(await db.get(TestCase, test_case_id))
+    
+    return {"task_id": await enqueue_test(run_correction_task, test_case_id, model_name, use_cache)}
 
 async def _run_correction_test_internal(
     test_case_id: int,
     model_name: str,
     correction_mode: str,
-    db: Session
+    db: AsyncSession,
+    correction_service: CorrectionService,
+    use_cache: bool = True
 ):
     """运行纠错任务测试"""
-    test_case = db.query(TestCase).filter(TestCase.id == test_case_id).first()
+    test_case = _validate_test_case(await db.get(TestCase, test_case_id))
+    
+    result_data = await _execute_correction_test(
+        test_case, model_name, correction_mode, correction_service, use_cache=use_cache
+    )
+    
+    test_result = TestResult(**result_data)
+    db.add(test_result)
+    await db.commit()
+    await invalidate_dashboard_cache()
+    
+    if result_data["status"] == "failed":
+        raise HTTPException(status_code=500, detail=f"测试执行失败: {result_data['error_message']}")
+    
+    await db.refresh(test_result)
+    return _build_test_response(test_result.id, result_data)
+
+def _validate_test_case(test_case: Optional[TestCase]) -> TestCase:
+    """校验测试用例存在且类型匹配"""
     if not test_case:
         raise HTTPException(status_code=404, detail="测试用例不存在")
     
     if test_case.task_type != "correction":
         raise HTTPException(status_code=400, detail="测试用例类型不匹配")
     
+    return test_case
+
+async def _execute_correction_test(
+    test_case: TestCase,
+    model_name: str,
+    correction_mode: str,
+    correction_service: CorrectionService,
+    use_cache: bool = True
+) -> Dict[str, Any]:
+    """执行纠错任务测试，返回待保存的测试结果字段；use_cache=False 时跳过缓存读取"""
+    start_time = time.time()
+    
     try:
-        start_time = time.time()
-        
-        correction_service = CorrectionService()
-        
-        # 适配我们的数据结构
-        input_data = CorrectionInput(
-            text=test_case.input_data.get("original_text"),
-            correction_type=test_case.input_data.get("error_type", "grammar")
-        )
+        # 输入模式通过字段别名适配我们的数据结构，直接校验保存的输入数据
+        input_data = CorrectionInput.model_validate(test_case.input_data)
         
-        result = await correction_service.correct(
-            text=input_data.text,
-            model_name=model_name,
-            correction_type=input_data.correction_type
-        )
+        with llm_cache_scope(use_cache) as cache:
+            result = await correction_service.correct(
+                text=input_data.text,
+                model_name=model_name,
+                correction_type=input_data.correction_type
+            )
         
-        execution_time = time.time() - start_time
+        # 命中缓存的结果不计入执行时间统计
+        execution_time = None if cache.hit else time.time() - start_time
         
         # 适配expected_output结构
         expected_output = CorrectionOutput(
@@ -106,69 +154,55 @@ async def _run_correction_test_internal(
             corrections=[],  # 这里可以根据需要填充
             confidence=test_case.expected_output.get("min_similarity", 0.8)
         )
-        metrics = correction_service.evaluate(result, expected_output)
-        
-        test_result = TestResult(
-            test_case_id=test_case_id,
-            model_name=model_name,
-            actual_output=result.dict(),
-            score=metrics.get("similarity_score", 0.0),
-            metrics=metrics,
-            execution_time=execution_time,
-            status="completed"
-        )
-        
-        db.add(test_result)
-        db.commit()
-        db.refresh(test_result)
+        metrics = {**correction_service.evaluate(result, expected_output), "cache_hit": cache.hit}
         
         return {
-            "test_result_id": test_result.id,
-            "result": result,
+            "test_case_id": test_case.id,
+            "task_type": test_case.task_type,
+            "model_name": model_name,
+            "actual_output": result.dict(),
+            "score": metrics.get("similarity_score", 0.0),
             "metrics": metrics,
-            "execution_time": execution_time
+            "execution_time": execution_time,
+            "status": "completed",
+            "error_message": None
         }
         
     except Exception as e:
-        test_result = TestResult(
-            test_case_id=test_case_id,
-            model_name=model_name,
-            actual_output={},
-            status="failed",
-            error_message=str(e),
-            execution_time=time.time() - start_time
-        )
-        
-        db.add(test_result)
-        db.commit()
-        
-        raise HTTPException(status_code=500, detail=f"测试执行失败: {str(e)}")
+        return {
+            "test_case_id": test_case.id,
+            "task_type": test_case.task_type,
+            "model_name": model_name,
+            "actual_output": {},
+            "score": None,
+            "metrics": None,
+            "execution_time": time.time() - start_time,
+            "status": "failed",
+            "error_message": str(e)
+        }
+
+def _build_test_response(test_result_id: int, result_data: Dict[str, Any]) -> Dict[str, Any]:
+    """构建测试执行的响应数据"""
+    return {
+        "test_result_id": test_result_id,
+        "result": result_data["actual_output"],
+        "metrics": result_data["metrics"],
+        "execution_time": result_data["execution_time"]
+    }
 
 @router.post("/batch-test/")
 async def run_batch_correction_test(
     test_case_ids: List[int],
     model_names: List[str],
-    db: Session = Depends(get_db)
+    use_cache: bool = True,
+    db: AsyncSession = Depends(get_async_db),
+    correction_service: CorrectionService = Depends(get_correction_service)
 ):
     """批量运行纠错任务测试"""
-    results = []
-    
-    for test_case_id in test_case_ids:
-        for model_name in model_names:
-            try:
-                result = await run_correction_test(test_case_id, model_name, db)
-                results.append({
-                    "test_case_id": test_case_id,
-                    "model_name": model_name,
-                    "status": "success",
-                    "result": result
-                })
-            except Exception as e:
-                results.append({
-                    "test_case_id": test_case_id,
-                    "model_name": model_name,
-                    "status": "failed",
-                    "error": str(e)
-                })
-    
-    return {"batch_results": results}
\ No newline at end of file
+    return await run_batch_test(
+        db, test_case_ids, model_names, _validate_test_case,
+        lambda test_case, model_name: _execute_correction_test(
+            test_case, model_name, "balanced", correction_service, use_cache=use_cache
+        ),
+        _build_test_response
+    )
@@ -1,84 +1,112 @@
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from sqlalchemy import func, desc
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import contains_eager
+from sqlalchemy import func, desc, select, and_, or_, lambda_stmt, union_all, literal_column, case
 from typing import List, Dict, Any
-import json
+import orjson
 from datetime import datetime, timedelta
 
-from app.database import get_db
-from app.models.test_models import TestCase, TestResult, TestSuite
+from app.cache import cached
+from app.database import AsyncSessionLocal, get_async_db
+from app.models.test_models import TestCase, TestResult, TestSuite, TestSuiteMember, mv_model_performance
 
 router = APIRouter()
 
-@router.get("/overview")
-async def get_dashboard_overview(db: Session = Depends(get_db)):
-    """获取仪表板概览数据"""
-    
-    # 统计各类任务的测试用例数量
-    task_stats = db.query(
-        TestCase.task_type,
+# 概览中的两个分组计数合并为一条 UNION ALL 查询，kind 列区分来源；
+# 语句结构固定，模块导入时用 lambda_stmt 构建一次，之后每次执行都命中语句缓存
+OVERVIEW_GROUP_STATS_STMT = lambda_stmt(lambda: union_all(
+    select(
+        literal_column("'task'").label('kind'),
+        TestCase.task_type.label('key'),
         func.count(TestCase.id).label('count')
-    ).filter(TestCase.is_active == True).group_by(TestCase.task_type).all()
-    
-    # 统计测试结果
-    result_stats = db.query(
-        TestResult.status,
+    ).where(TestCase.is_active == True).group_by(TestCase.task_type),
+    select(
+        literal_column("'status'").label('kind'),
+        TestResult.status.label('key'),
         func.count(TestResult.id).label('count')
-    ).group_by(TestResult.status).all()
+    ).group_by(TestResult.status)
+))
+
+@router.get("/overview")
+@cached(prefix="dashboard:overview", ttl=60)
+async def get_dashboard_overview(db: AsyncSession = Depends(get_async_db)):
+    """获取仪表板概览数据，共两次数据库往返"""
+    
+    # 统计各类任务的测试用例数量和测试结果状态
+    task_statistics = {}
+    result_statistics = {}
+    for item in await db.execute(OVERVIEW_GROUP_STATS_STMT):
+        if item.kind == 'task':
+            task_statistics[item.key] = item.count
+        else:
+            result_statistics[item.key] = item.count
     
-    # 最近7天的测试活动
+    # 最近7天的测试数量、平均执行时间和平均分数在同一行中返回，AVG 会忽略NULL；
+    # 闭包中的时间作为绑定参数传入，不影响语句缓存
     seven_days_ago = datetime.utcnow() - timedelta(days=7)
-    recent_tests = db.query(func.count(TestResult.id)).filter(
-        TestResult.created_at >= seven_days_ago
-    ).scalar()
-    
-    # 平均执行时间
-    avg_execution_time = db.query(func.avg(TestResult.execution_time)).filter(
-        TestResult.execution_time.isnot(None)
-    ).scalar()
-    
-    # 平均分数
-    avg_score = db.query(func.avg(TestResult.score)).filter(
-        TestResult.score.isnot(None)
-    ).scalar()
+    summary = (await db.execute(lambda_stmt(lambda: select(
+        func.count(case((TestResult.created_at >= seven_days_ago, TestResult.id))).label('recent_tests'),
+        func.avg(TestResult.execution_time).label('avg_execution_time'),
+        func.avg(TestResult.score).label('avg_score')
+    )))).one()
     
     return {
-        "task_statistics": {item.task_type: item.count for item in task_stats},
-        "result_statistics": {item.status: item.count for item in result_stats},
-        "recent_tests_count": recent_tests or 0,
-        "average_execution_time": float(avg_execution_time) if avg_execution_time else 0.0,
-        "average_score": float(avg_score) if avg_score else 0.0
+        "task_statistics": task_statistics,
+        "result_statistics": result_statistics,
+        "recent_tests_count": summary.recent_tests or 0,
+        "average_execution_time": float(summary.avg_execution_time) if summary.avg_execution_time else 0.0,
+        "average_score": float(summary.avg_score) if summary.avg_score else 0.0
     }
 
 @router.get("/model-performance")
+@cached(prefix="dashboard:model-performance", ttl=120)
 async def get_model_performance(
     task_type: str = None,
     limit: int = 10,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """获取模型性能对比"""
     
-    query = db.query(
-        TestResult.model_name,
-        func.count(TestResult.id).label('total_tests'),
-        func.avg(TestResult.score).label('avg_score'),
-        func.avg(TestResult.execution_time).label('avg_execution_time'),
-        func.count(func.nullif(TestResult.status == 'completed', False)).label('success_count')
-    ).filter(TestResult.score.isnot(None))
-    
-    if task_type:
-        query = query.join(TestCase).filter(TestCase.task_type == task_type)
+    if db.bind.dialect.name == "postgresql":
+        # PostgreSQL上读取定时刷新的物化视图，只需汇总每个模型/任务类型的一行
+        mv = mv_model_performance
+        stmt = lambda_stmt(lambda: select(
+            mv.c.model_name,
+            func.sum(mv.c.total_tests).label('total_tests'),
+            (func.sum(mv.c.score_sum) / func.sum(mv.c.total_tests)).label('avg_score'),
+            (func.sum(mv.c.execution_time_sum) / func.nullif(func.sum(mv.c.execution_time_count), 0)).label('avg_execution_time'),
+            func.sum(mv.c.success_count).label('success_count')
+        ))
+        
+        if task_type:
+            stmt += lambda s: s.where(mv.c.task_type == task_type)
+        
+        stmt += lambda s: s.group_by(mv.c.model_name)
+    else:
+        stmt = lambda_stmt(lambda: select(
+            TestResult.model_name,
+            func.count(TestResult.id).label('total_tests'),
+            func.avg(TestResult.score).label('avg_score'),
+            func.avg(TestResult.execution_time).label('avg_execution_time'),
+            func.count(func.nullif(TestResult.status == 'completed', False)).label('success_count')
+        ).where(TestResult.score.isnot(None)))
+        
+        if task_type:
+            stmt += lambda s: s.where(TestResult.task_type == task_type)
+        
+        stmt += lambda s: s.group_by(TestResult.model_name)
     
-    results = query.group_by(TestResult.model_name).order_by(
-        desc('avg_score')
-    ).limit(limit).all()
+    # task_type 和 limit 作为绑定参数，不同参数组合共用同一条缓存的语句
+    stmt += lambda s: s.order_by(desc('avg_score')).limit(limit)
+    results = (await db.execute(stmt)).all()
     
     performance_data = []
     for result in results:
-        success_rate = (result.success_count / result.total_tests) if result.total_tests > 0 else 0
+        success_rate = float(result.success_count / result.total_tests) if result.total_tests > 0 else 0
         performance_data.append({
             "model_name": result.model_name,
-            "total_tests": result.total_tests,
+            "total_tests": int(result.total_tests),
             "average_score": float(result.avg_score) if result.avg_score else 0.0,
             "average_execution_time": float(result.avg_execution_time) if result.avg_execution_time else 0.0,
             "success_rate": success_rate
@@ -89,51 +117,41 @@ async def get_model_performance(
 @router.get("/task-performance/{task_type}")
 async def get_task_performance(
     task_type: str,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """获取特定任务类型的性能数据"""
     
-    # 获取该任务类型的所有测试结果
-    results = db.query(TestResult).join(TestCase).filter(
-        TestCase.task_type == task_type,
+    # 在数据库中按模型聚合，只返回每个模型一行
+    results = (await db.execute(select(
+        TestResult.model_name,
+        func.count(TestResult.id).label('test_count'),
+        func.avg(TestResult.score).label('avg_score'),
+        func.min(TestResult.score).label('min_score'),
+        func.max(TestResult.score).label('max_score'),
+        func.avg(TestResult.execution_time).label('avg_execution_time'),
+        func.min(TestResult.execution_time).label('min_execution_time'),
+        func.max(TestResult.execution_time).label('max_execution_time')
+    ).where(
+        TestResult.task_type == task_type,
         TestResult.status == 'completed'
-    ).all()
+    ).group_by(TestResult.model_name))).all()
     
     if not results:
         return {"message": f"没有找到 {task_type} 任务的测试结果"}
     
-    # 按模型分组统计
-    model_stats = {}
-    for result in results:
-        model_name = result.model_name
-        if model_name not in model_stats:
-            model_stats[model_name] = {
-                "scores": [],
-                "execution_times": [],
-                "test_count": 0
-            }
-        
-        model_stats[model_name]["test_count"] += 1
-        if result.score is not None:
-            model_stats[model_name]["scores"].append(result.score)
-        if result.execution_time is not None:
-            model_stats[model_name]["execution_times"].append(result.execution_time)
-    
-    # 计算统计指标
-    performance_summary = {}
-    for model_name, stats in model_stats.items():
-        scores = stats["scores"]
-        times = stats["execution_times"]
-        
-        performance_summary[model_name] = {
-            "test_count": stats["test_count"],
-            "avg_score": sum(scores) / len(scores) if scores else 0,
-            "min_score": min(scores) if scores else 0,
-            "max_score": max(scores) if scores else 0,
-            "avg_execution_time": sum(times) / len(times) if times else 0,
-            "min_execution_time": min(times) if times else 0,
-            "max_execution_time": max(times) if times else 0
+    # AVG/MIN/MAX 会忽略NULL，某个模型没有分数或耗时记录时返回0
+    performance_summary = {
+        result.model_name: {
+            "test_count": result.test_count,
+            "avg_score": result.avg_score if result.avg_score is not None else 0,
+            "min_score": result.min_score if result.min_score is not None else 0,
+            "max_score": result.max_score if result.max_score is not None else 0,
+            "avg_execution_time": result.avg_execution_time if result.avg_execution_time is not None else 0,
+            "min_execution_time": result.min_execution_time if result.min_execution_time is not None else 0,
+            "max_execution_time": result.max_execution_time if result.max_execution_time is not None else 0
         }
+        for result in results
+    }
     
     return {
         "task_type": task_type,
@@ -144,132 +162,186 @@ async def get_task_performance(
 async def get_recent_tests(
     limit: int = 20,
     task_type: str = None,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """获取最近的测试结果"""
     
-    query = db.query(TestResult)
+    # 只查询列表需要的列，actual_output、metrics 等大字段不离开数据库；
+    # 测试用例信息在同一次查询中关联取出
+    stmt = lambda_stmt(lambda: select(
+        TestResult.id.label('test_result_id'),
+        TestResult.test_case_id,
+        func.coalesce(TestCase.name, 'Unknown').label('test_case_name'),
+        func.coalesce(TestResult.task_type, TestCase.task_type, 'Unknown').label('task_type'),
+        TestResult.model_name,
+        TestResult.score,
+        TestResult.status,
+        TestResult.execution_time,
+        TestResult.created_at
+    ).outerjoin(TestResult.test_case))
     
     if task_type:
-        # 只有在需要过滤任务类型时才进行JOIN
-        query = query.join(TestCase).filter(TestCase.task_type == task_type)
-    
-    recent_tests = query.order_by(desc(TestResult.created_at)).limit(limit).all()
-    
-    test_data = []
-    for test in recent_tests:
-        test_case = db.query(TestCase).filter(TestCase.id == test.test_case_id).first()
-        test_data.append({
-            "test_result_id": test.id,
-            "test_case_id": test.test_case_id,
-            "test_case_name": test_case.name if test_case else "Unknown",
-            "task_type": test_case.task_type if test_case else "Unknown",
-            "model_name": test.model_name,
-            "score": test.score,
-            "status": test.status,
-            "execution_time": test.execution_time,
-            "created_at": test.created_at
-        })
+        stmt += lambda s: s.where(TestResult.task_type == task_type)
+    
+    stmt += lambda s: s.order_by(desc(TestResult.created_at)).limit(limit)
+    test_data = [row._asdict() for row in await db.execute(stmt)]
     
     return {"recent_tests": test_data}
 
 @router.get("/test-trends")
+@cached(prefix="dashboard:trends", ttl=300)
 async def get_test_trends(
     days: int = 30,
     task_type: str = None,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """获取测试趋势数据"""
-    
-    start_date = datetime.utcnow() - timedelta(days=days)
-    
-    query = db.query(
-        func.date(TestResult.created_at).label('test_date'),
-        func.count(TestResult.id).label('test_count'),
-        func.avg(TestResult.score).label('avg_score')
-    ).filter(TestResult.created_at >= start_date)
-    
-    if task_type:
-        query = query.join(TestCase).filter(TestCase.task_type == task_type)
-    
-    trends = query.group_by(func.date(TestResult.created_at)).order_by('test_date').all()
-    
-    trend_data = []
-    for trend in trends:
-        trend_data.append({
-            "date": trend.test_date.isoformat(),
-            "test_count": trend.test_count,
-            "average_score": float(trend.avg_score) if trend.avg_score else 0.0
-        })
+    """获取测试趋势数据，按天返回从起始日期到今天的连续数据，没有测试的日期计数为0"""
+    
+    now = datetime.utcnow()
+    start_date = now - timedelta(days=days)
+    
+    if db.bind.dialect.name == "postgresql":
+        # PostgreSQL上用 generate_series 生成连续的日期序列，按时间范围关联测试结果，
+        # 一次查询即返回无缺口的趋势，关联条件可以使用 created_at 索引
+        day_series = select(func.generate_series(
+            func.date_trunc('day', start_date),
+            func.date_trunc('day', now),
+            literal_column("interval '1 day'")
+        ).label('day')).cte('days')
+        
+        join_condition = and_(
+            TestResult.created_at >= day_series.c.day,
+            TestResult.created_at < day_series.c.day + literal_column("interval '1 day'"),
+            TestResult.created_at >= start_date
+        )
+        if task_type:
+            join_condition = and_(join_condition, TestResult.task_type == task_type)
+        
+        trends = (await db.execute(select(
+            day_series.c.day.label('test_date'),
+            func.count(TestResult.id).label('test_count'),
+            func.avg(TestResult.score).label('avg_score')
+        ).select_from(day_series).outerjoin(TestResult, join_condition).group_by(
+            day_series.c.day
+        ).order_by(day_series.c.day))).all()
+        
+        trend_data = [
+            {
+                "date": trend.test_date.date().isoformat(),
+                "test_count": trend.test_count,
+                "average_score": float(trend.avg_score) if trend.avg_score else 0.0
+            }
+            for trend in trends
+        ]
+    else:
+        test_date = func.date(TestResult.created_at).label('test_date')
+        stmt = select(
+            test_date,
+            func.count(TestResult.id).label('test_count'),
+            func.avg(TestResult.score).label('avg_score')
+        ).where(TestResult.created_at >= start_date)
+        
+        if task_type:
+            stmt = stmt.where(TestResult.task_type == task_type)
+        
+        trends = (await db.execute(stmt.group_by(test_date).order_by(test_date))).all()
+        
+        # SQLite的 date() 返回字符串，其他数据库返回日期对象，统一为ISO日期字符串
+        buckets = {
+            trend.test_date if isinstance(trend.test_date, str) else trend.test_date.isoformat(): trend
+            for trend in trends
+        }
+        
+        trend_data = []
+        for offset in range((now.date() - start_date.date()).days + 1):
+            date_key = (start_date.date() + timedelta(days=offset)).isoformat()
+            trend = buckets.get(date_key)
+            trend_data.append({
+                "date": date_key,
+                "test_count": trend.test_count if trend else 0,
+                "average_score": float(trend.avg_score) if trend and trend.avg_score else 0.0
+            })
     
     return {"trends": trend_data}
 
+# 错误分类规则按优先级排列，在数据库中用 CASE 计算分类，只返回分组计数和需要展示的记录；
+# 统一先转小写再匹配，LIKE 在SQLite上不区分大小写、在PostgreSQL上区分，直接匹配会使两种数据库的分类不一致
+_error_message_lower = func.lower(TestResult.error_message)
+ERROR_TYPE = case(
+    (_error_message_lower.contains("api"), "API错误"),
+    (_error_message_lower.contains("timeout"), "超时错误"),
+    (_error_message_lower.contains("key"), "认证错误"),
+    (or_(_error_message_lower.contains("json"), _error_message_lower.contains("parse")), "解析错误"),
+    else_="其他错误"
+).label('error_type')
+
+FAILED_WITH_ERROR = (
+    TestResult.status == 'failed',
+    TestResult.error_message.isnot(None)
+)
+
 @router.get("/error-analysis")
 async def get_error_analysis(
     limit: int = 10,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """获取错误分析数据"""
     
-    # 获取失败的测试结果
-    failed_tests = db.query(TestResult).filter(
-        TestResult.status == 'failed',
-        TestResult.error_message.isnot(None)
-    ).order_by(desc(TestResult.created_at)).limit(limit * 2).all()
-    
-    # 分析错误类型
-    error_types = {}
-    error_details = []
-    
-    for test in failed_tests:
-        error_msg = test.error_message
-        
-        # 简单的错误分类
-        if "API" in error_msg or "api" in error_msg:
-            error_type = "API错误"
-        elif "timeout" in error_msg.lower():
-            error_type = "超时错误"
-        elif "key" in error_msg.lower():
-            error_type = "认证错误"
-        elif "json" in error_msg.lower() or "parse" in error_msg.lower():
-            error_type = "解析错误"
-        else:
-            error_type = "其他错误"
-        
-        error_types[error_type] = error_types.get(error_type, 0) + 1
-        
-        if len(error_details) < limit:
-            test_case = db.query(TestCase).filter(TestCase.id == test.test_case_id).first()
-            error_details.append({
-                "test_result_id": test.id,
-                "test_case_name": test_case.name if test_case else "Unknown",
-                "model_name": test.model_name,
-                "error_type": error_type,
-                "error_message": error_msg,
-                "created_at": test.created_at
-            })
+    # 按错误类型统计所有失败的测试结果；先在子查询中分类再分组，
+    # 避免 GROUP BY 中重复 CASE 表达式的绑定参数
+    classified = select(ERROR_TYPE).where(*FAILED_WITH_ERROR).subquery()
+    error_types = dict((await db.execute(
+        select(classified.c.error_type, func.count()).group_by(classified.c.error_type)
+    )).all())
+    
+    # 最近的失败记录，测试用例名称在同一次查询中关联取出
+    error_details = (await db.execute(select(
+        TestResult.id.label('test_result_id'),
+        func.coalesce(TestCase.name, 'Unknown').label('test_case_name'),
+        TestResult.model_name,
+        ERROR_TYPE,
+        TestResult.error_message,
+        TestResult.created_at
+    ).outerjoin(TestResult.test_case).where(
+        *FAILED_WITH_ERROR
+    ).order_by(desc(TestResult.created_at)).limit(limit))).all()
     
     return {
         "error_types": error_types,
-        "error_details": error_details
+        "error_details": [row._asdict() for row in error_details]
     }
 
 @router.get("/test-suites")
 async def get_test_suites(
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """获取测试套件列表"""
     
-    test_suites = db.query(TestSuite).filter(
+    # 只查询列表需要的列
+    test_suites = (await db.execute(select(
+        TestSuite.id,
+        TestSuite.name,
+        TestSuite.description,
+        TestSuite.task_type,
+        TestSuite.created_at,
+        TestSuite.updated_at
+    ).where(
         TestSuite.is_active == True
-    ).offset(skip).limit(limit).all()
+    ).offset(skip).limit(limit))).all()
+    
+    # 统计测试套件中的测试用例数量，在关联表上一次分组计数
+    counts = dict((await db.execute(select(
+        TestSuiteMember.suite_id,
+        func.count()
+    ).where(
+        TestSuiteMember.suite_id.in_([suite.id for suite in test_suites])
+    ).group_by(TestSuiteMember.suite_id))).all())
     
     suite_data = []
     for suite in test_suites:
-        # 统计测试套件中的测试用例数量
-        test_case_count = len(suite.test_case_ids) if suite.test_case_ids else 0
+        test_case_count = counts.get(suite.id, 0)
         
         suite_data.append({
             "id": suite.id,
@@ -283,60 +355,71 @@ async def get_test_suites(
     
     return {"test_suites": suite_data}
 
+# 导出时每批从数据库读取的行数
+EXPORT_BATCH_SIZE = 1000
+
 @router.post("/export-results")
 async def export_test_results(
     task_type: str = None,
     model_name: str = None,
     start_date: str = None,
-    end_date: str = None,
-    db: Session = Depends(get_db)
+    end_date: str = None
 ):
-    """导出测试结果"""
+    """导出测试结果，逐批从数据库读取并流式输出，内存占用与导出行数无关"""
     
-    query = db.query(TestResult).join(TestCase)
+    stmt = select(TestResult).join(TestResult.test_case).options(
+        contains_eager(TestResult.test_case)
+    )
     
     # 应用过滤条件
     if task_type:
-        query = query.filter(TestCase.task_type == task_type)
+        stmt = stmt.where(TestResult.task_type == task_type)
     
     if model_name:
-        query = query.filter(TestResult.model_name == model_name)
+        stmt = stmt.where(TestResult.model_name == model_name)
     
     if start_date:
         start_dt = datetime.fromisoformat(start_date)
-        query = query.filter(TestResult.created_at >= start_dt)
+        stmt = stmt.where(TestResult.created_at >= start_dt)
     
     if end_date:
         end_dt = datetime.fromisoformat(end_date)
-        query = query.filter(TestResult.created_at <= end_dt)
+        stmt = stmt.where(TestResult.created_at <= end_dt)
     
-    results = query.order_by(desc(TestResult.created_at)).all()
+    stmt = stmt.order_by(desc(TestResult.created_at)).execution_options(yield_per=EXPORT_BATCH_SIZE)
     
-    export_data = []
-    for result in results:
-        test_case = db.query(TestCase).filter(TestCase.id == result.test_case_id).first()
-        
-        export_data.append({
-            "test_result_id": result.id,
-            "test_case_id": result.test_case_id,
-            "test_case_name": test_case.name if test_case else "Unknown",
-            "task_type": test_case.task_type if test_case else "Unknown",
-            "model_name": result.model_name,
-            "score": result.score,
-            "metrics": result.metrics,
-            "execution_time": result.execution_time,
-            "status": result.status,
-            "error_message": result.error_message,
-            "created_at": result.created_at.isoformat()
-        })
+    filters_applied = {
+        "task_type": task_type,
+        "model_name": model_name,
+        "start_date": start_date,
+        "end_date": end_date
+    }
     
-    return {
-        "export_data": export_data,
-        "total_records": len(export_data),
-        "filters_applied": {
-            "task_type": task_type,
-            "model_name": model_name,
-            "start_date": start_date,
-            "end_date": end_date
-        }
-    }
\ No newline at end of file
+    async def generate():
+        # 响应结构与之前一次性返回时相同，total_records 在所有记录输出后才能确定
+        # 会话在生成器内打开：依赖注入的会话在部分FastAPI版本中会在响应开始发送前关闭
+        yield b'{"export_data":['
+        total_records = 0
+        async with AsyncSessionLocal() as db:
+            async for result in (await db.stream(stmt)).scalars():
+                test_case = result.test_case
+                
+                if total_records:
+                    yield b","
+                yield orjson.dumps({
+                    "test_result_id": result.id,
+                    "test_case_id": result.test_case_id,
+                    "test_case_name": test_case.name if test_case else "Unknown",
+                    "task_type": test_case.task_type if test_case else "Unknown",
+                    "model_name": result.model_name,
+                    "score": result.score,
+                    "metrics": result.metrics,
+                    "execution_time": result.execution_time,
+                    "status": result.status,
+                    "error_message": result.error_message,
+                    "created_at": result.created_at
+                })
+                total_records += 1
+        yield b'],"total_records":' + str(total_records).encode() + b',"filters_applied":' + orjson.dumps(filters_applied) + b"}"
+    
+    return StreamingResponse(generate(), media_type="application/json")
\ No newline at end of file
@@ -1,24 +1,33 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from typing import List
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional, Dict, Any
 import time
 
-from app.database import get_db
+from app.cache import invalidate_dashboard_cache
+from app.database import get_async_db
 from app.models.test_models import TestCase, TestResult
+from app.routers.batch import run_batch_test
 from app.schemas.test_schemas import (
     TestCase as TestCaseSchema,
     TestCaseCreate,
     DialogueInput,
     DialogueOutput
 )
+from app.services.cache_scope import llm_cache_scope
 from app.services.dialogue_service import DialogueService
 
 router = APIRouter()
 
+def get_dialogue_service(request: Request) -> DialogueService:
+    """获取应用启动时创建的共享DialogueService实例"""
+    return request.app.state.dialogue_service
+
 @router.post("/test-cases/", response_model=TestCaseSchema)
 async def create_dialogue_test_case(
     test_case: TestCaseCreate,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """创建对话任务测试用例"""
     if test_case.task_type != "dialogue":
@@ -26,83 +35,117 @@ async def create_dialogue_test_case(
     
     db_test_case = TestCase(**test_case.dict())
     db.add(db_test_case)
-    db.commit()
-    db.refresh(db_test_case)
+    await db.commit()
+    await invalidate_dashboard_cache()
+    await db.refresh(db_test_case)
     return db_test_case
 
 @router.get("/test-cases/", response_model=List[TestCaseSchema])
 async def get_dialogue_test_cases(
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """获取对话任务测试用例列表"""
-    test_cases = db.query(TestCase).filter(
-        TestCase.task_type == "dialogue",
-        TestCase.is_active == True
-    ).offset(skip).limit(limit).all()
-    return test_cases
+    result = await db.execute(
+        select(TestCase).where(
+            TestCase.task_type == "dialogue",
+            TestCase.is_active == True
+        ).offset(skip).limit(limit)
+    )
+    return result.scalars().all()
 
 @router.post("/test-cases/{test_case_id}/run")
 async def run_dialogue_test(
     test_case_id: int,
     request_data: dict,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db),
+    dialogue_service: DialogueService = Depends(get_dialogue_service)
 ):
     """运行对话任务测试"""
     model_name = request_data.get("model_name")
     temperature = request_data.get("temperature", 0.7)
     max_tokens = request_data.get("max_tokens", 150)
+    use_cache = request_data.get("use_cache", True)
     
     if not model_name:
         raise HTTPException(status_code=400, detail="缺少model_name参数")
         
-    return await _run_dialogue_test_internal(test_case_id, model_name, temperature, max_tokens, db)
+    return await _run_dialogue_test_internal(test_case_id, model_name, temperature, max_tokens, db, dialogue_service, use_cache)
 
 @router.post("/run-test/")
 async def run_dialogue_test_form(
     test_case_id: int,
     model_name: str,
-    db: Session = Depends(get_db)
+    use_cache: bool = True,
+    db: AsyncSession = Depends(get_async_db),
+    dialogue_service: DialogueService = Depends(get_dialogue_service)
 ):
     """运行对话任务测试（表单方式）"""
-    return await _run_dialogue_test_internal(test_case_id, model_name, 0.7, 150, db)
+    return await _run_dialogue_test_internal(test_case_id, model_name, 0.7, 150, db, dialogue_service, use_cache)
 
 async def _run_dialogue_test_internal(
     test_case_id: int,
     model_name: str,
     temperature: float,
     max_tokens: int,
-    db: Session
+    db: AsyncSession,
+    dialogue_service: DialogueService,
+    use_cache: bool = True
 ):
     """运行对话任务测试"""
-    test_case = db.query(TestCase).filter(TestCase.id == test_case_id).first()
+    test_case = _validate_test_case(await db.get(TestCase, test_case_id))
+    
+    result_data = await _execute_dialogue_test(
+        test_case, model_name, temperature, max_tokens, dialogue_service, use_cache=use_cache
+    )
+    
+    test_result = TestResult(**result_data)
+    db.add(test_result)
+    await db.commit()
+    await invalidate_dashboard_cache()
+    
+    if result_data["status"] == "failed":
+        raise HTTPException(status_code=500, detail=f"测试执行失败: {result_data['error_message']}")
+    
+    await db.refresh(test_result)
+    return _build_test_response(test_result.id, result_data)
+
+def _validate_test_case(test_case: Optional[TestCase]) -> TestCase:
+    """校验测试用例存在且类型匹配"""
     if not test_case:
         raise HTTPException(status_code=404, detail="测试用例不存在")
     
     if test_case.task_type != "dialogue":
         raise HTTPException(status_code=400, detail="测试用例类型不匹配")
     
+    return test_case
+
+async def _execute_dialogue_test(
+    test_case: TestCase,
+    model_name: str,
+    temperature: float,
+    max_tokens: int,
+    dialogue_service: DialogueService,
+    use_cache: bool = True
+) -> Dict[str, Any]:
+    """执行对话任务测试，返回待保存的测试结果字段；use_cache=False 时跳过缓存读取"""
+    start_time = time.time()
+    
     try:
-        start_time = time.time()
+        # 输入模式通过字段别名适配我们的数据结构，直接校验保存的输入数据
+        input_data = DialogueInput.model_validate(test_case.input_data)
         
-        dialogue_service = DialogueService()
+        with llm_cache_scope(use_cache) as cache:
+            result = await dialogue_service.generate_response(
+                message=input_data.message,
+                model_name=model_name,
+                context=input_data.context,
+                user_id=input_data.user_id
+            )
         
-        # 适配我们的数据结构
-        input_data = DialogueInput(
-            message=test_case.input_data.get("user_input"),
-            context=test_case.input_data.get("conversation_history"),
-            user_id=test_case.input_data.get("user_id")
-        )
-        
-        result = await dialogue_service.generate_response(
-            message=input_data.message,
-            model_name=model_name,
-            context=input_data.context,
-            user_id=input_data.user_id
-        )
-        
-        execution_time = time.time() - start_time
+        # 命中缓存的结果不计入执行时间统计
+        execution_time = None if cache.hit else time.time() - start_time
         
         # 适配expected_output结构
         expected_output = DialogueOutput(
@@ -110,83 +153,68 @@ async def _run_dialogue_test_internal(
             confidence=0.8,  # 默认置信度
             context_used=True
         )
-        metrics = dialogue_service.evaluate(result, expected_output)
-        
-        test_result = TestResult(
-            test_case_id=test_case_id,
-            model_name=model_name,
-            actual_output=result.dict(),
-            score=metrics.get("relevance_score", 0.0),
-            metrics=metrics,
-            execution_time=execution_time,
-            status="completed"
-        )
-        
-        db.add(test_result)
-        db.commit()
-        db.refresh(test_result)
+        metrics = {**dialogue_service.evaluate(result, expected_output), "cache_hit": cache.hit}
         
         return {
-            "test_result_id": test_result.id,
-            "result": result,
+            "test_case_id": test_case.id,
+            "task_type": test_case.task_type,
+            "model_name": model_name,
+            "actual_output": result.dict(),
+            "score": metrics.get("relevance_score", 0.0),
             "metrics": metrics,
-            "execution_time": execution_time
+            "execution_time": execution_time,
+            "status": "completed",
+            "error_message": None
         }
         
     except Exception as e:
-        test_result = TestResult(
-            test_case_id=test_case_id,
-            model_name=model_name,
-            actual_output={},
-            status="failed",
-            error_message=str(e),
-            execution_time=time.time() - start_time
-        )
-        
-        db.add(test_result)
-        db.commit()
-        
-        raise HTTPException(status_code=500, detail=f"测试执行失败: {str(e)}")
+        return {
+            "test_case_id": test_case.id,
+            "task_type": test_case.task_type,
+            "model_name": model_name,
+            "actual_output": {},
+            "score": None,
+            "metrics": None,
+            "execution_time": time.time() - start_time,
+            "status": "failed",
+            "error_message": str(e)
+        }
+
+def _build_test_response(test_result_id: int, result_data: Dict[str, Any]) -> Dict[str, Any]:
+    """构建测试执行的响应数据"""
+    return {
+        "test_result_id": test_result_id,
+        "result": result_data["actual_output"],
+        "metrics": result_data["metrics"],
+        "execution_time": result_data["execution_time"]
+    }
 
 @router.post("/batch-test/")
 async def run_batch_dialogue_test(
     test_case_ids: List[int],
     model_names: List[str],
-    db: Session = Depends(get_db)
+    use_cache: bool = True,
+    db: AsyncSession = Depends(get_async_db),
+    dialogue_service: DialogueService = Depends(get_dialogue_service)
 ):
     """批量运行对话任务测试"""
-    results = []
-    
-    for test_case_id in test_case_ids:
-        for model_name in model_names:
-            try:
-                result = await run_dialogue_test(test_case_id, model_name, db)
-                results.append({
-                    "test_case_id": test_case_id,
-                    "model_name": model_name,
-                    "status": "success",
-                    "result": result
-                })
-            except Exception as e:
-                results.append({
-                    "test_case_id": test_case_id,
-                    "model_name": model_name,
-                    "status": "failed",
-                    "error": str(e)
-                })
-    
-    return {"batch_results": results}
+    return await run_batch_test(
+        db, test_case_ids, model_names, _validate_test_case,
+        lambda test_case, model_name: _execute_dialogue_test(
+            test_case, model_name, 0.7, 150, dialogue_service, use_cache=use_cache
+        ),
+        _build_test_response
+    )
 
 @router.post("/interactive-test/")
 async def interactive_dialogue_test(
     model_name: str,
     message: str,
     context: List[dict] = None,
-    user_id: str = None
+    user_id: str = None,
+    dialogue_service: DialogueService = Depends(get_dialogue_service)
 ):
     """交互式对话测试"""
-    dialogue_service = DialogueService()
-    
     try:
         result = await dialogue_service.generate_response(
             message=message,
@@ -202,4 +230,33 @@ async def interactive_dialogue_test(
         }
         
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"对话生成失败: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"对话生成失败: {str(e)}")
+
+@router.post("/interactive-test/stream")
+async def interactive_dialogue_test_stream(
+    model_name: str,
+    message: str,
+    context: List[dict] = None,
+    user_id: str = None,
+    dialogue_service: DialogueService = Depends(get_dialogue_service)
+):
+    """交互式对话测试（流式返回响应文本）"""
+    chunks = dialogue_service.stream_response(
+        message=message,
+        model_name=model_name,
+        context=context,
+        user_id=user_id
+    )
+    
+    # 先取得第一段文本，调用失败时仍可返回错误状态码
+    try:
+        first_chunk = await anext(chunks, "")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"对话生成失败: {str(e)}")
+    
+    async def generate():
+        yield first_chunk
+        async for chunk in chunks:
+            yield chunk
+    
+    return StreamingResponse(generate(), media_type="text/plain; charset=utf-8")
@@ -1,24 +1,32 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from typing import List
+from fastapi import APIRouter, Depends, HTTPException, Request
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional, Dict, Any
 import time
 
-from app.database import get_db
+from app.cache import invalidate_dashboard_cache
+from app.database import get_async_db
 from app.models.test_models import TestCase, TestResult
+from app.routers.batch import run_batch_test
 from app.schemas.test_schemas import (
     TestCase as TestCaseSchema,
     TestCaseCreate,
     RAGInput,
     RAGOutput
 )
+from app.services.cache_scope import llm_cache_scope
 from app.services.rag_service import RAGService
 
 router = APIRouter()
 
+def get_rag_service(request: Request) -> RAGService:
+    """获取应用启动时创建的共享RAGService实例"""
+    return request.app.state.rag_service
+
 @router.post("/test-cases/", response_model=TestCaseSchema)
 async def create_rag_test_case(
     test_case: TestCaseCreate,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """创建RAG任务测试用例"""
     if test_case.task_type != "rag":
@@ -26,83 +34,119 @@ async def create_rag_test_case(
     
     db_test_case = TestCase(**test_case.dict())
     db.add(db_test_case)
-    db.commit()
-    db.refresh(db_test_case)
+    await db.commit()
+    await invalidate_dashboard_cache()
+    await db.refresh(db_test_case)
     return db_test_case
 
 @router.get("/test-cases/", response_model=List[TestCaseSchema])
 async def get_rag_test_cases(
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """获取RAG任务测试用例列表"""
-    test_cases = db.query(TestCase).filter(
-        TestCase.task_type == "rag",
-        TestCase.is_active == True
-    ).offset(skip).limit(limit).all()
-    return test_cases
+    result = await db.execute(
+        select(TestCase).where(
+            TestCase.task_type == "rag",
+            TestCase.is_active == True
+        ).offset(skip).limit(limit)
+    )
+    return result.scalars().all()
 
 @router.post("/test-cases/{test_case_id}/run")
 async def run_rag_test(
     test_case_id: int,
     request_data: dict,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db),
+    rag_service: RAGService = Depends(get_rag_service)
 ):
     """运行RAG任务测试"""
     model_name = request_data.get("model_name")
     embedding_model = request_data.get("embedding_model", "mock-embedding")
     retrieval_strategy = request_data.get("retrieval_strategy", "similarity")
+    use_cache = request_data.get("use_cache", True)
     
     if not model_name:
         raise HTTPException(status_code=400, detail="缺少model_name参数")
         
-    return await _run_rag_test_internal(test_case_id, model_name, embedding_model, retrieval_strategy, db)
+    return await _run_rag_test_internal(test_case_id, model_name, embedding_model, retrieval_strategy, db, rag_service, use_cache)
 
 @router.post("/run-test/")
 async def run_rag_test_form(
     test_case_id: int,
     model_name: str,
-    db: Session = Depends(get_db)
+    use_cache: bool = True,
+    db: AsyncSession = Depends(get_async_db),
+    rag_service: RAGService = Depends(get_rag_service)
 ):
     """运行RAG任务测试（表单方式）"""
-    return await _run_rag_test_internal(test_case_id, model_name, "mock-embedding", "similarity", db)
+    return await _run_rag_test_internal(
+        test_case_id, model_name, "mock-embedding", "similarity", db, rag_service, use_cache
+    )
 
 async def _run_rag_test_internal(
     test_case_id: int,
     model_name: str,
     embedding_model: str,
     retrieval_strategy: str,
-    db: Session
+    db: AsyncSession,
+    rag_service: RAGService,
+    use_cache: bool = True
 ):
     """运行RAG任务测试"""
-    test_case = db.query(TestCase).filter(TestCase.id == test_case_id).first()
+    test_case = _validate_test_case(await db.get(TestCase, test_case_id))
+    
+    result_data = await _execute_rag_test(
+        test_case, model_name, embedding_model, retrieval_strategy, rag_service, use_cache=use_cache
+    )
+    
+    test_result = TestResult(**result_data)
+    db.add(test_result)
+    await db.commit()
+    await invalidate_dashboard_cache()
+    
+    if result_data["status"] == "failed":
+        raise HTTPException(status_code=500, detail=f"测试执行失败: {result_data['error_message']}")
+    
+    await db.refresh(test_result)
+    return _build_test_response(test_result.id, result_data)
+
+def _validate_test_case(test_case: Optional[TestCase]) -> TestCase:
+    """校验测试用例存在且类型匹配"""
     if not test_case:
         raise HTTPException(status_code=404, detail="测试用例不存在")
     
     if test_case.task_type != "rag":
         raise HTTPException(status_code=400, detail="测试用例类型不匹配")
     
+    return test_case
+
+async def _execute_rag_test(
+    test_case: TestCase,
+    model_name: str,
+    embedding_model: str,
+    retrieval_strategy: str,
+    rag_service: RAGService,
+    use_cache: bool = True
+) -> Dict[str, Any]:
+    """执行RAG任务测试，返回待保存的测试结果字段；use_cache=False 时跳过缓存读取"""
+    start_time = time.time()
+    
     try:
-        start_time = time.time()
-        
-        rag_service = RAGService()
+        # 输入模式通过字段别名适配我们的数据结构，直接校验保存的输入数据
+        input_data = RAGInput.model_validate(test_case.input_data)
         
-        # 适配我们的数据结构
-        input_data = RAGInput(
-            query=test_case.input_data.get("query"),
-            documents=test_case.input_data.get("knowledge_base"),
-            top_k=test_case.input_data.get("top_k", 5)
-        )
-        
-        result = await rag_service.generate_answer(
-            query=input_data.query,
-            model_name=model_name,
-            documents=input_data.documents,
-            top_k=input_data.top_k
-        )
+        with llm_cache_scope(use_cache) as cache:
+            result = await rag_service.generate_answer(
+                query=input_data.query,
+                model_name=model_name,
+                documents=input_data.documents,
+                top_k=input_data.top_k
+            )
         
-        execution_time = time.time() - start_time
+        # 命中缓存的结果不计入执行时间统计
+        execution_time = None if cache.hit else time.time() - start_time
         
         # 适配expected_output结构
         expected_output = RAGOutput(
@@ -110,81 +154,66 @@ async def _run_rag_test_internal(
             retrieved_documents=[],  # 空的检索文档列表
             confidence=test_case.expected_output.get("min_relevance", 0.7)
         )
-        metrics = rag_service.evaluate(result, expected_output)
-        
-        test_result = TestResult(
-            test_case_id=test_case_id,
-            model_name=model_name,
-            actual_output=result.dict(),
-            score=metrics.get("answer_quality", 0.0),
-            metrics=metrics,
-            execution_time=execution_time,
-            status="completed"
-        )
-        
-        db.add(test_result)
-        db.commit()
-        db.refresh(test_result)
+        metrics = {**rag_service.evaluate(result, expected_output), "cache_hit": cache.hit}
         
         return {
-            "test_result_id": test_result.id,
-            "result": result,
+            "test_case_id": test_case.id,
+            "task_type": test_case.task_type,
+            "model_name": model_name,
+            "actual_output": result.dict(),
+            "score": metrics.get("answer_quality", 0.0),
             "metrics": metrics,
-            "execution_time": execution_time
+            "execution_time": execution_time,
+            "status": "completed",
+            "error_message": None
         }
         
     except Exception as e:
-        test_result = TestResult(
-            test_case_id=test_case_id,
-            model_name=model_name,
-            actual_output={},
-            status="failed",
-            error_message=str(e),
-            execution_time=time.time() - start_time
-        )
-        
-        db.add(test_result)
-        db.commit()
-        
-        raise HTTPException(status_code=500, detail=f"测试执行失败: {str(e)}")
+        return {
+            "test_case_id": test_case.id,
+            "task_type": test_case.task_type,
+            "model_name": model_name,
+            "actual_output": {},
+            "score": None,
+            "metrics": None,
+            "execution_time": time.time() - start_time,
+            "status": "failed",
+            "error_message": str(e)
+        }
+
+def _build_test_response(test_result_id: int, result_data: Dict[str, Any]) -> Dict[str, Any]:
+    """构建测试执行的响应数据"""
+    return {
+        "test_result_id": test_result_id,
+        "result": result_data["actual_output"],
+        "metrics": result_data["metrics"],
+        "execution_time": result_data["execution_time"]
+    }
 
 @router.post("/batch-test/")
 async def run_batch_rag_test(
     test_case_ids: List[int],
     model_names: List[str],
-    db: Session = Depends(get_db)
+    use_cache: bool = True,
+    db: AsyncSession = Depends(get_async_db),
+    rag_service: RAGService = Depends(get_rag_service)
 ):
     """批量运行RAG任务测试"""
-    results = []
-    
-    for test_case_id in test_case_ids:
-        for model_name in model_names:
-            try:
-                result = await run_rag_test(test_case_id, model_name, db)
-                results.append({
-                    "test_case_id": test_case_id,
-                    "model_name": model_name,
-                    "status": "success",
-                    "result": result
-                })
-            except Exception as e:
-                results.append({
-                    "test_case_id": test_case_id,
-                    "model_name": model_name,
-                    "status": "failed",
-                    "error": str(e)
-                })
-    
-    return {"batch_results": results}
+    return await run_batch_test(
+        db, test_case_ids, model_names, _validate_test_case,
+        lambda test_case, model_name: _execute_rag_test(
+            test_case, model_name, "mock-embedding", "similarity", rag_service, use_cache=use_cache
+        ),
+        _build_test_response
+    )
 
 @router.post("/upload-documents/")
 async def upload_documents(
     documents: List[str],
-    collection_name: str = "default"
+    collection_name: str = "default",
+    rag_service: RAGService = Depends(get_rag_service)
 ):
     """上传文档到向量数据库"""
-    rag_service = RAGService()
-    
     try:
         result = await rag_service.add_documents(documents, collection_name)
         return {
@@ -199,11 +228,10 @@ async def upload_documents(
 async def search_documents(
     query: str,
     collection_name: str = "default",
-    top_k: int = 5
+    top_k: int = 5,
+    rag_service: RAGService = Depends(get_rag_service)
 ):
     """搜索相关文档"""
-    rag_service = RAGService()
-    
     try:
         results = await rag_service.search_documents(query, collection_name, top_k)
         return {
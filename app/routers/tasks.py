@@ -0,0 +1,18 @@
+import redis
+from fastapi import APIRouter, HTTPException
+
+from app.tasks import get_task_status
+
+router = APIRouter()
+
+@router.get("/{task_id}")
+def get_test_task(task_id: str):
+    """查询后台测试任务的状态和结果"""
+    try:
+        task_status = get_task_status(task_id)
+    except redis.RedisError:
+        raise HTTPException(status_code=503, detail="任务状态存储不可用，请稍后重试")
+    if not task_status:
+        raise HTTPException(status_code=404, detail="任务不存在或已过期")
+    
+    return task_status
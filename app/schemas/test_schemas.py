@@ -1,4 +1,4 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, ConfigDict, AliasChoices
 from typing import Optional, Dict, Any, List
 from datetime import datetime
 
@@ -25,8 +25,16 @@ class TestCase(TestCaseBase):
     updated_at: Optional[datetime]
     is_active: bool
 
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True, extra='ignore')
+
+class TestCaseListItem(BaseModel):
+    """测试用例列表项，不包含输入数据和期望输出"""
+    id: int
+    name: str
+    description: Optional[str] = None
+    created_at: datetime
+
+    model_config = ConfigDict(from_attributes=True, extra='ignore')
 
 class TestResultBase(BaseModel):
     test_case_id: int
@@ -45,8 +53,7 @@ class TestResult(TestResultBase):
     id: int
     created_at: datetime
 
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True, extra='ignore')
 
 class TestSuiteBase(BaseModel):
     name: str
@@ -69,8 +76,7 @@ class TestSuite(TestSuiteBase):
     updated_at: Optional[datetime]
     is_active: bool
 
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True, extra='ignore')
 
 class ModelBase(BaseModel):
     name: str
@@ -94,8 +100,7 @@ class Model(ModelBase):
     updated_at: Optional[datetime]
     is_active: bool
 
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True, extra='ignore')
 
 # 任务特定的模式
 class ClassificationInput(BaseModel):
@@ -108,8 +113,9 @@ class ClassificationOutput(BaseModel):
     probabilities: Optional[Dict[str, float]] = None
 
 class CorrectionInput(BaseModel):
-    text: str
-    correction_type: str = "grammar"  # grammar, spelling, style
+    # 同时接受前端表单保存的字段名，测试用例的 input_data 可直接校验
+    text: str = Field(..., validation_alias=AliasChoices("original_text", "text"))
+    correction_type: str = Field("grammar", validation_alias=AliasChoices("error_type", "correction_type"))  # grammar, spelling, style
 
 class CorrectionOutput(BaseModel):
     corrected_text: str
@@ -117,8 +123,9 @@ class CorrectionOutput(BaseModel):
     confidence: float
 
 class DialogueInput(BaseModel):
-    message: str
-    context: Optional[List[Dict[str, str]]] = None
+    # 同时接受前端表单保存的字段名，测试用例的 input_data 可直接校验
+    message: str = Field(..., validation_alias=AliasChoices("user_input", "message"))
+    context: Optional[List[Dict[str, str]]] = Field(None, validation_alias=AliasChoices("conversation_history", "context"))
     user_id: Optional[str] = None
 
 class DialogueOutput(BaseModel):
@@ -128,7 +135,8 @@ class DialogueOutput(BaseModel):
 
 class RAGInput(BaseModel):
     query: str
-    documents: Optional[List[str]] = None
+    # 同时接受前端表单保存的字段名，测试用例的 input_data 可直接校验
+    documents: Optional[List[str]] = Field(None, validation_alias=AliasChoices("knowledge_base", "documents"))
     top_k: int = 5
 
 class RAGOutput(BaseModel):
@@ -1,25 +1,135 @@
+from functools import lru_cache
+from statistics import fmean
+from typing import List, Optional, Dict, Any, Tuple
+import ast
+import asyncio
+import operator
 import os
-import openai
-import anthropic
-from typing import List, Optional, Dict, Any
-import json
-import requests
-import difflib
+import random
+import re
+import numpy as np
+import orjson
+from dotenv import load_dotenv
 from app.schemas.test_schemas import AgentInput, AgentOutput
+from app.services import embeddings
+from app.services.cache_scope import cache_reads_allowed, record_cache_hit
+from app.services.llm_clients import LLMClients, create_llm_clients
+from app.services.semantic_cache import semantic_cache
+from app.services.text_similarity import sequence_similarity
+
+# 可选导入
+try:
+    import tiktoken
+    TIKTOKEN_AVAILABLE = True
+except ImportError:
+    tiktoken = None
+    TIKTOKEN_AVAILABLE = False
+
+load_dotenv()
+
+# 用户消息中上下文JSON的token预算，超出部分截断
+AGENT_CONTEXT_TOKEN_BUDGET = int(os.getenv("AGENT_CONTEXT_TOKEN_BUDGET", 4000))
+
+# tiktoken 不认识的模型（如Claude）用该编码近似计数
+FALLBACK_ENCODING = "cl100k_base"
+
+CONTEXT_TRUNCATED_NOTE = "\n...（上下文过长，已截断）"
+
+# 模型响应中的工具调用标记
+_TOOL_CALL_RE = re.compile(r'\[TOOL_CALL\](.*?)\[/TOOL_CALL\]', re.DOTALL)
+TOOL_CALL_END = "[/TOOL_CALL]"
+
+# 短于该长度的文本直接比较字符串，句向量对过短的文本区分度不高
+MIN_EMBEDDING_SIMILARITY_LENGTH = 20
+
+# 计算器支持的运算符
+_BINARY_OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Pow: operator.pow
+}
+_UNARY_OPERATORS = {
+    ast.UAdd: operator.pos,
+    ast.USub: operator.neg
+}
+
+# 整数运算结果的位数上限，计算前先估算结果位数，避免嵌套乘方等超大整数运算耗尽CPU和内存
+_MAX_INTEGER_BITS = 4096
+
+@lru_cache(maxsize=None)
+def _get_encoding(model_name: str):
+    """返回模型对应的分词器，每个模型只加载一次；tiktoken 不可用时返回None"""
+    if not TIKTOKEN_AVAILABLE:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model_name)
+    except KeyError:
+        return tiktoken.get_encoding(FALLBACK_ENCODING)
+    except Exception:
+        return None
+
+@lru_cache(maxsize=256)
+def _truncate_to_budget(text: str, model_name: str, budget: int) -> str:
+    """把文本截断到不超过budget个token；没有分词器时按每个字符一个token保守估计"""
+    encoding = _get_encoding(model_name)
+    if encoding is None:
+        return text if len(text) <= budget else text[:budget] + CONTEXT_TRUNCATED_NOTE
+    
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= budget:
+        return text
+    return encoding.decode(tokens[:budget]) + CONTEXT_TRUNCATED_NOTE
+
+def _check_integer_size(op: ast.operator, left, right) -> None:
+    """估算整数乘法和乘方结果的位数，超过上限时在计算前拒绝；浮点运算溢出时会直接抛出 OverflowError"""
+    if type(left) is not int or type(right) is not int:
+        return
+    if isinstance(op, ast.Mult):
+        bits = left.bit_length() + right.bit_length()
+    elif isinstance(op, ast.Pow) and right > 0 and abs(left) > 1:
+        bits = left.bit_length() * right
+    else:
+        return
+    if bits > _MAX_INTEGER_BITS:
+        raise ValueError("计算结果过大")
+
+def _eval_node(node: ast.AST):
+    """只计算数字常量和四则运算、乘方，其余语法一律拒绝"""
+    if isinstance(node, ast.Constant) and type(node.value) in (int, float):
+        if type(node.value) is int and node.value.bit_length() > _MAX_INTEGER_BITS:
+            raise ValueError("数字过大")
+        return node.value
+    if isinstance(node, ast.BinOp) and type(node.op) in _BINARY_OPERATORS:
+        left, right = _eval_node(node.left), _eval_node(node.right)
+        _check_integer_size(node.op, left, right)
+        return _BINARY_OPERATORS[type(node.op)](left, right)
+    if isinstance(node, ast.UnaryOp) and type(node.op) in _UNARY_OPERATORS:
+        return _UNARY_OPERATORS[type(node.op)](_eval_node(node.operand))
+    raise ValueError("表达式包含不支持的运算")
+
+@lru_cache(maxsize=1024)
+def _safe_eval(expression: str):
+    """安全地计算数学表达式，相同的表达式只解析和计算一次"""
+    return _eval_node(ast.parse(expression.strip(), mode="eval").body)
 
 class AgentService:
-    def __init__(self):
-        self.openai_client = None
-        self.anthropic_client = None
-        
-        if os.getenv("OPENAI_API_KEY"):
-            openai.api_key = os.getenv("OPENAI_API_KEY")
-            self.openai_client = openai
-        
-        if os.getenv("ANTHROPIC_API_KEY"):
-            self.anthropic_client = anthropic.Anthropic(
-                api_key=os.getenv("ANTHROPIC_API_KEY")
-            )
+    # 工具描述，顺序与 available_tools 一致
+    TOOL_DESCRIPTIONS = {
+        "web_search": "搜索网络信息",
+        "calculator": "执行数学计算",
+        "text_analyzer": "分析文本内容",
+        "file_reader": "读取文件内容",
+        "api_caller": "调用外部API"
+    }
+    
+    def __init__(self, llm_clients: Optional[LLMClients] = None):
+        # 传入llm_clients时复用共享的连接池，否则按环境变量单独创建
+        llm_clients = llm_clients or create_llm_clients()
+        self.openai_client = llm_clients.openai_client
+        self.anthropic_client = llm_clients.anthropic_client
         
         # 定义可用工具
         self.available_tools = {
@@ -40,12 +150,33 @@ class AgentService:
         """执行Agent任务"""
         
         if model_name.startswith("gpt-"):
-            return await self._execute_openai(task, model_name, context, tools)
+            return await self._execute_cached(self._execute_openai, task, model_name, context, tools)
         elif model_name.startswith("claude-"):
-            return await self._execute_anthropic(task, model_name, context, tools)
+            return await self._execute_cached(self._execute_anthropic, task, model_name, context, tools)
         else:
             return await self._execute_mock(task, model_name, context, tools)
     
+    async def _execute_cached(
+        self,
+        execute_func,
+        task: str,
+        model_name: str,
+        context: Optional[Dict[str, Any]] = None,
+        tools: Optional[List[str]] = None
+    ) -> AgentOutput:
+        """语义相近的任务在同一模型、同一工具集合下复用已有的执行结果（返回值为共享对象，不要修改）"""
+        namespace = ("agent", model_name, tuple(tools) if tools else None)
+        prompt = self._build_user_message(task, model_name, context)
+        
+        cached = await semantic_cache.get(namespace, prompt) if cache_reads_allowed() else None
+        if cached is not None:
+            record_cache_hit()
+            return cached
+        
+        result = await execute_func(task, model_name, context, tools)
+        await semantic_cache.put(namespace, prompt, result)
+        return result
+    
     async def _execute_openai(
         self,
         task: str,
@@ -58,52 +189,56 @@ class AgentService:
             raise ValueError("OpenAI API key not configured")
         
         # 构建系统提示
-        system_prompt = self._build_system_prompt(tools)
+        system_prompt = self._build_system_prompt(tuple(tools) if tools else None)
         
         # 构建用户消息
-        user_message = self._build_user_message(task, context)
+        user_message = self._build_user_message(task, model_name, context)
         
-        actions_taken = []
         result = ""
         
         try:
-            # 第一步：分析任务并制定计划
-            response = await self.openai_client.ChatCompletion.acreate(
+            # 第一步：分析任务并制定计划，流式接收响应，每个工具调用块一结束就开始执行
+            stream = await self.openai_client.chat.completions.create(
                 model=model_name,
                 messages=[
                     {"role": "system", "content": system_prompt},
                     {"role": "user", "content": user_message}
                 ],
                 temperature=0.3,
-                max_tokens=1500
+                max_tokens=1500,
+                stream=True
             )
             
-            agent_response = response.choices[0].message.content
+            buffer = ""
+            scan_pos = 0
+            tool_tasks = []
             
-            # 解析Agent的响应，提取工具调用
-            tool_calls = self._parse_tool_calls(agent_response)
+            try:
+                async for chunk in stream:
+                    delta = chunk.choices[0].delta.content if chunk.choices else None
+                    if not delta:
+                        continue
+                    
+                    # 只有新内容可能补全结束标记时才重新查找
+                    check_from = max(scan_pos, len(buffer) - len(TOOL_CALL_END) + 1)
+                    buffer += delta
+                    if TOOL_CALL_END not in buffer[check_from:]:
+                        continue
+                    
+                    while (match := _TOOL_CALL_RE.search(buffer, scan_pos)):
+                        scan_pos = match.end()
+                        tool_call = self._load_tool_call(match.group(1))
+                        if tool_call is not None:
+                            tool_tasks.append(asyncio.create_task(self._run_tool_call(tool_call, tools)))
+            except BaseException:
+                for tool_task in tool_tasks:
+                    tool_task.cancel()
+                raise
             
-            # 执行工具调用
-            for tool_call in tool_calls:
-                tool_name = tool_call.get("tool")
-                tool_args = tool_call.get("args", {})
-                
-                if tool_name in self.available_tools and (not tools or tool_name in tools):
-                    try:
-                        tool_result = await self.available_tools[tool_name](**tool_args)
-                        actions_taken.append({
-                            "tool": tool_name,
-                            "args": tool_args,
-                            "result": tool_result,
-                            "status": "success"
-                        })
-                    except Exception as e:
-                        actions_taken.append({
-                            "tool": tool_name,
-                            "args": tool_args,
-                            "error": str(e),
-                            "status": "failed"
-                        })
+            agent_response = buffer
+            
+            # 等待所有工具调用完成，结果顺序与响应中的调用顺序一致
+            actions_taken = [action for action in await asyncio.gather(*tool_tasks) if action is not None]
             
             # 如果有工具调用结果，让Agent综合结果
             if actions_taken:
@@ -112,7 +247,7 @@ class AgentService:
                     for action in actions_taken
                 ])
                 
-                final_response = await self.openai_client.ChatCompletion.acreate(
+                final_response = await self.openai_client.chat.completions.create(
                     model=model_name,
                     messages=[
                         {"role": "system", "content": system_prompt},
@@ -151,47 +286,29 @@ class AgentService:
         if not self.anthropic_client:
             raise ValueError("Anthropic API key not configured")
         
-        system_prompt = self._build_system_prompt(tools)
-        user_message = self._build_user_message(task, context)
-        
-        full_prompt = f"{system_prompt}\n\n{user_message}"
-        
-        actions_taken = []
+        system_prompt = self._build_system_prompt(tuple(tools) if tools else None)
+        user_message = self._build_user_message(task, model_name, context)
         
         try:
+            # 缓存的系统提示直接作为system块传入，不再与用户消息拼接，相同工具组合的请求共享可缓存的前缀
             response = await self.anthropic_client.messages.create(
                 model=model_name,
                 max_tokens=1500,
+                system=[
+                    {"type": "text", "text": system_prompt, "cache_control": {"type": "ephemeral"}}
+                ],
                 messages=[
-                    {"role": "user", "content": full_prompt}
+                    {"role": "user", "content": user_message}
                 ]
             )
             
             agent_response = response.content[0].text
             
-            # 解析和执行工具调用
+            # 解析工具调用并并发执行，结果顺序与调用顺序一致
             tool_calls = self._parse_tool_calls(agent_response)
             
-            for tool_call in tool_calls:
-                tool_name = tool_call.get("tool")
-                tool_args = tool_call.get("args", {})
-                
-                if tool_name in self.available_tools and (not tools or tool_name in tools):
-                    try:
-                        tool_result = await self.available_tools[tool_name](**tool_args)
-                        actions_taken.append({
-                            "tool": tool_name,
-                            "args": tool_args,
-                            "result": tool_result,
-                            "status": "success"
-                        })
-                    except Exception as e:
-                        actions_taken.append({
-                            "tool": tool_name,
-                            "args": tool_args,
-                            "error": str(e),
-                            "status": "failed"
-                        })
+            actions = await asyncio.gather(*(self._run_tool_call(tool_call, tools) for tool_call in tool_calls))
+            actions_taken = [action for action in actions if action is not None]
             
             result = agent_response
             confidence = self._calculate_confidence(result, actions_taken)
@@ -213,8 +330,6 @@ class AgentService:
         tools: Optional[List[str]] = None
     ) -> AgentOutput:
         """模拟Agent任务执行（用于演示）"""
-        import random
-        
         actions_taken = []
         
         # 模拟使用一些工具
@@ -255,8 +370,10 @@ class AgentService:
             confidence=confidence
         )
     
-    def _build_system_prompt(self, tools: Optional[List[str]] = None) -> str:
-        """构建系统提示"""
+    @staticmethod
+    @lru_cache(maxsize=32)
+    def _build_system_prompt(tools: Optional[Tuple[str, ...]] = None) -> str:
+        """构建系统提示，相同的工具组合只构建一次"""
         
         base_prompt = """你是一个智能AI助手，能够使用各种工具来完成复杂任务。
 
@@ -270,11 +387,11 @@ class AgentService:
         
         if tools:
             for tool in tools:
-                if tool in self.available_tools:
-                    base_prompt += f"\n- {tool}: {self._get_tool_description(tool)}"
+                if tool in AgentService.TOOL_DESCRIPTIONS:
+                    base_prompt += f"\n- {tool}: {AgentService.TOOL_DESCRIPTIONS[tool]}"
         else:
-            for tool_name in self.available_tools:
-                base_prompt += f"\n- {tool_name}: {self._get_tool_description(tool_name)}"
+            for tool_name, description in AgentService.TOOL_DESCRIPTIONS.items():
+                base_prompt += f"\n- {tool_name}: {description}"
         
         base_prompt += """
 
@@ -292,13 +409,14 @@ class AgentService:
         
         return base_prompt
     
-    def _build_user_message(self, task: str, context: Optional[Dict[str, Any]] = None) -> str:
-        """构建用户消息"""
+    def _build_user_message(self, task: str, model_name: str, context: Optional[Dict[str, Any]] = None) -> str:
+        """构建用户消息，上下文超出token预算时截断"""
         
         message = f"任务: {task}"
         
         if context:
-            message += f"\n\n上下文信息:\n{json.dumps(context, ensure_ascii=False, indent=2)}"
+            context_json = orjson.dumps(context, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS).decode()
+            message += f"\n\n上下文信息:\n{_truncate_to_budget(context_json, model_name, AGENT_CONTEXT_TOKEN_BUDGET)}"
         
         message += "\n\n请分析这个任务，使用必要的工具，并给出详细的解决方案。"
         
@@ -310,31 +428,54 @@ class AgentService:
         tool_calls = []
         
         # 查找工具调用标记
-        import re
-        pattern = r'\[TOOL_CALL\](.*?)\[/TOOL_CALL\]'
-        matches = re.findall(pattern, response, re.DOTALL)
-        
-        for match in matches:
+        for match in _TOOL_CALL_RE.findall(response):
             try:
-                tool_call = json.loads(match.strip())
+                tool_call = orjson.loads(match.strip())
                 tool_calls.append(tool_call)
-            except json.JSONDecodeError:
+            except orjson.JSONDecodeError:
                 continue
         
         return tool_calls
     
+    def _load_tool_call(self, block: str) -> Optional[Dict[str, Any]]:
+        """解析单个工具调用块，不是合法JSON时返回None"""
+        try:
+            return orjson.loads(block.strip())
+        except orjson.JSONDecodeError:
+            return None
+    
+    async def _run_tool_call(
+        self,
+        tool_call: Dict[str, Any],
+        tools: Optional[List[str]] = None
+    ) -> Optional[Dict[str, Any]]:
+        """执行单个工具调用并返回动作记录，工具不存在或不在允许列表中时返回None"""
+        tool_name = tool_call.get("tool")
+        tool_args = tool_call.get("args", {})
+        
+        if tool_name not in self.available_tools or (tools and tool_name not in tools):
+            return None
+        
+        try:
+            tool_result = await self.available_tools[tool_name](**tool_args)
+            return {
+                "tool": tool_name,
+                "args": tool_args,
+                "result": tool_result,
+                "status": "success"
+            }
+        except Exception as e:
+            return {
+                "tool": tool_name,
+                "args": tool_args,
+                "error": str(e),
+                "status": "failed"
+            }
+    
     def _get_tool_description(self, tool_name: str) -> str:
         """获取工具描述"""
         
-        descriptions = {
-            "web_search": "搜索网络信息",
-            "calculator": "执行数学计算",
-            "text_analyzer": "分析文本内容",
-            "file_reader": "读取文件内容",
-            "api_caller": "调用外部API"
-        }
-        
-        return descriptions.get(tool_name, "未知工具")
+        return self.TOOL_DESCRIPTIONS.get(tool_name, "未知工具")
     
     def _calculate_confidence(self, result: str, actions_taken: List[Dict[str, Any]]) -> float:
         """计算置信度"""
@@ -343,7 +484,7 @@ class AgentService:
         
         # 基于工具使用情况调整置信度
         if actions_taken:
-            successful_actions = sum(1 for action in actions_taken if action.get("status") == "success")
+            successful_actions = [action.get("status") for action in actions_taken].count("success")
             total_actions = len(actions_taken)
             
             if total_actions > 0:
@@ -364,13 +505,9 @@ class AgentService:
     async def _calculator(self, expression: str) -> str:
         """计算器工具"""
         try:
-            # 安全的数学表达式计算
-            allowed_chars = set('0123456789+-*/.() ')
-            if all(c in allowed_chars for c in expression):
-                result = eval(expression)
-                return f"{expression} = {result}"
-            else:
-                return "表达式包含不允许的字符"
+            # 基于AST的白名单计算，不使用eval
+            result = _safe_eval(expression)
+            return f"{expression} = {result}"
         except Exception as e:
             return f"计算错误: {str(e)}"
     
@@ -413,9 +550,54 @@ class AgentService:
             expected.result
         )
         
+        return self._build_metrics(predicted, expected, task_completion_score)
+    
+    def batch_evaluate(
+        self,
+        predictions: List[AgentOutput],
+        expected: List[AgentOutput]
+    ) -> Dict[str, Any]:
+        """批量评估Agent执行结果，所有结果文本一次性编码"""
+        
+        if len(predictions) != len(expected):
+            raise ValueError("预测结果和期望结果数量不匹配")
+        
+        task_completion_scores = self._calculate_similarities(
+            [p.result for p in predictions],
+            [e.result for e in expected]
+        )
+        
+        metrics = [
+            self._build_metrics(p, e, score)
+            for p, e, score in zip(predictions, expected, task_completion_scores)
+        ]
+        
+        if not metrics:
+            return {
+                "avg_task_completion_score": 0.0,
+                "avg_tool_usage_score": 0.0,
+                "avg_confidence_diff": 0.0,
+                "total_samples": 0
+            }
+        
+        return {
+            "avg_task_completion_score": fmean(m["task_completion_score"] for m in metrics),
+            "avg_tool_usage_score": fmean(m["tool_usage_score"] for m in metrics),
+            "avg_confidence_diff": fmean(m["confidence_diff"] for m in metrics),
+            "total_samples": len(metrics)
+        }
+    
+    def _build_metrics(
+        self,
+        predicted: AgentOutput,
+        expected: AgentOutput,
+        task_completion_score: float
+    ) -> Dict[str, Any]:
+        """根据任务完成度和工具使用情况构建评估指标"""
+        
         # 工具使用评估
-        predicted_tools = set([action.get("tool") for action in predicted.actions_taken])
-        expected_tools = set([action.get("tool") for action in expected.actions_taken])
+        predicted_tools = {action.get("tool") for action in predicted.actions_taken}
+        expected_tools = {action.get("tool") for action in expected.actions_taken}
         
         tool_usage_score = 0.0
         if expected_tools:
@@ -443,8 +625,38 @@ class AgentService:
     
     def _calculate_similarity(self, text1: str, text2: str) -> float:
         """计算文本相似度"""
-        if text1 == text2:
-            return 1.0
+        return self._calculate_similarities([text1], [text2])[0]
+    
+    def _calculate_similarities(self, texts1: List[str], texts2: List[str]) -> List[float]:
+        """逐对计算文本相似度
+        
+        句向量模型可用时使用余弦相似度（语义改写不会拉低分数），需要编码的文本一次性批量编码；
+        完全相同或过短的文本、以及模型不可用时使用字符串相似度。
+        """
+        scores = [None] * len(texts1)
+        to_embed = []
+        
+        for i, (text1, text2) in enumerate(zip(texts1, texts2)):
+            if text1 == text2:
+                scores[i] = 1.0
+            elif min(len(text1), len(text2)) < MIN_EMBEDDING_SIMILARITY_LENGTH:
+                scores[i] = self._string_similarity(text1, text2)
+            else:
+                to_embed.append(i)
+        
+        if to_embed:
+            vectors = embeddings.encode([texts1[i] for i in to_embed] + [texts2[i] for i in to_embed])
+            if vectors is not None:
+                n = len(to_embed)
+                cosine = np.einsum("ij,ij->i", vectors[:n], vectors[n:])
+                for i, similarity in zip(to_embed, np.clip(cosine, 0.0, 1.0)):
+                    scores[i] = float(similarity)
+            else:
+                for i in to_embed:
+                    scores[i] = self._string_similarity(texts1[i], texts2[i])
         
-        matcher = difflib.SequenceMatcher(None, text1.lower(), text2.lower())
-        return matcher.ratio()
\ No newline at end of file
+        return scores
+    
+    def _string_similarity(self, text1: str, text2: str) -> float:
+        """字符串相似度"""
+        return sequence_similarity(text1.lower(), text2.lower())
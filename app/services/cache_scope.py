@@ -0,0 +1,40 @@
+"""
+测试执行期间的模型结果缓存控制
+
+测试执行函数用 llm_cache_scope(use_cache) 包住一次服务调用：use_cache=False 时各缓存跳过读取
+（新结果照常写入，相当于刷新缓存）；退出后 scope.hit 表示本次调用是否直接返回了缓存的结果，
+测试结果据此标记 cache_hit，且不计入执行时间统计。基于contextvars，批量测试中并发的调用互不影响。
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Iterator, Optional
+
+@dataclass
+class CacheScope:
+    use_cache: bool = True
+    hit: bool = False
+
+_current_scope: ContextVar[Optional[CacheScope]] = ContextVar("llm_cache_scope", default=None)
+
+@contextmanager
+def llm_cache_scope(use_cache: bool = True) -> Iterator[CacheScope]:
+    """在当前上下文中设置缓存读取开关并记录是否命中"""
+    scope = CacheScope(use_cache=use_cache)
+    token = _current_scope.set(scope)
+    try:
+        yield scope
+    finally:
+        _current_scope.reset(token)
+
+def cache_reads_allowed() -> bool:
+    """当前测试是否允许读取缓存，不在测试执行中（如交互式接口）时允许"""
+    scope = _current_scope.get()
+    return scope is None or scope.use_cache
+
+def record_cache_hit() -> None:
+    """缓存命中时由各缓存调用"""
+    scope = _current_scope.get()
+    if scope is not None:
+        scope.hit = True
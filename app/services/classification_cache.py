@@ -0,0 +1,149 @@
+"""
+分类结果的持久化缓存
+
+相同的 (模型, 标签集合, 文本) 在多次测试运行之间重复分类时直接返回上次的结果。
+结果保存在本地SQLite文件中（WAL模式），重启后仍然有效；读写出错时缓存自动关闭。
+条目超过 CLASSIFICATION_CACHE_TTL 秒后失效（同名模型的行为可能随版本更新而变化），打开缓存时清理过期条目。
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from typing import List, Optional
+
+import aiosqlite
+import orjson
+from dotenv import load_dotenv
+
+from app.schemas.test_schemas import ClassificationOutput
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+CLASSIFICATION_CACHE_ENABLED = os.getenv("CLASSIFICATION_CACHE_ENABLED", "1") == "1"
+CLASSIFICATION_CACHE_PATH = os.getenv("CLASSIFICATION_CACHE_PATH", "classification_cache.db")
+CLASSIFICATION_CACHE_TTL = int(os.getenv("CLASSIFICATION_CACHE_TTL", 7 * 24 * 60 * 60))
+
+CREATE_TABLE = """
+CREATE TABLE IF NOT EXISTS classification_cache (
+    key TEXT PRIMARY KEY,
+    predicted_label TEXT NOT NULL,
+    confidence REAL NOT NULL,
+    probabilities BLOB,
+    created_at REAL NOT NULL
+)
+"""
+
+class ClassificationResultCache:
+    """基于单个长连接的SQLite结果缓存，每个事件循环（应用进程或worker线程）使用各自的实例"""
+
+    def __init__(
+        self,
+        path: str = CLASSIFICATION_CACHE_PATH,
+        enabled: bool = CLASSIFICATION_CACHE_ENABLED,
+        ttl: int = CLASSIFICATION_CACHE_TTL
+    ):
+        self.path = path
+        self.enabled = enabled
+        self.ttl = ttl
+        self._connection: Optional[aiosqlite.Connection] = None
+        self._connect_lock = asyncio.Lock()
+
+    async def _get_connection(self) -> Optional[aiosqlite.Connection]:
+        """首次使用时打开连接并建表，失败时关闭缓存"""
+        if self._connection is None and self.enabled:
+            async with self._connect_lock:
+                if self._connection is None and self.enabled:
+                    try:
+                        connection = await aiosqlite.connect(self.path)
+                        await connection.execute("PRAGMA journal_mode=WAL")
+                        await connection.execute("PRAGMA synchronous=NORMAL")
+                        async with connection.execute("PRAGMA table_info(classification_cache)") as cursor:
+                            columns = {row[1] for row in await cursor.fetchall()}
+                        if columns and "created_at" not in columns:
+                            # 旧版缓存没有写入时间，无法判断是否过期，直接丢弃
+                            await connection.execute("DROP TABLE classification_cache")
+                        await connection.execute(CREATE_TABLE)
+                        await connection.execute(
+                            "DELETE FROM classification_cache WHERE created_at < ?", (time.time() - self.ttl,)
+                        )
+                        await connection.commit()
+                        self._connection = connection
+                    except (aiosqlite.Error, OSError) as e:
+                        logger.warning("分类结果缓存不可用，已关闭: %s", e)
+                        self.enabled = False
+        return self._connection
+
+    @staticmethod
+    def _key(text: str, model_name: str, labels: Optional[List[str]] = None) -> str:
+        payload = orjson.dumps([model_name, sorted(labels) if labels else None, text])
+        return hashlib.blake2b(payload, digest_size=16).hexdigest()
+
+    async def get(
+        self,
+        text: str,
+        model_name: str,
+        labels: Optional[List[str]] = None
+    ) -> Optional[ClassificationOutput]:
+        """读取缓存，未命中或出错时返回None"""
+        connection = await self._get_connection()
+        if connection is None:
+            return None
+
+        try:
+            async with connection.execute(
+                "SELECT predicted_label, confidence, probabilities FROM classification_cache "
+                "WHERE key = ? AND created_at >= ?",
+                (self._key(text, model_name, labels), time.time() - self.ttl)
+            ) as cursor:
+                row = await cursor.fetchone()
+        except aiosqlite.Error as e:
+            logger.warning("读取分类结果缓存失败: %s", e)
+            return None
+
+        if row is None:
+            return None
+
+        predicted_label, confidence, probabilities = row
+        return ClassificationOutput(
+            predicted_label=predicted_label,
+            confidence=confidence,
+            probabilities=orjson.loads(probabilities) if probabilities is not None else None
+        )
+
+    async def put(
+        self,
+        text: str,
+        model_name: str,
+        labels: Optional[List[str]],
+        result: ClassificationOutput
+    ) -> None:
+        """写入缓存"""
+        connection = await self._get_connection()
+        if connection is None:
+            return
+
+        try:
+            await connection.execute(
+                "INSERT OR REPLACE INTO classification_cache "
+                "(key, predicted_label, confidence, probabilities, created_at) VALUES (?, ?, ?, ?, ?)",
+                (
+                    self._key(text, model_name, labels),
+                    result.predicted_label,
+                    result.confidence,
+                    orjson.dumps(result.probabilities) if result.probabilities is not None else None,
+                    time.time()
+                )
+            )
+            await connection.commit()
+        except aiosqlite.Error as e:
+            logger.warning("写入分类结果缓存失败: %s", e)
+
+    async def close(self) -> None:
+        """关闭连接"""
+        if self._connection is not None:
+            await self._connection.close()
+            self._connection = None
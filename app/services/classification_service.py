@@ -1,27 +1,53 @@
-import os
-import openai
+from functools import lru_cache
+from typing import List, Optional, Dict, Any, Tuple, Union
+import asyncio
+import logging
+import random
 import anthropic
-from typing import List, Optional, Dict, Any
-import json
 import numpy as np
-from sklearn.metrics import accuracy_score, precision_recall_fscore_support
+import openai
+import orjson
 
 from app.schemas.test_schemas import ClassificationInput, ClassificationOutput
+from app.services import onnx_classifier
+from app.services.cache_scope import cache_reads_allowed, record_cache_hit
+from app.services.classification_cache import ClassificationResultCache
+from app.services.llm_clients import LLMClients, create_llm_clients
+from app.services.semantic_cache import semantic_cache
+
+logger = logging.getLogger(__name__)
+
+# classify_batch 在线调用时的默认并发数
+BATCH_CLASSIFY_CONCURRENCY = 16
+
+# 支持结构化输出（response_format=json_schema）的OpenAI模型前缀
+JSON_SCHEMA_MODEL_PREFIXES = ("gpt-4o", "gpt-4.1", "gpt-5")
+
+# Anthropic 通过强制调用该工具返回结构化的分类结果
+CLASSIFICATION_TOOL_NAME = "record_classification"
+
+# 轮询批处理任务状态的间隔（秒）
+BATCH_POLL_INTERVAL = 30
+
+# 触发供应商限流（429）时的重试次数和退避基数（秒），第n次重试前等待 基数 * 2^n 秒
+RATE_LIMIT_MAX_RETRIES = 3
+RATE_LIMIT_BACKOFF_BASE = 1.0
 
 class ClassificationService:
-    def __init__(self):
-        self.openai_client = None
-        self.anthropic_client = None
-        
-        # 初始化API客户端
-        if os.getenv("OPENAI_API_KEY"):
-            openai.api_key = os.getenv("OPENAI_API_KEY")
-            self.openai_client = openai
-        
-        if os.getenv("ANTHROPIC_API_KEY"):
-            self.anthropic_client = anthropic.Anthropic(
-                api_key=os.getenv("ANTHROPIC_API_KEY")
-            )
+    def __init__(self, llm_clients: Optional[LLMClients] = None):
+        # 传入llm_clients时复用共享的连接池，否则按环境变量单独创建
+        llm_clients = llm_clients or create_llm_clients()
+        self.openai_client = llm_clients.openai_client
+        self.anthropic_client = llm_clients.anthropic_client
+        self.openai_rate_limiter = llm_clients.openai_rate_limiter
+        self.anthropic_rate_limiter = llm_clients.anthropic_rate_limiter
+        
+        # 模型调用结果的持久化缓存，测试重跑时直接复用
+        self.result_cache = ClassificationResultCache()
+    
+    async def aclose(self) -> None:
+        """关闭结果缓存的数据库连接"""
+        await self.result_cache.close()
     
     async def classify(
         self,
@@ -32,14 +58,89 @@ class ClassificationService:
         """执行文本分类任务"""
         
         if model_name.startswith("gpt-"):
-            return await self._classify_openai(text, model_name, labels)
+            return await self._classify_cached(self._classify_openai, text, model_name, labels)
         elif model_name.startswith("claude-"):
-            return await self._classify_anthropic(text, model_name, labels)
+            return await self._classify_cached(self._classify_anthropic, text, model_name, labels)
         elif model_name.startswith("huggingface/"):
             return await self._classify_huggingface(text, model_name, labels)
         else:
             return await self._classify_mock(text, model_name, labels)
     
+    async def _classify_cached(
+        self,
+        classify_func,
+        text: str,
+        model_name: str,
+        labels: Optional[List[str]] = None
+    ) -> ClassificationOutput:
+        """语义相近的文本在同一模型、同一标签集合下复用已有的分类结果（返回值为共享对象，不要修改）"""
+        cached = await self._get_cached(text, model_name, labels)
+        if cached is not None:
+            return cached
+        
+        result = await self._call_rate_limited(classify_func, text, model_name, labels)
+        await self._put_cached(text, model_name, labels, result)
+        return result
+    
+    async def _call_rate_limited(
+        self,
+        classify_func,
+        text: str,
+        model_name: str,
+        labels: Optional[List[str]] = None
+    ) -> ClassificationOutput:
+        """按供应商的每分钟请求数限流调用模型，被限流（429）时指数退避后重试"""
+        if model_name.startswith("gpt-"):
+            provider, rate_limiter = "OpenAI", self.openai_rate_limiter
+        else:
+            provider, rate_limiter = "Anthropic", self.anthropic_rate_limiter
+        
+        for attempt in range(RATE_LIMIT_MAX_RETRIES + 1):
+            if rate_limiter:
+                await rate_limiter.acquire()
+            
+            try:
+                return await classify_func(text, model_name, labels)
+            except (openai.RateLimitError, anthropic.RateLimitError) as e:
+                if attempt == RATE_LIMIT_MAX_RETRIES:
+                    raise Exception(f"{provider}分类失败: {str(e)}")
+                await asyncio.sleep(RATE_LIMIT_BACKOFF_BASE * 2 ** attempt + random.uniform(0, RATE_LIMIT_BACKOFF_BASE))
+    
+    async def _get_cached(
+        self,
+        text: str,
+        model_name: str,
+        labels: Optional[List[str]] = None
+    ) -> Optional[ClassificationOutput]:
+        """依次查找内存中的语义缓存和磁盘上的结果缓存，测试要求跳过缓存时不读取"""
+        if not cache_reads_allowed():
+            return None
+        
+        namespace = ("classification", model_name, self._label_key(labels))
+        
+        cached = await semantic_cache.get(namespace, text)
+        if cached is None:
+            cached = await self.result_cache.get(text, model_name, labels)
+            if cached is not None:
+                await semantic_cache.put(namespace, text, cached)
+        
+        if cached is not None:
+            record_cache_hit()
+        return cached
+    
+    async def _put_cached(
+        self,
+        text: str,
+        model_name: str,
+        labels: Optional[List[str]],
+        result: ClassificationOutput
+    ) -> None:
+        """写入语义缓存和结果缓存"""
+        namespace = ("classification", model_name, self._label_key(labels))
+        
+        await semantic_cache.put(namespace, text, result)
+        await self.result_cache.put(text, model_name, labels, result)
+    
     async def _classify_openai(
         self,
         text: str,
@@ -50,52 +151,16 @@ class ClassificationService:
         if not self.openai_client:
             raise ValueError("OpenAI API key not configured")
         
-        # 构建提示词
-        if labels:
-            prompt = f"""请对以下文本进行分类，从给定的标签中选择最合适的一个：
-
-文本: {text}
-
-可选标签: {', '.join(labels)}
-
-请返回JSON格式的结果，包含predicted_label和confidence字段。"""
-        else:
-            prompt = f"""请对以下文本进行情感分析分类：
-
-文本: {text}
-
-请从以下标签中选择：positive, negative, neutral
-
-请返回JSON格式的结果，包含predicted_label和confidence字段。"""
-        
         try:
-            response = await self.openai_client.ChatCompletion.acreate(
-                model=model_name,
-                messages=[
-                    {"role": "system", "content": "你是一个专业的文本分类助手。"},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.1
+            response = await self.openai_client.chat.completions.create(
+                **self._openai_request_body(text, model_name, labels)
             )
             
-            result_text = response.choices[0].message.content
-            
-            # 尝试解析JSON结果
-            try:
-                result_json = json.loads(result_text)
-                predicted_label = result_json.get("predicted_label", "unknown")
-                confidence = result_json.get("confidence", 0.5)
-            except json.JSONDecodeError:
-                # 如果无法解析JSON，尝试从文本中提取标签
-                predicted_label = self._extract_label_from_text(result_text, labels)
-                confidence = 0.5
-            
-            return ClassificationOutput(
-                predicted_label=predicted_label,
-                confidence=confidence,
-                probabilities={predicted_label: confidence} if labels else None
-            )
+            return self._parse_openai_content(response.choices[0].message.content, labels)
             
+        except openai.RateLimitError:
+            # 由 _call_rate_limited 退避重试
+            raise
         except Exception as e:
             raise Exception(f"OpenAI分类失败: {str(e)}")
     
@@ -109,52 +174,328 @@ class ClassificationService:
         if not self.anthropic_client:
             raise ValueError("Anthropic API key not configured")
         
-        # 构建提示词
+        try:
+            response = await self.anthropic_client.messages.create(
+                **self._anthropic_request_params(text, model_name, labels)
+            )
+            
+            return self._parse_anthropic_content(response.content, labels)
+            
+        except anthropic.RateLimitError:
+            # 由 _call_rate_limited 退避重试
+            raise
+        except Exception as e:
+            raise Exception(f"Anthropic分类失败: {str(e)}")
+    
+    @staticmethod
+    def _label_key(labels: Optional[List[str]] = None) -> Optional[Tuple[str, ...]]:
+        """标签集合的规范形式，标签顺序不同的请求共用同一个提示词前缀和缓存"""
+        return tuple(sorted(labels)) if labels else None
+    
+    @staticmethod
+    @lru_cache(maxsize=256)
+    def _build_instructions(labels: Optional[Tuple[str, ...]] = None) -> str:
+        """构建分类指令，待分类文本不在其中，同一标签集合的请求共享完全相同的前缀以命中供应商的提示词缓存"""
         if labels:
-            prompt = f"""请对以下文本进行分类，从给定的标签中选择最合适的一个：
+            return f"""你是一个专业的文本分类助手。
 
-文本: {text}
+请对用户给出的文本进行分类，从给定的标签中选择最合适的一个。
 
 可选标签: {', '.join(labels)}
 
 请返回JSON格式的结果，包含predicted_label和confidence字段。"""
-        else:
-            prompt = f"""请对以下文本进行情感分析分类：
+        
+        return """你是一个专业的文本分类助手。
 
-文本: {text}
+请对用户给出的文本进行情感分析分类。
 
 请从以下标签中选择：positive, negative, neutral
 
 请返回JSON格式的结果，包含predicted_label和confidence字段。"""
+    
+    @staticmethod
+    @lru_cache(maxsize=256)
+    def _build_output_schema(labels: Optional[Tuple[str, ...]] = None) -> Dict[str, Any]:
+        """分类结果的JSON Schema，predicted_label 限定为可选标签（返回值为共享对象，不要修改）"""
+        return {
+            "type": "object",
+            "properties": {
+                "predicted_label": {
+                    "type": "string",
+                    "enum": list(labels) if labels else ["positive", "negative", "neutral"]
+                },
+                "confidence": {"type": "number"}
+            },
+            "required": ["predicted_label", "confidence"],
+            "additionalProperties": False
+        }
+    
+    @staticmethod
+    def _supports_json_schema(model_name: str) -> bool:
+        """是否支持结构化输出（json_schema），较早的模型只支持JSON模式"""
+        return model_name.startswith(JSON_SCHEMA_MODEL_PREFIXES)
+    
+    def _openai_request_body(
+        self,
+        text: str,
+        model_name: str,
+        labels: Optional[List[str]] = None
+    ) -> Dict[str, Any]:
+        """OpenAI chat completions 的请求参数，在线调用和Batch API共用；固定指令在前，待分类文本在最后"""
+        return {
+            "model": model_name,
+            "messages": [
+                {"role": "system", "content": self._build_instructions(self._label_key(labels))},
+                {"role": "user", "content": f"文本: {text}"}
+            ],
+            "temperature": 0.1,
+            "response_format": self._openai_response_format(model_name, labels)
+        }
+    
+    def _openai_response_format(self, model_name: str, labels: Optional[List[str]] = None) -> Dict[str, Any]:
+        """支持结构化输出的模型按JSON Schema约束输出，其余模型使用JSON模式保证返回合法JSON"""
+        if not self._supports_json_schema(model_name):
+            return {"type": "json_object"}
+        
+        return {
+            "type": "json_schema",
+            "json_schema": {
+                "name": "classification_result",
+                "strict": True,
+                "schema": self._build_output_schema(self._label_key(labels))
+            }
+        }
+    
+    def _anthropic_request_params(
+        self,
+        text: str,
+        model_name: str,
+        labels: Optional[List[str]] = None
+    ) -> Dict[str, Any]:
+        """Anthropic messages 的请求参数，在线调用和Message Batches共用；固定指令放在可缓存的system块中"""
+        return {
+            "model": model_name,
+            "max_tokens": 1000,
+            "system": [
+                {
+                    "type": "text",
+                    "text": self._build_instructions(self._label_key(labels)),
+                    "cache_control": {"type": "ephemeral"}
+                }
+            ],
+            "tools": [
+                {
+                    "name": CLASSIFICATION_TOOL_NAME,
+                    "description": "返回文本的分类结果",
+                    "input_schema": self._build_output_schema(self._label_key(labels))
+                }
+            ],
+            "tool_choice": {"type": "tool", "name": CLASSIFICATION_TOOL_NAME},
+            "messages": [
+                {"role": "user", "content": f"文本: {text}"}
+            ]
+        }
+    
+    def _parse_openai_content(self, content: str, labels: Optional[List[str]] = None) -> ClassificationOutput:
+        """解析OpenAI的返回内容，JSON模式下内容一定是合法的JSON"""
+        return self._parse_result(orjson.loads(content), labels)
+    
+    def _parse_anthropic_content(self, content: List[Any], labels: Optional[List[str]] = None) -> ClassificationOutput:
+        """从Anthropic返回的工具调用参数中读取分类结果"""
+        for block in content:
+            if block.type == "tool_use" and block.name == CLASSIFICATION_TOOL_NAME:
+                return self._parse_result(block.input, labels)
+        
+        raise ValueError("模型未返回分类结果")
+    
+    def _parse_result(self, result_json: Dict[str, Any], labels: Optional[List[str]] = None) -> ClassificationOutput:
+        """根据模型返回的结构化结果构建分类输出
+
+        JSON模式（json_object）下模型的输出不受标签集合约束：大小写或首尾空白不同的标签归一化为给定的标签，
+        其余不在标签集合中的结果记为 "unknown"、置信度为0，按预测错误计分。
+        """
+        predicted_label = result_json.get("predicted_label", "unknown")
+        confidence = result_json.get("confidence", 0.5)
+        
+        if labels and predicted_label not in labels:
+            normalized = str(predicted_label).strip().casefold()
+            matched = next((label for label in labels if label.strip().casefold() == normalized), None)
+            if matched is None:
+                logger.warning("模型返回的标签 %r 不在标签集合中，记为unknown", predicted_label)
+                predicted_label, confidence = "unknown", 0.0
+            else:
+                predicted_label = matched
+        
+        return ClassificationOutput(
+            predicted_label=predicted_label,
+            confidence=confidence,
+            probabilities={predicted_label: confidence} if labels else None
+        )
+    
+    async def classify_batch(
+        self,
+        texts: List[str],
+        model_name: str,
+        labels: Optional[List[str]] = None,
+        use_batch_api: bool = False,
+        max_concurrency: int = BATCH_CLASSIFY_CONCURRENCY
+    ) -> List[ClassificationOutput]:
+        """批量执行文本分类任务，结果顺序与texts一致
+        
+        use_batch_api=True 时 gpt-/claude- 模型通过供应商的批处理接口提交（费用减半，但可能需要数小时才完成），
+        否则以最多 max_concurrency 个并发请求在线调用。
+        """
+        is_batch_model = model_name.startswith("gpt-") or model_name.startswith("claude-")
+        
+        if not (use_batch_api and is_batch_model):
+            results = await self.classify_many([(text, labels) for text in texts], model_name, max_concurrency)
+            for result in results:
+                if isinstance(result, Exception):
+                    raise result
+            return results
+        
+        # 缓存命中的条目不再提交
+        results = [await self._get_cached(text, model_name, labels) for text in texts]
+        missing = [i for i, result in enumerate(results) if result is None]
+        
+        if missing:
+            if model_name.startswith("gpt-"):
+                outputs = await self._classify_openai_batch([texts[i] for i in missing], model_name, labels)
+            else:
+                outputs = await self._classify_anthropic_batch([texts[i] for i in missing], model_name, labels)
+            
+            for i, output in zip(missing, outputs):
+                # 批处理中失败的条目改用在线接口补齐
+                if output is None:
+                    output = await self.classify(texts[i], model_name, labels)
+                else:
+                    await self._put_cached(texts[i], model_name, labels, output)
+                results[i] = output
+        
+        return results
+    
+    async def classify_many(
+        self,
+        items: List[Tuple[str, Optional[List[str]]]],
+        model_name: str,
+        max_concurrency: int = BATCH_CLASSIFY_CONCURRENCY
+    ) -> List[Union[ClassificationOutput, Exception]]:
+        """并发在线分类多个 (文本, 标签) 条目，结果顺序与items一致，失败的条目返回对应的异常
+        
+        同时进行的请求不超过 max_concurrency 个，请求速率由各供应商共享的限流器控制。
+        """
+        semaphore = asyncio.Semaphore(max_concurrency)
+        
+        async def classify_one(text: str, labels: Optional[List[str]]) -> ClassificationOutput:
+            async with semaphore:
+                return await self.classify(text, model_name, labels)
+        
+        return list(await asyncio.gather(
+            *(classify_one(text, labels) for text, labels in items),
+            return_exceptions=True
+        ))
+    
+    async def _classify_openai_batch(
+        self,
+        texts: List[str],
+        model_name: str,
+        labels: Optional[List[str]] = None
+    ) -> List[Optional[ClassificationOutput]]:
+        """通过OpenAI Batch API批量分类，失败的条目返回None"""
+        if not self.openai_client:
+            raise ValueError("OpenAI API key not configured")
         
         try:
-            response = await self.anthropic_client.messages.create(
-                model=model_name,
-                max_tokens=1000,
-                messages=[
-                    {"role": "user", "content": prompt}
-                ]
+            request_lines = b"\n".join(
+                orjson.dumps({
+                    "custom_id": str(i),
+                    "method": "POST",
+                    "url": "/v1/chat/completions",
+                    "body": self._openai_request_body(text, model_name, labels)
+                })
+                for i, text in enumerate(texts)
+            )
+            
+            input_file = await self.openai_client.files.create(
+                file=("classification_batch.jsonl", request_lines, "application/jsonl"),
+                purpose="batch"
+            )
+            batch = await self.openai_client.batches.create(
+                input_file_id=input_file.id,
+                endpoint="/v1/chat/completions",
+                completion_window="24h"
             )
             
-            result_text = response.content[0].text
+            while batch.status not in ("completed", "failed", "expired", "cancelled"):
+                await asyncio.sleep(BATCH_POLL_INTERVAL)
+                batch = await self.openai_client.batches.retrieve(batch.id)
             
-            # 尝试解析JSON结果
-            try:
-                result_json = json.loads(result_text)
-                predicted_label = result_json.get("predicted_label", "unknown")
-                confidence = result_json.get("confidence", 0.5)
-            except json.JSONDecodeError:
-                predicted_label = self._extract_label_from_text(result_text, labels)
-                confidence = 0.5
+            if batch.status != "completed" or not batch.output_file_id:
+                raise Exception(f"批处理任务状态为 {batch.status}")
+            
+            output_file = await self.openai_client.files.content(batch.output_file_id)
             
-            return ClassificationOutput(
-                predicted_label=predicted_label,
-                confidence=confidence,
-                probabilities={predicted_label: confidence} if labels else None
+            results: List[Optional[ClassificationOutput]] = [None] * len(texts)
+            for line in output_file.text.splitlines():
+                if not line.strip():
+                    continue
+                
+                entry = orjson.loads(line)
+                response = entry.get("response") or {}
+                if entry.get("error") or response.get("status_code") != 200:
+                    continue
+                
+                try:
+                    results[int(entry["custom_id"])] = self._parse_openai_content(
+                        response["body"]["choices"][0]["message"]["content"], labels
+                    )
+                except (orjson.JSONDecodeError, TypeError):
+                    continue
+            
+            return results
+            
+        except Exception as e:
+            raise Exception(f"OpenAI批量分类失败: {str(e)}")
+    
+    async def _classify_anthropic_batch(
+        self,
+        texts: List[str],
+        model_name: str,
+        labels: Optional[List[str]] = None
+    ) -> List[Optional[ClassificationOutput]]:
+        """通过Anthropic Message Batches批量分类，失败的条目返回None"""
+        if not self.anthropic_client:
+            raise ValueError("Anthropic API key not configured")
+        
+        try:
+            batch = await self.anthropic_client.messages.batches.create(
+                requests=[
+                    {
+                        "custom_id": str(i),
+                        "params": self._anthropic_request_params(text, model_name, labels)
+                    }
+                    for i, text in enumerate(texts)
+                ]
             )
             
+            while batch.processing_status != "ended":
+                await asyncio.sleep(BATCH_POLL_INTERVAL)
+                batch = await self.anthropic_client.messages.batches.retrieve(batch.id)
+            
+            results: List[Optional[ClassificationOutput]] = [None] * len(texts)
+            async for entry in await self.anthropic_client.messages.batches.results(batch.id):
+                if entry.result.type != "succeeded":
+                    continue
+                
+                try:
+                    results[int(entry.custom_id)] = self._parse_anthropic_content(entry.result.message.content, labels)
+                except ValueError:
+                    continue
+            
+            return results
+            
         except Exception as e:
-            raise Exception(f"Anthropic分类失败: {str(e)}")
+            raise Exception(f"Anthropic批量分类失败: {str(e)}")
     
     async def _classify_huggingface(
         self,
@@ -162,10 +503,26 @@ class ClassificationService:
         model_name: str,
         labels: Optional[List[str]] = None
     ) -> ClassificationOutput:
-        """使用HuggingFace模型进行分类"""
-        # 这里可以集成HuggingFace的transformers库
-        # 为了演示，我们返回模拟结果
-        return await self._classify_mock(text, model_name, labels)
+        """使用HuggingFace模型进行分类，模型导出为ONNX并做int8量化后在本地推理"""
+        if not onnx_classifier.ONNXRUNTIME_AVAILABLE:
+            # 未安装 optimum[onnxruntime] 时返回模拟结果
+            return await self._classify_mock(text, model_name, labels)
+        
+        repo = model_name[len("huggingface/"):]
+        
+        try:
+            # 模型加载和推理都是CPU密集操作，放到线程池中执行
+            probabilities = await asyncio.to_thread(onnx_classifier.classify, repo, text, labels)
+        except Exception as e:
+            raise Exception(f"HuggingFace分类失败: {str(e)}")
+        
+        predicted_label = max(probabilities, key=probabilities.get)
+        
+        return ClassificationOutput(
+            predicted_label=predicted_label,
+            confidence=probabilities[predicted_label],
+            probabilities=probabilities
+        )
     
     async def _classify_mock(
         self,
@@ -174,8 +531,6 @@ class ClassificationService:
         labels: Optional[List[str]] = None
     ) -> ClassificationOutput:
         """模拟分类结果（用于演示）"""
-        import random
-        
         if labels:
             predicted_label = random.choice(labels)
         else:
@@ -198,24 +553,6 @@ class ClassificationService:
             probabilities=probabilities
         )
     
-    def _extract_label_from_text(self, text: str, labels: Optional[List[str]] = None) -> str:
-        """从文本中提取标签"""
-        text_lower = text.lower()
-        
-        if labels:
-            for label in labels:
-                if label.lower() in text_lower:
-                    return label
-            return labels[0]  # 默认返回第一个标签
-        else:
-            # 情感分析默认标签
-            if "positive" in text_lower or "积极" in text_lower:
-                return "positive"
-            elif "negative" in text_lower or "消极" in text_lower:
-                return "negative"
-            else:
-                return "neutral"
-    
     def evaluate(
         self,
         predicted: ClassificationOutput,
@@ -250,23 +587,41 @@ class ClassificationService:
         if len(predictions) != len(expected):
             raise ValueError("预测结果和期望结果数量不匹配")
         
-        predicted_labels = [p.predicted_label for p in predictions]
-        expected_labels = [e.predicted_label for e in expected]
+        n = len(predictions)
+        
+        # 标签统一编码为整数，前n个为期望标签，后n个为预测标签
+        classes, encoded = np.unique(
+            [e.predicted_label for e in expected] + [p.predicted_label for p in predictions],
+            return_inverse=True
+        )
+        expected_codes, predicted_codes = encoded[:n], encoded[n:]
+        n_classes = len(classes)
         
         # 计算准确率
-        accuracy = accuracy_score(expected_labels, predicted_labels)
+        correct = expected_codes == predicted_codes
+        accuracy = float(correct.mean())
         
-        # 计算精确率、召回率、F1分数
-        precision, recall, f1, support = precision_recall_fscore_support(
-            expected_labels, predicted_labels, average='weighted'
-        )
+        # 按类别统计TP/FP/FN，计算按支持度加权的精确率、召回率、F1分数（与sklearn的average='weighted'一致）
+        true_positive = np.bincount(expected_codes[correct], minlength=n_classes)
+        support = np.bincount(expected_codes, minlength=n_classes)
+        predicted_count = np.bincount(predicted_codes, minlength=n_classes)
+        
+        with np.errstate(divide="ignore", invalid="ignore"):
+            class_precision = np.where(predicted_count > 0, true_positive / predicted_count, 0.0)
+            class_recall = np.where(support > 0, true_positive / support, 0.0)
+            precision_recall_sum = class_precision + class_recall
+            class_f1 = np.where(
+                precision_recall_sum > 0, 2 * class_precision * class_recall / precision_recall_sum, 0.0
+            )
+        
+        precision = float(np.average(class_precision, weights=support))
+        recall = float(np.average(class_recall, weights=support))
+        f1 = float(np.average(class_f1, weights=support))
         
         # 计算置信度相关指标
-        confidence_diffs = [
-            abs(p.confidence - e.confidence) 
-            for p, e in zip(predictions, expected)
-        ]
-        avg_confidence_diff = np.mean(confidence_diffs)
+        predicted_confidence = np.fromiter((p.confidence for p in predictions), dtype=np.float64, count=n)
+        expected_confidence = np.fromiter((e.confidence for e in expected), dtype=np.float64, count=n)
+        avg_confidence_diff = float(np.abs(predicted_confidence - expected_confidence).mean())
         
         return {
             "accuracy": accuracy,
@@ -274,5 +629,5 @@ class ClassificationService:
             "recall": recall,
             "f1_score": f1,
             "avg_confidence_diff": avg_confidence_diff,
-            "total_samples": len(predictions)
-        }
\ No newline at end of file
+            "total_samples": n
+        }
@@ -1,24 +1,130 @@
-import os
-import openai
-import anthropic
-from typing import Dict, Any
-import json
+from itertools import accumulate
+from typing import Dict, Any, Optional
+import orjson
 import difflib
+import random
+import re
 from app.schemas.test_schemas import CorrectionInput, CorrectionOutput
+from app.services.llm_clients import LLMClients, create_llm_clients
+from app.services.response_cache import LLMResponseCache
+from app.services.text_similarity import sequence_similarity
+
+# 纠错结果按空白分词比较
+_WORD_RE = re.compile(r'\S+')
+
+# 纠错提示词：固定部分在前、待纠错文本在最后，相同纠错类型的请求前缀完全一致，可命中供应商的前缀缓存
+CORRECTION_SYSTEM_PROMPT = "你是一个专业的文本纠错助手。"
+
+CORRECTION_PROMPTS = {
+    "grammar": "请纠正以下文本的语法错误，保持原意不变：",
+    "spelling": "请纠正以下文本的拼写错误：",
+    "style": "请改善以下文本的表达风格，使其更加流畅自然："
+}
+
+CORRECTION_OUTPUT_FORMAT = """请返回JSON格式的结果，包含以下字段：
+- corrected_text: 纠错后的文本
+- corrections: 修改列表，每个修改包含original、corrected、type、position等信息
+- confidence: 纠错的置信度(0-1)"""
+
+# 模拟纠错使用的常见拼写错误，所有错误词合并为一个正则，一次扫描找出全部匹配
+MOCK_COMMON_ERRORS = {
+    "teh": "the",
+    "recieve": "receive",
+    "seperate": "separate",
+    "occured": "occurred"
+}
+_MOCK_ERRORS_RE = re.compile("|".join(
+    re.escape(wrong) for wrong in sorted(MOCK_COMMON_ERRORS, key=len, reverse=True)
+))
+
+def _build_correction_prompt(text: str, correction_type: str) -> str:
+    instruction = CORRECTION_PROMPTS.get(correction_type, CORRECTION_PROMPTS["grammar"])
+    return f"{instruction}\n\n{CORRECTION_OUTPUT_FORMAT}\n\n原文: {text}"
+
+def _find_json_object(text: str, start: int) -> int:
+    """从start处的 '{' 开始做括号匹配（跳过字符串中的括号），返回对象结束后的位置，不完整时返回-1"""
+    depth = 0
+    in_string = False
+    escaped = False
+    for i in range(start, len(text)):
+        char = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char == '{':
+            depth += 1
+        elif char == '}':
+            depth -= 1
+            if depth == 0:
+                return i + 1
+    return -1
+
+def _load_json_object(text: str) -> Dict[str, Any]:
+    """解析模型返回的JSON对象，整体不是JSON时（如包在markdown代码块或说明文字中）提取其中第一个完整的JSON对象"""
+    try:
+        result = orjson.loads(text)
+        if isinstance(result, dict):
+            return result
+    except orjson.JSONDecodeError:
+        pass
+    
+    start = text.find('{')
+    while start != -1:
+        end = _find_json_object(text, start)
+        if end == -1:
+            break
+        try:
+            result = orjson.loads(text[start:end])
+            if isinstance(result, dict):
+                return result
+        except orjson.JSONDecodeError:
+            pass
+        start = text.find('{', start + 1)
+    
+    raise orjson.JSONDecodeError("未找到JSON对象", text, 0)
+
+# JSON不完整（如被截断）时从回复中提取 corrected_text 字段的字符串值
+_CORRECTED_TEXT_FIELD_RE = re.compile(r'"corrected_text"\s*:\s*("(?:[^"\\]|\\.)*")')
+
+def _extract_corrected_text(result_text: str, original_text: str) -> str:
+    """回复中没有完整的JSON对象时提取纠错后的文本：先找 corrected_text 字段，再找“纠错后: ...”这样的行，都没有时返回原文"""
+    match = _CORRECTED_TEXT_FIELD_RE.search(result_text)
+    if match:
+        try:
+            return orjson.loads(match.group(1))
+        except orjson.JSONDecodeError:
+            pass
+    
+    for line in result_text.split('\n'):
+        if '纠错后' in line or 'corrected' in line.lower():
+            parts = re.split(r'[:：]', line, maxsplit=1)
+            if len(parts) > 1 and parts[1].strip():
+                return parts[1].strip()
+    
+    return original_text
 
 class CorrectionService:
-    def __init__(self):
-        self.openai_client = None
-        self.anthropic_client = None
+    def __init__(self, llm_clients: Optional[LLMClients] = None):
+        # 传入llm_clients时复用共享的连接池，否则按环境变量单独创建
+        self.llm_clients = llm_clients or create_llm_clients()
+        self.openai_client = self.llm_clients.openai_client
+        self.anthropic_client = self.llm_clients.anthropic_client
         
-        if os.getenv("OPENAI_API_KEY"):
-            openai.api_key = os.getenv("OPENAI_API_KEY")
-            self.openai_client = openai
+        # 相同输入的纠错结果直接复用，测试重跑时不再调用模型
+        self.response_cache = LLMResponseCache("correction")
         
-        if os.getenv("ANTHROPIC_API_KEY"):
-            self.anthropic_client = anthropic.Anthropic(
-                api_key=os.getenv("ANTHROPIC_API_KEY")
-            )
+        # 模型名前缀（第一个"-"之前的部分）-> 纠错实现，其余模型使用模拟结果
+        self._providers = {"gpt": self._correct_openai, "claude": self._correct_anthropic}
+    
+    async def aclose(self) -> None:
+        """关闭响应缓存的Redis连接"""
+        await self.response_cache.close()
     
     async def correct(
         self,
@@ -28,12 +134,30 @@ class CorrectionService:
     ) -> CorrectionOutput:
         """执行文本纠错任务"""
         
-        if model_name.startswith("gpt-"):
-            return await self._correct_openai(text, model_name, correction_type)
-        elif model_name.startswith("claude-"):
-            return await self._correct_anthropic(text, model_name, correction_type)
-        else:
+        provider, separator, _ = model_name.partition("-")
+        correct_func = self._providers.get(provider) if separator else None
+        if correct_func is None:
             return await self._correct_mock(text, model_name, correction_type)
+        
+        return await self._correct_cached(correct_func, text, model_name, correction_type)
+    
+    async def _correct_cached(
+        self,
+        correct_func,
+        text: str,
+        model_name: str,
+        correction_type: str
+    ) -> CorrectionOutput:
+        """相同模型、相同纠错类型下重复的文本直接复用已有的纠错结果"""
+        key = self.response_cache.key(model_name, correction_type, text)
+        
+        cached = await self.response_cache.get(key, CorrectionOutput)
+        if cached is not None:
+            return cached
+        
+        result = await correct_func(text, model_name, correction_type)
+        await self.response_cache.put(key, result)
+        return result
     
     async def _correct_openai(
         self,
@@ -45,49 +169,19 @@ class CorrectionService:
         if not self.openai_client:
             raise ValueError("OpenAI API key not configured")
         
-        correction_prompts = {
-            "grammar": "请纠正以下文本的语法错误，保持原意不变：",
-            "spelling": "请纠正以下文本的拼写错误：",
-            "style": "请改善以下文本的表达风格，使其更加流畅自然："
-        }
-        
-        prompt = f"""{correction_prompts.get(correction_type, correction_prompts['grammar'])}
-
-原文: {text}
-
-请返回JSON格式的结果，包含以下字段：
-- corrected_text: 纠错后的文本
-- corrections: 修改列表，每个修改包含original、corrected、type、position等信息
-- confidence: 纠错的置信度(0-1)"""
+        prompt = _build_correction_prompt(text, correction_type)
         
         try:
-            response = await self.openai_client.ChatCompletion.acreate(
+            response = await self.llm_clients.openai_chat(
                 model=model_name,
                 messages=[
-                    {"role": "system", "content": "你是一个专业的文本纠错助手。"},
+                    {"role": "system", "content": CORRECTION_SYSTEM_PROMPT},
                     {"role": "user", "content": prompt}
                 ],
                 temperature=0.1
             )
             
-            result_text = response.choices[0].message.content
-            
-            try:
-                result_json = json.loads(result_text)
-                corrected_text = result_json.get("corrected_text", text)
-                corrections = result_json.get("corrections", [])
-                confidence = result_json.get("confidence", 0.8)
-            except json.JSONDecodeError:
-                # 如果无法解析JSON，尝试从文本中提取纠错结果
-                corrected_text = self._extract_corrected_text(result_text, text)
-                corrections = self._generate_corrections(text, corrected_text)
-                confidence = 0.7
-            
-            return CorrectionOutput(
-                corrected_text=corrected_text,
-                corrections=corrections,
-                confidence=confidence
-            )
+            return self._parse_reply(response.choices[0].message.content, text)
             
         except Exception as e:
             raise Exception(f"OpenAI纠错失败: {str(e)}")
@@ -102,47 +196,19 @@ class CorrectionService:
         if not self.anthropic_client:
             raise ValueError("Anthropic API key not configured")
         
-        correction_prompts = {
-            "grammar": "请纠正以下文本的语法错误，保持原意不变：",
-            "spelling": "请纠正以下文本的拼写错误：",
-            "style": "请改善以下文本的表达风格，使其更加流畅自然："
-        }
-        
-        prompt = f"""{correction_prompts.get(correction_type, correction_prompts['grammar'])}
-
-原文: {text}
-
-请返回JSON格式的结果，包含以下字段：
-- corrected_text: 纠错后的文本
-- corrections: 修改列表
-- confidence: 纠错的置信度(0-1)"""
+        prompt = _build_correction_prompt(text, correction_type)
         
         try:
-            response = await self.anthropic_client.messages.create(
+            response = await self.llm_clients.anthropic_messages(
                 model=model_name,
                 max_tokens=1000,
+                system=CORRECTION_SYSTEM_PROMPT,
                 messages=[
                     {"role": "user", "content": prompt}
                 ]
             )
             
-            result_text = response.content[0].text
-            
-            try:
-                result_json = json.loads(result_text)
-                corrected_text = result_json.get("corrected_text", text)
-                corrections = result_json.get("corrections", [])
-                confidence = result_json.get("confidence", 0.8)
-            except json.JSONDecodeError:
-                corrected_text = self._extract_corrected_text(result_text, text)
-                corrections = self._generate_corrections(text, corrected_text)
-                confidence = 0.7
-            
-            return CorrectionOutput(
-                corrected_text=corrected_text,
-                corrections=corrections,
-                confidence=confidence
-            )
+            return self._parse_reply(response.content[0].text, text)
             
         except Exception as e:
             raise Exception(f"Anthropic纠错失败: {str(e)}")
@@ -154,30 +220,22 @@ class CorrectionService:
         correction_type: str
     ) -> CorrectionOutput:
         """模拟纠错结果（用于演示）"""
-        import random
-        
-        # 简单的模拟纠错
+        # 简单的模拟纠错：每种错误记录一次（不区分大小写，取第一次出现的位置）
         corrections = []
-        corrected_text = text
-        
-        # 模拟一些常见的纠错
-        common_errors = {
-            "teh": "the",
-            "recieve": "receive",
-            "seperate": "separate",
-            "occured": "occurred"
-        }
-        
-        for wrong, correct in common_errors.items():
-            if wrong in text.lower():
-                corrected_text = corrected_text.replace(wrong, correct)
+        seen = set()
+        for match in _MOCK_ERRORS_RE.finditer(text.lower()):
+            wrong = match.group()
+            if wrong not in seen:
+                seen.add(wrong)
                 corrections.append({
                     "original": wrong,
-                    "corrected": correct,
+                    "corrected": MOCK_COMMON_ERRORS[wrong],
                     "type": "spelling",
-                    "position": text.lower().find(wrong)
+                    "position": match.start()
                 })
         
+        corrected_text = _MOCK_ERRORS_RE.sub(lambda match: MOCK_COMMON_ERRORS[match.group()], text) if corrections else text
+        
         confidence = random.uniform(0.7, 0.95)
         
         return CorrectionOutput(
@@ -186,44 +244,69 @@ class CorrectionService:
             confidence=confidence
         )
     
-    def _extract_corrected_text(self, result_text: str, original_text: str) -> str:
-        """从结果文本中提取纠错后的文本"""
-        lines = result_text.split('\n')
-        for line in lines:
-            if '纠错后' in line or 'corrected' in line.lower():
-                # 尝试提取纠错后的文本
-                parts = line.split(':', 1)
-                if len(parts) > 1:
-                    return parts[1].strip()
+    def _parse_reply(self, result_text: str, text: str) -> CorrectionOutput:
+        """解析模型回复；回复中没有修改列表时根据纠错前后的文本生成"""
+        try:
+            result_json = _load_json_object(result_text)
+            corrected_text = result_json.get("corrected_text", text)
+            corrections = result_json.get("corrections")
+            if corrections is None:
+                corrections = self._generate_corrections(text, corrected_text)
+            confidence = result_json.get("confidence", 0.8)
+        except orjson.JSONDecodeError:
+            # 无法解析JSON时尽量从文本中提取纠错结果
+            corrected_text = _extract_corrected_text(result_text, text)
+            corrections = self._generate_corrections(text, corrected_text)
+            confidence = 0.7
         
-        return original_text  # 如果无法提取，返回原文
+        return CorrectionOutput(
+            corrected_text=corrected_text,
+            corrections=corrections,
+            confidence=confidence
+        )
     
     def _generate_corrections(self, original: str, corrected: str) -> list:
-        """生成修改列表"""
+        """生成修改列表：先按行比较，只在有改动的行内再按词比较"""
         corrections = []
         
-        # 使用difflib比较文本差异
-        diff = list(difflib.unified_diff(
-            original.split(),
-            corrected.split(),
-            lineterm=''
-        ))
+        original_lines = original.split('\n')
+        corrected_lines = corrected.split('\n')
+        line_offsets = list(accumulate((len(line) + 1 for line in original_lines[:-1]), initial=0))
         
-        for line in diff:
-            if line.startswith('-'):
-                # 删除的词
-                word = line[1:].strip()
-                if word:
+        line_matcher = difflib.SequenceMatcher(None, original_lines, corrected_lines)
+        for tag, i1, i2, j1, j2 in line_matcher.get_opcodes():
+            if tag == 'equal':
+                continue
+            
+            # 改动的行内逐词比较，删除的词记录其在原文中的位置
+            original_words = [
+                (line_offsets[i] + match.start(), match.group())
+                for i in range(i1, i2)
+                for match in _WORD_RE.finditer(original_lines[i])
+            ]
+            corrected_words = [
+                match.group()
+                for line in corrected_lines[j1:j2]
+                for match in _WORD_RE.finditer(line)
+            ]
+            
+            word_matcher = difflib.SequenceMatcher(
+                None, [word for _, word in original_words], corrected_words, autojunk=False
+            )
+            for word_tag, a1, a2, b1, b2 in word_matcher.get_opcodes():
+                if word_tag == 'equal':
+                    continue
+                
+                for position, word in original_words[a1:a2]:
+                    # 删除的词
                     corrections.append({
                         "original": word,
                         "corrected": "",
                         "type": "deletion",
-                        "position": original.find(word)
+                        "position": position
                     })
-            elif line.startswith('+'):
-                # 添加的词
-                word = line[1:].strip()
-                if word:
+                for word in corrected_words[b1:b2]:
+                    # 添加的词
                     corrections.append({
                         "original": "",
                         "corrected": word,
@@ -268,9 +351,4 @@ class CorrectionService:
     
     def _calculate_similarity(self, text1: str, text2: str) -> float:
         """计算两个文本的相似度"""
-        if text1 == text2:
-            return 1.0
-        
-        # 使用序列匹配器计算相似度
-        matcher = difflib.SequenceMatcher(None, text1, text2)
-        return matcher.ratio()
\ No newline at end of file
+        return sequence_similarity(text1, text2)
\ No newline at end of file
@@ -1,24 +1,35 @@
-import os
-import openai
-import anthropic
-from typing import List, Optional, Dict, Any
-import json
-import difflib
+from functools import lru_cache
+from typing import AsyncIterator, FrozenSet, List, Optional, Dict, Any, Tuple
+import random
 from app.schemas.test_schemas import DialogueInput, DialogueOutput
+from app.services.llm_clients import LLMClients, create_llm_clients
+from app.services.response_cache import LLMResponseCache
+from app.services.text_similarity import sequence_similarity
+
+# 对话系统提示词，所有请求共用同一前缀
+DIALOGUE_SYSTEM_PROMPT = "你是一个有用、友善、诚实的AI助手。请根据用户的问题提供准确、有帮助的回答。"
+
+@lru_cache(maxsize=4096)
+def _word_set(text: str) -> FrozenSet[str]:
+    """文本的小写词集合，重复出现的消息和对话历史只分词一次"""
+    return frozenset(text.lower().split())
 
 class DialogueService:
-    def __init__(self):
-        self.openai_client = None
-        self.anthropic_client = None
+    def __init__(self, llm_clients: Optional[LLMClients] = None):
+        # 传入llm_clients时复用共享的连接池，否则按环境变量单独创建
+        self.llm_clients = llm_clients or create_llm_clients()
+        self.openai_client = self.llm_clients.openai_client
+        self.anthropic_client = self.llm_clients.anthropic_client
         
-        if os.getenv("OPENAI_API_KEY"):
-            openai.api_key = os.getenv("OPENAI_API_KEY")
-            self.openai_client = openai
+        # 相同消息和对话历史的响应直接复用，测试重跑时不再调用模型
+        self.response_cache = LLMResponseCache("dialogue")
         
-        if os.getenv("ANTHROPIC_API_KEY"):
-            self.anthropic_client = anthropic.Anthropic(
-                api_key=os.getenv("ANTHROPIC_API_KEY")
-            )
+        # 模型名前缀（第一个"-"之前的部分）-> 生成实现，其余模型使用模拟结果
+        self._providers = {"gpt": self._generate_openai, "claude": self._generate_anthropic}
+    
+    async def aclose(self) -> None:
+        """关闭响应缓存的Redis连接"""
+        await self.response_cache.close()
     
     async def generate_response(
         self,
@@ -29,27 +40,96 @@ class DialogueService:
     ) -> DialogueOutput:
         """生成对话响应"""
         
-        if model_name.startswith("gpt-"):
-            return await self._generate_openai(message, model_name, context, user_id)
-        elif model_name.startswith("claude-"):
-            return await self._generate_anthropic(message, model_name, context, user_id)
-        else:
+        provider, separator, _ = model_name.partition("-")
+        generate_func = self._providers.get(provider) if separator else None
+        if generate_func is None:
             return await self._generate_mock(message, model_name, context, user_id)
+        
+        return await self._generate_cached(generate_func, message, model_name, context, user_id)
     
-    async def _generate_openai(
+    async def _generate_cached(
         self,
+        generate_func,
         message: str,
         model_name: str,
         context: Optional[List[Dict[str, str]]] = None,
         user_id: Optional[str] = None
     ) -> DialogueOutput:
-        """使用OpenAI模型生成对话响应"""
-        if not self.openai_client:
-            raise ValueError("OpenAI API key not configured")
+        """相同模型下消息和最近5轮对话历史都相同时直接复用已有的响应"""
+        key = self.response_cache.key(model_name, message, context[-5:] if context else None)
+        
+        cached = await self.response_cache.get(key, DialogueOutput)
+        if cached is not None:
+            return cached
+        
+        result = await generate_func(message, model_name, context, user_id)
+        await self.response_cache.put(key, result)
+        return result
+    
+    async def stream_response(
+        self,
+        message: str,
+        model_name: str,
+        context: Optional[List[Dict[str, str]]] = None,
+        user_id: Optional[str] = None
+    ) -> AsyncIterator[str]:
+        """流式生成对话响应，逐段返回文本；完整响应生成后写入响应缓存"""
+        provider, separator, _ = model_name.partition("-")
+        if not separator or provider not in self._providers:
+            result = await self._generate_mock(message, model_name, context, user_id)
+            yield result.response
+            return
+        
+        key = self.response_cache.key(model_name, message, context[-5:] if context else None)
+        cached = await self.response_cache.get(key, DialogueOutput)
+        if cached is not None:
+            yield cached.response
+            return
+        
+        if provider == "gpt":
+            if not self.openai_client:
+                raise ValueError("OpenAI API key not configured")
+            messages, context_used = self._build_openai_messages(message, context)
+            chunks = self.llm_clients.openai_chat_stream(
+                model=model_name,
+                messages=messages,
+                temperature=0.7,
+                max_tokens=1000
+            )
+        else:
+            if not self.anthropic_client:
+                raise ValueError("Anthropic API key not configured")
+            conversation_text, context_used = self._build_anthropic_conversation(message, context)
+            chunks = self.llm_clients.anthropic_messages_stream(
+                model=model_name,
+                max_tokens=1000,
+                system=DIALOGUE_SYSTEM_PROMPT,
+                messages=[
+                    {"role": "user", "content": conversation_text}
+                ]
+            )
+        
+        parts = []
+        async for chunk in chunks:
+            parts.append(chunk)
+            yield chunk
         
+        response_text = "".join(parts)
+        await self.response_cache.put(key, DialogueOutput(
+            response=response_text,
+            confidence=self._response_confidence(response_text),
+            context_used=context_used
+        ))
+    
+    @staticmethod
+    def _build_openai_messages(
+        message: str,
+        context: Optional[List[Dict[str, str]]] = None
+    ) -> Tuple[List[Dict[str, str]], bool]:
+        """构建OpenAI的消息列表，返回 (消息列表, 是否使用了上下文)"""
         # 构建消息历史
         messages = [
-            {"role": "system", "content": "你是一个有用、友善、诚实的AI助手。请根据用户的问题提供准确、有帮助的回答。"}
+            {"role": "system", "content": DIALOGUE_SYSTEM_PROMPT}
         ]
         
         # 添加上下文
@@ -66,8 +146,43 @@ class DialogueService:
         # 添加当前用户消息
         messages.append({"role": "user", "content": message})
         
+        return messages, context_used
+    
+    @staticmethod
+    def _build_anthropic_conversation(
+        message: str,
+        context: Optional[List[Dict[str, str]]] = None
+    ) -> Tuple[str, bool]:
+        """构建Anthropic的对话内容，返回 (对话文本, 是否使用了上下文)"""
+        if not context:
+            return message, False
+        
+        context_text = "\n".join([
+            f"{ctx.get('role', 'user')}: {ctx.get('content', '')}"
+            for ctx in context[-5:]
+        ])
+        return f"对话历史:\n{context_text}\n\n当前用户消息: {message}", True
+    
+    @staticmethod
+    def _response_confidence(response_text: str) -> float:
+        """计算置信度（基于响应长度和完整性）"""
+        return min(0.9, len(response_text) / 100 + 0.5)
+    
+    async def _generate_openai(
+        self,
+        message: str,
+        model_name: str,
+        context: Optional[List[Dict[str, str]]] = None,
+        user_id: Optional[str] = None
+    ) -> DialogueOutput:
+        """使用OpenAI模型生成对话响应"""
+        if not self.openai_client:
+            raise ValueError("OpenAI API key not configured")
+        
+        messages, context_used = self._build_openai_messages(message, context)
+        
         try:
-            response = await self.openai_client.ChatCompletion.acreate(
+            response = await self.llm_clients.openai_chat(
                 model=model_name,
                 messages=messages,
                 temperature=0.7,
@@ -76,12 +191,9 @@ class DialogueService:
             
             response_text = response.choices[0].message.content
             
-            # 计算置信度（基于响应长度和完整性）
-            confidence = min(0.9, len(response_text) / 100 + 0.5)
-            
             return DialogueOutput(
                 response=response_text,
-                confidence=confidence,
+                confidence=self._response_confidence(response_text),
                 context_used=context_used
             )
             
@@ -99,33 +211,23 @@ class DialogueService:
         if not self.anthropic_client:
             raise ValueError("Anthropic API key not configured")
         
-        # 构建对话内容
-        conversation_text = message
-        context_used = False
-        
-        if context:
-            context_used = True
-            context_text = "\n".join([
-                f"{ctx.get('role', 'user')}: {ctx.get('content', '')}"
-                for ctx in context[-5:]
-            ])
-            conversation_text = f"对话历史:\n{context_text}\n\n当前用户消息: {message}"
+        conversation_text, context_used = self._build_anthropic_conversation(message, context)
         
         try:
-            response = await self.anthropic_client.messages.create(
+            response = await self.llm_clients.anthropic_messages(
                 model=model_name,
                 max_tokens=1000,
+                system=DIALOGUE_SYSTEM_PROMPT,
                 messages=[
                     {"role": "user", "content": conversation_text}
                 ]
             )
             
             response_text = response.content[0].text
-            confidence = min(0.9, len(response_text) / 100 + 0.5)
             
             return DialogueOutput(
                 response=response_text,
-                confidence=confidence,
+                confidence=self._response_confidence(response_text),
                 context_used=context_used
             )
             
@@ -140,8 +242,6 @@ class DialogueService:
         user_id: Optional[str] = None
     ) -> DialogueOutput:
         """模拟对话响应（用于演示）"""
-        import random
-        
         # 简单的模拟响应
         mock_responses = [
             f"我理解您关于'{message[:20]}...'的问题。让我为您详细解答。",
@@ -198,13 +298,8 @@ class DialogueService:
         return metrics
     
     def _calculate_similarity(self, text1: str, text2: str) -> float:
-        """计算两个文本的相似度"""
-        if text1 == text2:
-            return 1.0
-        
-        # 使用序列匹配器计算相似度
-        matcher = difflib.SequenceMatcher(None, text1.lower(), text2.lower())
-        return matcher.ratio()
+        """计算两个文本的相似度（忽略大小写）"""
+        return sequence_similarity(text1.lower(), text2.lower())
     
     def calculate_dialogue_quality(
         self,
@@ -226,9 +321,9 @@ class DialogueService:
             metrics["length_score"] = max(0.5, 500 / response_length)
         
         # 关键词匹配度
-        message_words = set(message.lower().split())
-        response_words = set(response.lower().split())
-        common_words = message_words.intersection(response_words)
+        message_words = _word_set(message)
+        response_words = frozenset(response.lower().split())
+        common_words = message_words & response_words
         
         if message_words:
             metrics["keyword_match"] = len(common_words) / len(message_words)
@@ -237,9 +332,8 @@ class DialogueService:
         
         # 上下文相关性（如果有上下文）
         if context:
-            context_text = " ".join([ctx.get("content", "") for ctx in context])
-            context_words = set(context_text.lower().split())
-            context_response_common = context_words.intersection(response_words)
+            context_words = frozenset().union(*(_word_set(ctx.get("content", "")) for ctx in context))
+            context_response_common = context_words & response_words
             
             if context_words:
                 metrics["context_relevance"] = len(context_response_common) / len(context_words)
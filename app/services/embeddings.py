@@ -0,0 +1,82 @@
+"""
+进程内共享的句向量模型
+
+RAG检索、语义缓存和Agent结果评估使用同一个 sentence-transformers 模型，
+每个模型在进程内只加载一次。未安装 sentence-transformers 或加载失败时返回None，调用方自行降级。
+
+CPU上默认通过 ONNX Runtime 加载模型仓库中的int8量化模型，不支持时（sentence-transformers 版本过旧、
+未安装 onnxruntime 或仓库中没有该文件）使用默认的PyTorch后端，在GPU上以FP16推理。
+"""
+
+import os
+import threading
+from typing import Dict, List, Optional
+
+import numpy as np
+from dotenv import load_dotenv
+
+# 可选导入
+try:
+    from sentence_transformers import SentenceTransformer
+    SENTENCE_TRANSFORMERS_AVAILABLE = True
+except ImportError:
+    SentenceTransformer = None
+    SENTENCE_TRANSFORMERS_AVAILABLE = False
+
+load_dotenv()
+
+# 默认使用多语言模型，测试用例、提示和模型输出主要是中文
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "paraphrase-multilingual-MiniLM-L12-v2")
+
+# 推理后端（onnx 或 torch）和ONNX后端加载的模型文件（相对模型仓库）
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "onnx")
+EMBEDDING_ONNX_FILE = os.getenv("EMBEDDING_ONNX_FILE", "onnx/model_qint8_avx512_vnni.onnx")
+
+# 批量编码时每批的文本数
+EMBEDDING_BATCH_SIZE = 64
+
+_models: Dict[str, Optional["SentenceTransformer"]] = {}
+_load_lock = threading.Lock()
+
+def _load_model(model_name: str) -> "SentenceTransformer":
+    """优先加载量化的ONNX模型，不可用时使用PyTorch后端"""
+    if EMBEDDING_BACKEND == "onnx":
+        try:
+            return SentenceTransformer(
+                model_name,
+                backend="onnx",
+                model_kwargs={"file_name": EMBEDDING_ONNX_FILE}
+            )
+        except Exception:
+            pass
+
+    model = SentenceTransformer(model_name)
+    if model.device.type == "cuda":
+        model.half()
+    return model
+
+def get_embedding_model(model_name: str = EMBEDDING_MODEL) -> Optional["SentenceTransformer"]:
+    """返回共享的句向量模型，首次使用时加载，不可用时返回None"""
+    if model_name in _models:
+        return _models[model_name]
+
+    with _load_lock:
+        if model_name not in _models:
+            model = None
+            if SENTENCE_TRANSFORMERS_AVAILABLE:
+                try:
+                    model = _load_model(model_name)
+                except Exception:
+                    model = None
+            _models[model_name] = model
+
+    return _models[model_name]
+
+def encode(texts: List[str], model_name: str = EMBEDDING_MODEL) -> Optional[np.ndarray]:
+    """批量计算归一化的句向量，形状为 (len(texts), dim)，模型不可用时返回None"""
+    model = get_embedding_model(model_name)
+    if model is None:
+        return None
+
+    vectors = model.encode(texts, batch_size=EMBEDDING_BATCH_SIZE, normalize_embeddings=True)
+    return np.asarray(vectors, dtype=np.float32)
@@ -0,0 +1,166 @@
+import asyncio
+import hashlib
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional
+
+import openai
+import anthropic
+import orjson
+
+# LLM接口的连接池大小
+MAX_CONNECTIONS = 100
+MAX_KEEPALIVE_CONNECTIONS = 50
+
+# LLM接口请求超时（秒）
+REQUEST_TIMEOUT = 60
+
+# 每个供应商默认的每分钟请求数上限，可通过 OPENAI_RPM / ANTHROPIC_RPM 配置，0表示不限制
+DEFAULT_RPM = 500
+
+class AsyncRateLimiter:
+    """令牌桶限流：每 period 秒最多 max_rate 个请求，允许突发到 max_rate 个"""
+
+    def __init__(self, max_rate: float, period: float = 60.0):
+        self.max_rate = max_rate
+        self.refill_rate = max_rate / period
+        self.tokens = max_rate
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        """取得一个令牌，令牌不足时等待补充，等待者按先来后到排队"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.max_rate, self.tokens + (now - self.updated_at) * self.refill_rate)
+                self.updated_at = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                await asyncio.sleep((1 - self.tokens) / self.refill_rate)
+
+    async def __aenter__(self) -> "AsyncRateLimiter":
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        return None
+
+class InflightRequests:
+    """合并并发的相同请求：参数完全相同的调用同一时刻只向供应商发送一次，其余调用等待同一个结果
+
+    只合并 temperature=0 的请求；采样请求（未指定temperature时供应商默认为1）的每次调用都应得到独立的结果，
+    例如同一用例在批量测试中重复运行以观察输出的波动。
+    """
+
+    def __init__(self):
+        self._pending: Dict[str, asyncio.Future] = {}
+
+    @staticmethod
+    def _key(provider: str, params: Dict[str, Any]) -> str:
+        payload = orjson.dumps([provider, params], option=orjson.OPT_SORT_KEYS)
+        return hashlib.blake2b(payload, digest_size=16).hexdigest()
+
+    async def run(self, provider: str, params: Dict[str, Any], call: Callable[[], Awaitable[Any]]) -> Any:
+        if params.get("temperature") != 0:
+            return await call()
+
+        key = self._key(provider, params)
+        future = self._pending.get(key)
+        if future is None:
+            future = self._pending[key] = asyncio.ensure_future(call())
+            future.add_done_callback(lambda _: self._pending.pop(key, None))
+
+        # 单个调用方被取消时不影响其他等待同一结果的调用方
+        return await asyncio.shield(future)
+
+@dataclass
+class LLMClients:
+    """各服务共享的LLM SDK客户端，每个供应商一个连接池和一个请求限流器"""
+    openai_client: Optional[openai.AsyncOpenAI] = None
+    anthropic_client: Optional[anthropic.AsyncAnthropic] = None
+    openai_rate_limiter: Optional[AsyncRateLimiter] = None
+    anthropic_rate_limiter: Optional[AsyncRateLimiter] = None
+    inflight: InflightRequests = field(default_factory=InflightRequests)
+
+    async def openai_chat(self, **params) -> Any:
+        """调用OpenAI chat completions，经过限流，并发的相同确定性请求合并为一次"""
+        async def call():
+            if self.openai_rate_limiter:
+                await self.openai_rate_limiter.acquire()
+            return await self.openai_client.chat.completions.create(**params)
+
+        return await self.inflight.run("openai", params, call)
+
+    async def anthropic_messages(self, **params) -> Any:
+        """调用Anthropic messages，经过限流，并发的相同确定性请求合并为一次"""
+        async def call():
+            if self.anthropic_rate_limiter:
+                await self.anthropic_rate_limiter.acquire()
+            return await self.anthropic_client.messages.create(**params)
+
+        return await self.inflight.run("anthropic", params, call)
+
+    async def openai_chat_stream(self, **params) -> AsyncIterator[str]:
+        """流式调用OpenAI chat completions，逐段返回生成的文本；流式请求不做合并"""
+        if self.openai_rate_limiter:
+            await self.openai_rate_limiter.acquire()
+        stream = await self.openai_client.chat.completions.create(stream=True, **params)
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+    async def anthropic_messages_stream(self, **params) -> AsyncIterator[str]:
+        """流式调用Anthropic messages，逐段返回生成的文本；流式请求不做合并"""
+        if self.anthropic_rate_limiter:
+            await self.anthropic_rate_limiter.acquire()
+        async with self.anthropic_client.messages.stream(**params) as stream:
+            async for text in stream.text_stream:
+                yield text
+
+    async def aclose(self) -> None:
+        """关闭连接池"""
+        for client in (self.openai_client, self.anthropic_client):
+            if client:
+                await client.close()
+
+def _create_http_client(sdk):
+    """使用SDK自带的HTTP客户端类型，开启HTTP/2并限制连接池大小"""
+    limits_class = type(sdk.DEFAULT_CONNECTION_LIMITS)
+    return sdk.DefaultAsyncHttpxClient(
+        http2=True,
+        limits=limits_class(
+            max_connections=MAX_CONNECTIONS,
+            max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS
+        )
+    )
+
+def create_llm_clients() -> LLMClients:
+    """根据环境变量中配置的API密钥创建LLM客户端"""
+    clients = LLMClients()
+    
+    if os.getenv("OPENAI_API_KEY"):
+        clients.openai_client = openai.AsyncOpenAI(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            timeout=REQUEST_TIMEOUT,
+            http_client=_create_http_client(openai)
+        )
+        openai_rpm = int(os.getenv("OPENAI_RPM", DEFAULT_RPM))
+        if openai_rpm > 0:
+            clients.openai_rate_limiter = AsyncRateLimiter(openai_rpm)
+    
+    if os.getenv("ANTHROPIC_API_KEY"):
+        clients.anthropic_client = anthropic.AsyncAnthropic(
+            api_key=os.getenv("ANTHROPIC_API_KEY"),
+            timeout=REQUEST_TIMEOUT,
+            http_client=_create_http_client(anthropic)
+        )
+        anthropic_rpm = int(os.getenv("ANTHROPIC_RPM", DEFAULT_RPM))
+        if anthropic_rpm > 0:
+            clients.anthropic_rate_limiter = AsyncRateLimiter(anthropic_rpm)
+    
+    return clients
@@ -0,0 +1,119 @@
+"""
+基于 ONNX Runtime 的本地HuggingFace分类模型
+
+首次使用某个模型时从HuggingFace导出为ONNX并做动态int8量化，量化结果缓存在磁盘上，
+之后直接加载。每个模型在进程内只加载一次。给定候选标签时使用NLI模型做零样本分类。
+需要安装 optimum[onnxruntime]，未安装时 ONNXRUNTIME_AVAILABLE 为 False。
+"""
+
+import os
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from dotenv import load_dotenv
+
+# 可选导入
+try:
+    from optimum.onnxruntime import ORTModelForSequenceClassification, ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+    from transformers import AutoTokenizer
+    ONNXRUNTIME_AVAILABLE = True
+except ImportError:
+    ORTModelForSequenceClassification = None
+    ORTQuantizer = None
+    AutoQuantizationConfig = None
+    AutoTokenizer = None
+    ONNXRUNTIME_AVAILABLE = False
+
+load_dotenv()
+
+# 量化后模型的缓存目录
+HF_ONNX_CACHE_DIR = os.getenv("HF_ONNX_CACHE_DIR", "onnx_models")
+
+# 指定候选标签时使用的零样本分类（NLI）模型
+HF_ZERO_SHOT_MODEL = os.getenv("HF_ZERO_SHOT_MODEL", "facebook/bart-large-mnli")
+
+# 零样本分类的假设模板
+ZERO_SHOT_HYPOTHESIS = "This example is {}."
+
+QUANTIZED_FILE_NAME = "model_quantized.onnx"
+
+_models: Dict[str, Tuple[object, object]] = {}
+_load_lock = threading.Lock()
+
+def _quantize(repo: str, save_dir: str) -> None:
+    """导出ONNX模型并做动态int8量化，连同分词器和配置保存到save_dir"""
+    model = ORTModelForSequenceClassification.from_pretrained(
+        repo, export=True, provider="CPUExecutionProvider"
+    )
+    quantizer = ORTQuantizer.from_pretrained(model)
+    quantizer.quantize(
+        save_dir=save_dir,
+        quantization_config=AutoQuantizationConfig.avx2(is_static=False, per_channel=False)
+    )
+    model.config.save_pretrained(save_dir)
+    AutoTokenizer.from_pretrained(repo).save_pretrained(save_dir)
+
+def get_model(repo: str) -> Tuple[object, object]:
+    """返回 (分词器, 量化模型)，进程内每个模型只加载一次"""
+    if repo in _models:
+        return _models[repo]
+
+    with _load_lock:
+        if repo not in _models:
+            save_dir = os.path.join(HF_ONNX_CACHE_DIR, repo.replace("/", "__"))
+            if not os.path.exists(os.path.join(save_dir, QUANTIZED_FILE_NAME)):
+                _quantize(repo, save_dir)
+
+            model = ORTModelForSequenceClassification.from_pretrained(
+                save_dir, file_name=QUANTIZED_FILE_NAME, provider="CPUExecutionProvider"
+            )
+            _models[repo] = (AutoTokenizer.from_pretrained(save_dir), model)
+
+    return _models[repo]
+
+def _softmax(logits: np.ndarray) -> np.ndarray:
+    exp = np.exp(logits - logits.max(axis=-1, keepdims=True))
+    return exp / exp.sum(axis=-1, keepdims=True)
+
+def classify(repo: str, text: str, labels: Optional[List[str]] = None) -> Dict[str, float]:
+    """分类并返回各标签的概率
+
+    未给定标签时使用模型自带的标签（小写）；给定的标签都在模型标签中时只在这些标签上重新归一化，
+    否则改用零样本分类。
+    """
+    tokenizer, model = get_model(repo)
+
+    inputs = tokenizer(text, return_tensors="np", truncation=True)
+    probabilities = _softmax(np.asarray(model(**inputs).logits)[0])
+
+    id2label = model.config.id2label
+    model_probabilities = {id2label[i].lower(): float(p) for i, p in enumerate(probabilities)}
+    if not labels:
+        return model_probabilities
+
+    if all(label.lower() in model_probabilities for label in labels):
+        total = sum(model_probabilities[label.lower()] for label in labels) or 1.0
+        return {label: model_probabilities[label.lower()] / total for label in labels}
+
+    return zero_shot_classify(text, labels)
+
+def zero_shot_classify(text: str, labels: List[str]) -> Dict[str, float]:
+    """使用NLI模型做零样本分类，各候选标签的蕴含分数经softmax归一化为概率"""
+    tokenizer, model = get_model(HF_ZERO_SHOT_MODEL)
+
+    inputs = tokenizer(
+        [text] * len(labels),
+        [ZERO_SHOT_HYPOTHESIS.format(label) for label in labels],
+        return_tensors="np",
+        padding=True,
+        truncation="only_first"
+    )
+    logits = np.asarray(model(**inputs).logits)
+
+    label2id = {name.lower(): i for name, i in model.config.label2id.items()}
+    entailment_id = label2id.get("entailment", logits.shape[-1] - 1)
+    probabilities = _softmax(logits[:, entailment_id])
+
+    return {label: float(p) for label, p in zip(labels, probabilities)}
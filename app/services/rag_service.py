@@ -1,44 +1,91 @@
-import os
-import openai
-import anthropic
-from typing import List, Optional, Dict, Any
-import json
+from collections import OrderedDict
+from functools import lru_cache
+from typing import List, Optional, Dict, Any, Tuple
+import asyncio
+import hashlib
 import numpy as np
-import difflib
+import random
+import sys
+from statistics import fmean
 from app.schemas.test_schemas import RAGInput, RAGOutput
+from app.services import embeddings
+from app.services.llm_clients import LLMClients, create_llm_clients
+from app.services.response_cache import LLMResponseCache
+from app.services.text_similarity import sequence_similarity
 
 # 可选导入
 try:
-    from sentence_transformers import SentenceTransformer
-    SENTENCE_TRANSFORMERS_AVAILABLE = True
+    import hnswlib
+    HNSWLIB_AVAILABLE = True
 except ImportError:
-    SentenceTransformer = None
-    SENTENCE_TRANSFORMERS_AVAILABLE = False
+    hnswlib = None
+    HNSWLIB_AVAILABLE = False
+
+# 文档嵌入缓存的最大条目数（按文档内容去重）
+RAG_EMBEDDING_CACHE_SIZE = 10000
+
+# 问答提示词：固定的指令在前，检索到的文档和问题在后，请求前缀完全一致，可命中供应商的前缀缓存
+RAG_SYSTEM_PROMPT = "你是一个专业的问答助手，请基于提供的文档内容回答问题。"
+
+RAG_INSTRUCTION = "基于以下文档内容回答用户问题，给出准确、详细的答案。如果文档中没有相关信息，请明确说明。"
+
+def _build_rag_prompt(query: str, retrieved_docs: List[Dict[str, Any]]) -> str:
+    context = "\n\n".join(
+        f"文档 {i+1}: {doc['content']}"
+        for i, doc in enumerate(retrieved_docs)
+    )
+    return f"{RAG_INSTRUCTION}\n\n文档内容:\n{context}\n\n用户问题: {query}"
+
+# 集合文档数不少于该值时使用HNSW近似检索，文档较少时直接计算全部相似度更快
+RAG_HNSW_MIN_DOCUMENTS = 1000
+
+def _top_k_indices(scores: np.ndarray, top_k: int) -> np.ndarray:
+    """返回分数最高的top_k个下标（按分数降序，同分时下标小的在前），与稳定排序后取前k个的结果一致
+    
+    argpartition 在与第k名同分的元素中任意取舍，因此先取出所有不低于第k名分数的下标
+    （flatnonzero 按下标升序返回），再对这些候选做稳定排序。
+    """
+    k = min(top_k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    
+    kth_score = scores[np.argpartition(-scores, k - 1)[k - 1]]
+    candidates = np.flatnonzero(scores >= kth_score)
+    return candidates[np.argsort(-scores[candidates], kind="stable")[:k]]
+
+@lru_cache(maxsize=128)
+def _inline_postings(documents: Tuple[str, ...]) -> Dict[str, np.ndarray]:
+    """测试用例中直接给出的文档列表的倒排索引，同一用例重复运行时不再重新分词"""
+    return RAGService._build_postings(list(documents))
 
 class RAGService:
-    def __init__(self):
-        self.openai_client = None
-        self.anthropic_client = None
+    def __init__(self, llm_clients: Optional[LLMClients] = None):
+        # 传入llm_clients时复用共享的连接池，否则按环境变量单独创建
+        self.llm_clients = llm_clients or create_llm_clients()
+        self.openai_client = self.llm_clients.openai_client
+        self.anthropic_client = self.llm_clients.anthropic_client
         self.embedding_model = None
         self.document_store = {}  # 简单的内存文档存储
-        
-        if os.getenv("OPENAI_API_KEY"):
-            openai.api_key = os.getenv("OPENAI_API_KEY")
-            self.openai_client = openai
-        
-        if os.getenv("ANTHROPIC_API_KEY"):
-            self.anthropic_client = anthropic.Anthropic(
-                api_key=os.getenv("ANTHROPIC_API_KEY")
-            )
-        
-        # 初始化嵌入模型
-        if SENTENCE_TRANSFORMERS_AVAILABLE:
-            try:
-                self.embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
-            except Exception:
-                self.embedding_model = None
-        else:
-            self.embedding_model = None
+        # 文档内容哈希 -> 归一化嵌入向量，相同的文档只编码一次
+        self._document_embeddings: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        # 集合名（None表示全部文档）-> (文档列表, 嵌入矩阵, HNSW索引)，添加文档时失效
+        # 安装了hnswlib且文档足够多时同时保存HNSW索引，否则为None
+        self._collection_matrices: Dict[Optional[str], Tuple[List[str], np.ndarray, Any]] = {}
+        # 集合名 -> 关键词倒排索引，添加文档时失效
+        self._collection_postings: Dict[Optional[str], Dict[str, np.ndarray]] = {}
+        
+        # 初始化嵌入模型，与其他服务共用同一个模型实例
+        self.embedding_model = embeddings.get_embedding_model()
+        
+        # 相同问题和检索结果的答案直接复用，测试重跑时不再调用模型
+        self.response_cache = LLMResponseCache("rag")
+        
+        # 模型名前缀（第一个"-"之前的部分）-> 生成实现，其余模型使用模拟结果
+        self._providers = {"gpt": self._generate_openai, "claude": self._generate_anthropic}
+    
+    async def aclose(self) -> None:
+        """关闭响应缓存的Redis连接"""
+        await self.response_cache.close()
     
     async def generate_answer(
         self,
@@ -53,48 +100,81 @@ class RAGService:
         retrieved_docs = await self._retrieve_documents(query, documents, top_k)
         
         # 生成答案
-        if model_name.startswith("gpt-"):
-            return await self._generate_openai(query, model_name, retrieved_docs)
-        elif model_name.startswith("claude-"):
-            return await self._generate_anthropic(query, model_name, retrieved_docs)
-        else:
+        provider, separator, _ = model_name.partition("-")
+        generate_func = self._providers.get(provider) if separator else None
+        if generate_func is None:
             return await self._generate_mock(query, model_name, retrieved_docs)
+        
+        return await self._generate_cached(generate_func, query, model_name, retrieved_docs)
+    
+    async def _generate_cached(
+        self,
+        generate_func,
+        query: str,
+        model_name: str,
+        retrieved_docs: List[Dict[str, Any]]
+    ) -> RAGOutput:
+        """相同模型下问题和检索到的文档都相同时直接复用已有的答案"""
+        key = self.response_cache.key(model_name, query, [doc["content"] for doc in retrieved_docs])
+        
+        cached = await self.response_cache.get(key, RAGOutput)
+        if cached is not None:
+            return cached
+        
+        result = await generate_func(query, model_name, retrieved_docs)
+        await self.response_cache.put(key, result)
+        return result
     
     async def _retrieve_documents(
         self,
         query: str,
         documents: Optional[List[str]] = None,
-        top_k: int = 5
+        top_k: int = 5,
+        collection_name: Optional[str] = None
     ) -> List[Dict[str, Any]]:
-        """检索相关文档"""
+        """检索相关文档，未给定文档时从文档存储（指定集合或全部文档）中检索"""
         
-        if not documents:
-            # 从文档存储中检索
-            documents = list(self.document_store.values())
+        from_store = not documents
+        if from_store:
+            documents = self._collection_documents(collection_name)
         
         if not documents:
             return []
         
         if not self.embedding_model:
             # 如果没有嵌入模型，使用简单的关键词匹配
-            return self._keyword_based_retrieval(query, documents, top_k)
+            return self._keyword_based_retrieval(
+                query, documents, top_k, self._get_collection_postings(collection_name) if from_store else None
+            )
         
         try:
-            # 使用语义相似度检索
-            query_embedding = self.embedding_model.encode([query])
-            doc_embeddings = self.embedding_model.encode(documents)
-            
-            # 计算相似度
-            similarities = np.dot(query_embedding, doc_embeddings.T)[0]
+            # 使用语义相似度检索，文档嵌入取自缓存，只需编码查询
+            hnsw_index = None
+            if from_store:
+                documents, doc_matrix, hnsw_index = await self._get_collection_matrix(collection_name)
+            else:
+                doc_matrix = await self._embed_documents(documents)
+            query_embedding = (await asyncio.to_thread(embeddings.encode, [query]))[0]
             
-            # 获取top_k个最相似的文档
-            top_indices = np.argsort(similarities)[::-1][:top_k]
+            if hnsw_index is not None:
+                # 近似检索，余弦距离换算为余弦相似度
+                k = min(top_k, len(documents))
+                hnsw_index.set_ef(max(k, 50))
+                labels, distances = hnsw_index.knn_query(query_embedding, k=k)
+                top_indices, scores = labels[0], 1.0 - distances[0]
+            else:
+                # 向量已归一化，点积即余弦相似度
+                similarities = doc_matrix @ query_embedding
+                
+                # 获取top_k个最相似的文档
+                top_indices = _top_k_indices(similarities, top_k)
+                scores = similarities[top_indices]
             
             retrieved_docs = []
-            for idx in top_indices:
+            for idx, score in zip(top_indices, scores):
                 retrieved_docs.append({
                     "content": documents[idx],
-                    "score": float(similarities[idx]),
+                    "score": float(score),
                     "index": int(idx)
                 })
             
@@ -102,34 +182,107 @@ class RAGService:
             
         except Exception:
             # 如果语义检索失败，回退到关键词匹配
-            return self._keyword_based_retrieval(query, documents, top_k)
+            return self._keyword_based_retrieval(
+                query, documents, top_k, self._get_collection_postings(collection_name) if from_store else None
+            )
+    
+    def _collection_documents(self, collection_name: Optional[str] = None) -> List[str]:
+        """返回文档存储中指定集合的文档，未指定集合时返回全部文档"""
+        if collection_name is None:
+            return list(self.document_store.values())
+        
+        return [
+            doc for doc_id, doc in self.document_store.items()
+            if doc_id.startswith(collection_name)
+        ]
+    
+    async def _get_collection_matrix(self, collection_name: Optional[str] = None) -> Tuple[List[str], np.ndarray, Any]:
+        """返回集合的文档列表、嵌入矩阵和HNSW索引，首次检索时构建，之后直接复用"""
+        cached = self._collection_matrices.get(collection_name)
+        if cached is None:
+            documents = self._collection_documents(collection_name)
+            doc_matrix = await self._embed_documents(documents)
+            hnsw_index = None
+            if HNSWLIB_AVAILABLE and len(documents) >= RAG_HNSW_MIN_DOCUMENTS:
+                hnsw_index = await asyncio.to_thread(self._build_hnsw_index, doc_matrix)
+            cached = self._collection_matrices[collection_name] = (documents, doc_matrix, hnsw_index)
+        return cached
+    
+    @staticmethod
+    def _build_hnsw_index(doc_matrix: np.ndarray):
+        """用文档嵌入矩阵构建HNSW索引，标签为文档在集合中的下标"""
+        index = hnswlib.Index(space="cosine", dim=doc_matrix.shape[1])
+        index.init_index(max_elements=len(doc_matrix), ef_construction=200, M=16)
+        index.add_items(doc_matrix, np.arange(len(doc_matrix)))
+        return index
+    
+    @staticmethod
+    def _content_key(document: str) -> str:
+        return hashlib.blake2b(document.encode("utf-8"), digest_size=16).hexdigest()
+    
+    async def _embed_documents(self, documents: List[str]) -> np.ndarray:
+        """返回文档的归一化嵌入矩阵，只批量编码缓存中没有的文档"""
+        keys = [self._content_key(doc) for doc in documents]
+        missing = {key: doc for key, doc in zip(keys, documents) if key not in self._document_embeddings}
+        if missing:
+            vectors = await asyncio.to_thread(embeddings.encode, list(missing.values()))
+            if vectors is None:
+                raise ValueError("嵌入模型不可用")
+            self._document_embeddings.update(zip(missing, vectors))
+        
+        for key in keys:
+            self._document_embeddings.move_to_end(key)
+        doc_matrix = np.stack([self._document_embeddings[key] for key in keys])
+        
+        while len(self._document_embeddings) > RAG_EMBEDDING_CACHE_SIZE:
+            self._document_embeddings.popitem(last=False)
+        
+        return doc_matrix
+    
+    @staticmethod
+    def _build_postings(documents: List[str]) -> Dict[str, np.ndarray]:
+        """构建倒排索引：词 -> 包含该词的文档下标，词经过驻留，各集合的索引共用同一个字符串对象"""
+        postings: Dict[str, List[int]] = {}
+        for idx, doc in enumerate(documents):
+            for word in set(doc.lower().split()):
+                postings.setdefault(sys.intern(word), []).append(idx)
+        
+        return {word: np.array(ids, dtype=np.int64) for word, ids in postings.items()}
+    
+    def _get_collection_postings(self, collection_name: Optional[str] = None) -> Dict[str, np.ndarray]:
+        """返回集合的倒排索引，首次检索时构建，添加文档时失效"""
+        postings = self._collection_postings.get(collection_name)
+        if postings is None:
+            postings = self._collection_postings[collection_name] = self._build_postings(
+                self._collection_documents(collection_name)
+            )
+        return postings
     
     def _keyword_based_retrieval(
         self,
         query: str,
         documents: List[str],
-        top_k: int
+        top_k: int,
+        postings: Optional[Dict[str, np.ndarray]] = None
     ) -> List[Dict[str, Any]]:
-        """基于关键词的文档检索"""
-        
-        query_words = set(query.lower().split())
-        doc_scores = []
+        """基于关键词的文档检索，分数为文档包含的查询词占全部查询词的比例"""
         
-        for idx, doc in enumerate(documents):
-            doc_words = set(doc.lower().split())
-            common_words = query_words.intersection(doc_words)
-            score = len(common_words) / len(query_words) if query_words else 0
-            doc_scores.append((idx, score, doc))
+        if postings is None:
+            postings = _inline_postings(tuple(documents))
         
-        # 按分数排序
-        doc_scores.sort(key=lambda x: x[1], reverse=True)
+        query_words = set(query.lower().split())
+        matched = [postings[word] for word in query_words if word in postings]
+        if matched:
+            doc_scores = np.bincount(np.concatenate(matched), minlength=len(documents)) / len(query_words)
+        else:
+            doc_scores = np.zeros(len(documents))
         
         retrieved_docs = []
-        for idx, score, doc in doc_scores[:top_k]:
+        for idx in _top_k_indices(doc_scores, top_k):
             retrieved_docs.append({
-                "content": doc,
-                "score": score,
-                "index": idx
+                "content": documents[idx],
+                "score": float(doc_scores[idx]),
+                "index": int(idx)
             })
         
         return retrieved_docs
@@ -144,26 +297,13 @@ class RAGService:
         if not self.openai_client:
             raise ValueError("OpenAI API key not configured")
         
-        # 构建上下文
-        context = "\n\n".join([
-            f"文档 {i+1}: {doc['content']}"
-            for i, doc in enumerate(retrieved_docs)
-        ])
-        
-        prompt = f"""基于以下文档内容回答用户问题：
-
-文档内容:
-{context}
-
-用户问题: {query}
-
-请基于提供的文档内容给出准确、详细的答案。如果文档中没有相关信息，请明确说明。"""
+        prompt = _build_rag_prompt(query, retrieved_docs)
         
         try:
-            response = await self.openai_client.ChatCompletion.acreate(
+            response = await self.llm_clients.openai_chat(
                 model=model_name,
                 messages=[
-                    {"role": "system", "content": "你是一个专业的问答助手，请基于提供的文档内容回答问题。"},
+                    {"role": "system", "content": RAG_SYSTEM_PROMPT},
                     {"role": "user", "content": prompt}
                 ],
                 temperature=0.3,
@@ -194,24 +334,13 @@ class RAGService:
         if not self.anthropic_client:
             raise ValueError("Anthropic API key not configured")
         
-        context = "\n\n".join([
-            f"文档 {i+1}: {doc['content']}"
-            for i, doc in enumerate(retrieved_docs)
-        ])
-        
-        prompt = f"""基于以下文档内容回答用户问题：
-
-文档内容:
-{context}
-
-用户问题: {query}
-
-请基于提供的文档内容给出准确、详细的答案。"""
+        prompt = _build_rag_prompt(query, retrieved_docs)
         
         try:
-            response = await self.anthropic_client.messages.create(
+            response = await self.llm_clients.anthropic_messages(
                 model=model_name,
                 max_tokens=1000,
+                system=RAG_SYSTEM_PROMPT,
                 messages=[
                     {"role": "user", "content": prompt}
                 ]
@@ -236,8 +365,6 @@ class RAGService:
         retrieved_docs: List[Dict[str, Any]]
     ) -> RAGOutput:
         """模拟RAG答案生成（用于演示）"""
-        import random
-        
         if retrieved_docs:
             # 基于检索到的文档生成模拟答案
             doc_content = retrieved_docs[0]['content'][:200]
@@ -264,7 +391,7 @@ class RAGService:
             return 0.3
         
         # 基于检索文档的平均分数
-        avg_retrieval_score = np.mean([doc['score'] for doc in retrieved_docs])
+        avg_retrieval_score = fmean(doc['score'] for doc in retrieved_docs)
         
         # 基于答案长度
         length_score = min(1.0, len(answer) / 200)
@@ -287,6 +414,16 @@ class RAGService:
             self.document_store[doc_id] = doc
             document_ids.append(doc_id)
         
+        # 集合内容已变化，嵌入矩阵、HNSW索引和倒排索引下次检索时重建；新文档的嵌入在此一次性批量计算
+        self._collection_matrices.clear()
+        self._collection_postings.clear()
+        if self.embedding_model:
+            try:
+                await self._embed_documents(documents)
+            except Exception:
+                # 预先编码失败不影响添加，检索时会再次尝试
+                pass
+        
         return document_ids
     
     async def search_documents(
@@ -297,13 +434,7 @@ class RAGService:
     ) -> List[Dict[str, Any]]:
         """搜索文档"""
         
-        # 过滤指定集合的文档
-        collection_docs = [
-            doc for doc_id, doc in self.document_store.items()
-            if doc_id.startswith(collection_name)
-        ]
-        
-        return await self._retrieve_documents(query, collection_docs, top_k)
+        return await self._retrieve_documents(query, top_k=top_k, collection_name=collection_name)
     
     def evaluate(
         self,
@@ -349,11 +480,7 @@ class RAGService:
     
     def _calculate_similarity(self, text1: str, text2: str) -> float:
         """计算文本相似度"""
-        if text1 == text2:
-            return 1.0
-        
-        matcher = difflib.SequenceMatcher(None, text1.lower(), text2.lower())
-        return matcher.ratio()
+        return sequence_similarity(text1.lower(), text2.lower())
     
     def _evaluate_retrieval_quality(
         self,
@@ -365,12 +492,10 @@ class RAGService:
         if not expected_docs:
             return 0.0
         
-        # 计算检索到的文档与期望文档的重叠度
-        predicted_contents = set([doc['content'] for doc in predicted_docs])
-        expected_contents = set([doc['content'] for doc in expected_docs])
-        
+        # 计算检索到的文档与期望文档的重叠度（str会缓存自身的哈希值，每个文档内容只哈希一次）
+        expected_contents = {doc['content'] for doc in expected_docs}
         if not expected_contents:
             return 0.0
         
-        intersection = predicted_contents.intersection(expected_contents)
-        return len(intersection) / len(expected_contents)
\ No newline at end of file
+        matched = expected_contents.intersection(doc['content'] for doc in predicted_docs)
+        return len(matched) / len(expected_contents)
\ No newline at end of file
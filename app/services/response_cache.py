@@ -0,0 +1,128 @@
+"""
+纠错、对话、RAG任务的LLM响应缓存
+
+相同模型下输入完全相同的请求直接返回上次解析好的结果，测试平台重放相同输入时不再调用模型。
+先查进程内LRU，再查Redis（API进程和Celery worker之间共享）；Redis不可用时只使用进程内缓存。
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+from collections import OrderedDict
+from typing import Any, Optional, Type, TypeVar
+
+import orjson
+import redis
+import redis.asyncio as aioredis
+from dotenv import load_dotenv
+from pydantic import BaseModel
+
+from app.cache import REDIS_URL
+from app.services.cache_scope import cache_reads_allowed, record_cache_hit
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+LLM_RESPONSE_CACHE_ENABLED = os.getenv("LLM_RESPONSE_CACHE_ENABLED", "1") == "1"
+LLM_RESPONSE_CACHE_TTL = int(os.getenv("LLM_RESPONSE_CACHE_TTL", 86400))
+
+# 进程内每个命名空间最多缓存的条目数
+LLM_RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("LLM_RESPONSE_CACHE_MAX_ENTRIES", 10000))
+
+T = TypeVar("T", bound=BaseModel)
+
+class LLMResponseCache:
+    """进程内LRU加Redis的两级缓存，Redis连接在首次使用时建立，每个事件循环（应用进程或worker线程）使用各自的实例"""
+
+    def __init__(
+        self,
+        namespace: str,
+        url: str = REDIS_URL,
+        enabled: bool = LLM_RESPONSE_CACHE_ENABLED,
+        ttl: int = LLM_RESPONSE_CACHE_TTL,
+        max_entries: int = LLM_RESPONSE_CACHE_MAX_ENTRIES
+    ):
+        self.namespace = namespace
+        self.url = url
+        self.enabled = enabled
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._local: "OrderedDict[str, bytes]" = OrderedDict()
+        self._redis: Optional[aioredis.Redis] = None
+        self._redis_checked = False
+        self._connect_lock = asyncio.Lock()
+
+    def key(self, *parts: Any) -> str:
+        """根据模型名和请求输入生成缓存键"""
+        payload = orjson.dumps(parts, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS)
+        return f"llm_response:{self.namespace}:{hashlib.blake2b(payload, digest_size=16).hexdigest()}"
+
+    async def _get_redis(self) -> Optional[aioredis.Redis]:
+        """首次使用时连接Redis，不可用时只使用进程内缓存"""
+        if not self._redis_checked:
+            async with self._connect_lock:
+                if not self._redis_checked:
+                    client = aioredis.from_url(self.url, socket_connect_timeout=1, socket_timeout=1)
+                    try:
+                        await client.ping()
+                        self._redis = client
+                    except redis.RedisError as e:
+                        logger.warning("Redis不可用，LLM响应缓存只保存在进程内: %s", e)
+                        await client.aclose()
+                    self._redis_checked = True
+        return self._redis
+
+    def _remember(self, key: str, payload: bytes) -> None:
+        self._local[key] = payload
+        self._local.move_to_end(key)
+        if len(self._local) > self.max_entries:
+            self._local.popitem(last=False)
+
+    async def get(self, key: str, output_class: Type[T]) -> Optional[T]:
+        """读取缓存，未命中、出错或测试要求跳过缓存时返回None；每次返回新的对象，调用方可以修改"""
+        if not self.enabled or not cache_reads_allowed():
+            return None
+
+        payload = self._local.get(key)
+        if payload is not None:
+            self._local.move_to_end(key)
+        else:
+            client = await self._get_redis()
+            if client is None:
+                return None
+            try:
+                payload = await client.get(key)
+            except redis.RedisError as e:
+                logger.warning("读取LLM响应缓存失败: %s", e)
+                return None
+            if payload is None:
+                return None
+            self._remember(key, payload)
+
+        record_cache_hit()
+        return output_class.model_validate_json(payload)
+
+    async def put(self, key: str, output: BaseModel) -> None:
+        """写入缓存"""
+        if not self.enabled:
+            return
+
+        payload = orjson.dumps(output.model_dump())
+        self._remember(key, payload)
+
+        client = await self._get_redis()
+        if client is None:
+            return
+        try:
+            await client.setex(key, self.ttl, payload)
+        except redis.RedisError as e:
+            logger.warning("写入LLM响应缓存失败: %s", e)
+
+    async def close(self) -> None:
+        """关闭Redis连接"""
+        if self._redis is not None:
+            await self._redis.aclose()
+        self._redis = None
+        self._redis_checked = False
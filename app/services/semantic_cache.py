@@ -0,0 +1,278 @@
+"""
+LLM响应的语义缓存
+
+相同命名空间（模型、标签集合、工具集合等）下，提示文本相同的请求直接返回缓存的结果，
+跳过一次完整的模型调用。
+
+开启 SEMANTIC_CACHE_SIMILARITY_MATCH 后，语义相近的提示也会命中：安装了 sentence-transformers 时按嵌入向量的
+余弦相似度匹配，安装了 hnswlib 时使用HNSW近似检索。评测平台上近似命中会把另一个测试用例的结果当作被测模型的输出，
+因此默认关闭，只在愿意用评测准确性换取调用成本时开启。
+
+积累足够的嵌入向量后用 PCA 把向量压缩到低维空间做近似检索，再用原始向量对候选重排，
+PCA 基底保存到磁盘，重启后直接加载。
+"""
+
+import asyncio
+import hashlib
+import os
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+import numpy as np
+from dotenv import load_dotenv
+from sklearn.decomposition import IncrementalPCA
+
+from app.services import embeddings
+
+# 可选导入
+try:
+    import hnswlib
+    HNSWLIB_AVAILABLE = True
+except ImportError:
+    hnswlib = None
+    HNSWLIB_AVAILABLE = False
+
+load_dotenv()
+
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "1") == "1"
+SEMANTIC_CACHE_MODEL = os.getenv("SEMANTIC_CACHE_MODEL", embeddings.EMBEDDING_MODEL)
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", 0.9))
+
+# 是否按嵌入相似度近似命中，关闭时只在提示文本完全相同时命中，也不计算嵌入向量
+SEMANTIC_CACHE_SIMILARITY_MATCH = os.getenv("SEMANTIC_CACHE_SIMILARITY_MATCH", "0") == "1"
+
+# 每个命名空间最多缓存的条目数，写满后覆盖最早的条目
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", 10000))
+
+# PCA压缩后的维度、拟合所需的嵌入向量数量和基底的保存路径
+SEMANTIC_CACHE_PCA_COMPONENTS = int(os.getenv("SEMANTIC_CACHE_PCA_COMPONENTS", 64))
+SEMANTIC_CACHE_PCA_FIT_SIZE = int(os.getenv("SEMANTIC_CACHE_PCA_FIT_SIZE", 512))
+SEMANTIC_CACHE_PCA_PATH = os.getenv("SEMANTIC_CACHE_PCA_PATH", "semantic_cache_pca.npz")
+
+# 近似检索返回的候选数量，候选再用原始向量重排
+SEMANTIC_CACHE_RERANK_K = 10
+
+class _PCAProjection:
+    """把归一化的嵌入向量投影到PCA子空间，投影结果重新归一化"""
+
+    def __init__(self, mean: np.ndarray, components: np.ndarray):
+        self.mean = mean.astype(np.float32)
+        self.components = components.astype(np.float32)
+
+    @property
+    def dim(self) -> int:
+        return self.components.shape[0]
+
+    def __call__(self, vectors: np.ndarray) -> np.ndarray:
+        projected = (vectors - self.mean) @ self.components.T
+        norms = np.linalg.norm(projected, axis=-1, keepdims=True)
+        return projected / np.maximum(norms, 1e-12)
+
+class _VectorIndex:
+    """单个命名空间内的向量索引，槽位写满后按先进先出覆盖
+
+    原始向量始终保留用于重排；近似检索在投影后的向量上进行，未设置投影时直接使用原始向量。
+    """
+
+    def __init__(self, dim: int, max_entries: int, projection: Optional[_PCAProjection] = None):
+        self.max_entries = max_entries
+        self.size = 0
+        self.next_slot = 0
+        self.values: Dict[int, Any] = {}
+        self.vectors = np.zeros((max_entries, dim), dtype=np.float32)
+        self.set_projection(projection)
+
+    def set_projection(self, projection: Optional[_PCAProjection]) -> None:
+        """设置投影并用已有的原始向量重建近似索引"""
+        self.projection = projection
+        search_dim = projection.dim if projection is not None else self.vectors.shape[1]
+
+        if HNSWLIB_AVAILABLE:
+            self.hnsw = hnswlib.Index(space="cosine", dim=search_dim)
+            self.hnsw.init_index(max_elements=self.max_entries, ef_construction=200, M=16)
+            self.search_vectors = None
+            if self.size:
+                self.hnsw.add_items(self._project(self.vectors[:self.size]), np.arange(self.size))
+        else:
+            self.hnsw = None
+            self.search_vectors = np.zeros((self.max_entries, search_dim), dtype=np.float32)
+            if self.size:
+                self.search_vectors[:self.size] = self._project(self.vectors[:self.size])
+
+    def _project(self, vectors: np.ndarray) -> np.ndarray:
+        return self.projection(vectors) if self.projection is not None else vectors
+
+    def add(self, vector: np.ndarray, value: Any) -> None:
+        slot = self.next_slot
+        self.next_slot = (slot + 1) % self.max_entries
+
+        self.vectors[slot] = vector
+        search_vector = self._project(vector)
+        if self.hnsw is not None:
+            # 标签已存在时 hnswlib 会原地更新该条目的向量
+            self.hnsw.add_items(search_vector[np.newaxis], [slot])
+        else:
+            self.search_vectors[slot] = search_vector
+
+        self.values[slot] = value
+        self.size = min(self.size + 1, self.max_entries)
+
+    def search(self, vector: np.ndarray) -> Optional[Tuple[float, Any]]:
+        """返回最相似条目的 (余弦相似度, 缓存值)"""
+        if not self.size:
+            return None
+
+        k = min(SEMANTIC_CACHE_RERANK_K, self.size)
+        search_vector = self._project(vector)
+        if self.hnsw is not None:
+            labels, _ = self.hnsw.knn_query(search_vector[np.newaxis], k=k)
+            candidates = labels[0].astype(np.int64)
+        else:
+            approx = self.search_vectors[:self.size] @ search_vector
+            candidates = np.argpartition(-approx, k - 1)[:k] if k < self.size else np.arange(self.size)
+
+        # 向量已归一化，用原始向量的点积（余弦相似度）重排候选
+        similarities = self.vectors[candidates] @ vector
+        best = int(np.argmax(similarities))
+        slot = int(candidates[best])
+        return float(similarities[best]), self.values[slot]
+
+class SemanticCache:
+    """按命名空间隔离的语义缓存，缓存值应为不可变使用的结果对象"""
+
+    def __init__(
+        self,
+        enabled: bool = SEMANTIC_CACHE_ENABLED,
+        model_name: str = SEMANTIC_CACHE_MODEL,
+        threshold: float = SEMANTIC_CACHE_THRESHOLD,
+        similarity_match: bool = SEMANTIC_CACHE_SIMILARITY_MATCH,
+        max_entries: int = SEMANTIC_CACHE_MAX_ENTRIES,
+        pca_components: int = SEMANTIC_CACHE_PCA_COMPONENTS,
+        pca_fit_size: int = SEMANTIC_CACHE_PCA_FIT_SIZE,
+        pca_path: str = SEMANTIC_CACHE_PCA_PATH
+    ):
+        self.enabled = enabled
+        self.model_name = model_name
+        self.threshold = threshold
+        self.similarity_match = similarity_match
+        self.max_entries = max_entries
+        self.pca_components = pca_components
+        self.pca_fit_size = max(pca_fit_size, pca_components)
+        self.pca_path = pca_path
+
+        self._projection: Optional[_PCAProjection] = None
+        self._projection_loaded = False
+        self._pca_samples = []
+        self._exact: "OrderedDict[Tuple[Hashable, str], Any]" = OrderedDict()
+        self._indexes: Dict[Hashable, _VectorIndex] = {}
+
+    async def _embed(self, text: str) -> Optional[np.ndarray]:
+        """计算归一化的嵌入向量，放到线程池中执行，避免阻塞事件循环；嵌入模型不可用时返回None，只使用精确匹配"""
+        vectors = await asyncio.to_thread(embeddings.encode, [text], self.model_name)
+        return vectors[0] if vectors is not None else None
+
+    def _get_projection(self, dim: int) -> Optional[_PCAProjection]:
+        """首次使用时从磁盘加载PCA基底，嵌入模型或维度不一致时忽略"""
+        if not self._projection_loaded:
+            self._projection_loaded = True
+            if self.pca_path and os.path.exists(self.pca_path):
+                try:
+                    with np.load(self.pca_path) as data:
+                        if str(data["model_name"]) == self.model_name and data["mean"].shape[0] == dim:
+                            self._projection = _PCAProjection(data["mean"], data["components"])
+                except (OSError, KeyError, ValueError):
+                    self._projection = None
+        return self._projection
+
+    def _collect_pca_sample(self, vector: np.ndarray) -> None:
+        """积累嵌入向量，数量足够时拟合PCA、保存基底并重建所有索引"""
+        if self._projection is not None or vector.shape[0] <= self.pca_components:
+            return
+
+        self._pca_samples.append(vector)
+        if len(self._pca_samples) < self.pca_fit_size:
+            return
+
+        pca = IncrementalPCA(n_components=self.pca_components)
+        pca.partial_fit(np.stack(self._pca_samples))
+        self._pca_samples = []
+        self._projection = _PCAProjection(pca.mean_, pca.components_)
+
+        if self.pca_path:
+            try:
+                np.savez(
+                    self.pca_path,
+                    mean=self._projection.mean,
+                    components=self._projection.components,
+                    model_name=self.model_name
+                )
+            except OSError:
+                pass
+
+        for index in self._indexes.values():
+            index.set_projection(self._projection)
+
+    @staticmethod
+    def _exact_key(namespace: Hashable, text: str) -> Tuple[Hashable, str]:
+        return namespace, hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+    async def get(self, namespace: Hashable, text: str) -> Optional[Any]:
+        """查找缓存，未命中时返回None"""
+        if not self.enabled:
+            return None
+
+        key = self._exact_key(namespace, text)
+        if key in self._exact:
+            self._exact.move_to_end(key)
+            return self._exact[key]
+
+        if not self.similarity_match:
+            return None
+
+        index = self._indexes.get(namespace)
+        if index is None:
+            return None
+
+        vector = await self._embed(text)
+        if vector is None:
+            return None
+
+        match = index.search(vector)
+        if match and match[0] >= self.threshold:
+            return match[1]
+        return None
+
+    async def put(self, namespace: Hashable, text: str, value: Any) -> None:
+        """写入缓存"""
+        if not self.enabled:
+            return
+
+        key = self._exact_key(namespace, text)
+        self._exact[key] = value
+        self._exact.move_to_end(key)
+        if len(self._exact) > self.max_entries:
+            self._exact.popitem(last=False)
+
+        if not self.similarity_match:
+            return
+
+        vector = await self._embed(text)
+        if vector is None:
+            return
+
+        index = self._indexes.get(namespace)
+        if index is None:
+            index = self._indexes[namespace] = _VectorIndex(
+                vector.shape[0], self.max_entries, self._get_projection(vector.shape[0])
+            )
+        index.add(vector, value)
+        self._collect_pca_sample(vector)
+
+    def clear(self) -> None:
+        """清空缓存"""
+        self._exact.clear()
+        self._indexes.clear()
+        self._pca_samples = []
+
+# 各服务共用的缓存实例
+semantic_cache = SemanticCache()
@@ -0,0 +1,37 @@
+"""
+各服务评估时共用的字符串相似度
+
+安装了 rapidfuzz 时使用其C++实现的Indel相似度（与 SequenceMatcher.ratio 同为 2*匹配数/总长度），
+否则回退到 difflib.SequenceMatcher（最坏情况O(n²)，且不会对相同的输入提前返回）。
+先判断相等，结果按文本内容缓存（同一批测试中期望输出经常重复出现）；多行的长文本按行比较，避免逐字符匹配。
+"""
+
+import difflib
+from functools import lru_cache
+
+# 可选导入
+try:
+    from rapidfuzz.distance import Indel
+    RAPIDFUZZ_AVAILABLE = True
+except ImportError:
+    Indel = None
+    RAPIDFUZZ_AVAILABLE = False
+
+# 超过该长度的多行文本按行比较
+LINE_DIFF_THRESHOLD = 2048
+
+@lru_cache(maxsize=4096)
+def sequence_similarity(text1: str, text2: str) -> float:
+    """0-1之间的相似度，需要忽略大小写时由调用方先转成小写"""
+    if text1 == text2:
+        return 1.0
+
+    if max(len(text1), len(text2)) > LINE_DIFF_THRESHOLD and "\n" in text1 and "\n" in text2:
+        seq1, seq2 = text1.splitlines(), text2.splitlines()
+    else:
+        seq1, seq2 = text1, text2
+
+    if RAPIDFUZZ_AVAILABLE:
+        return Indel.normalized_similarity(seq1, seq2)
+
+    return difflib.SequenceMatcher(None, seq1, seq2, autojunk=True).ratio()
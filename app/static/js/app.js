@@ -365,9 +365,15 @@ async function handleRunClassificationTest(event) {
         });
         
         if (response.ok) {
-            const result = await response.json();
-            displayTestResult(result);
-            showAlert('测试执行成功', 'success');
+            const { task_id } = await response.json();
+            const task = await waitForTask(task_id);
+            
+            if (task.status === 'completed') {
+                displayTestResult('classification', task.result);
+                showAlert('测试执行成功', 'success');
+            } else {
+                showAlert('测试执行失败: ' + (task.error || '未知错误'), 'danger');
+            }
         } else {
             const error = await response.json();
             showAlert('测试执行失败: ' + (error.detail || '未知错误'), 'danger');
@@ -381,6 +387,24 @@ async function handleRunClassificationTest(event) {
     }
 }
 
+// 轮询后台测试任务，直到任务完成或失败
+async function waitForTask(taskId, interval = 1000) {
+    while (true) {
+        const response = await fetch(`/api/tasks/${taskId}`);
+        if (!response.ok) {
+            const error = await response.json();
+            throw new Error(error.detail || '查询任务状态失败');
+        }
+        
+        const task = await response.json();
+        if (task.status === 'completed' || task.status === 'failed') {
+            return task;
+        }
+        
+        await new Promise(resolve => setTimeout(resolve, interval));
+    }
+}
+
 // 显示测试结果
 function displayTestResult(result) {
     const resultDiv = document.getElementById('classification-result');
@@ -0,0 +1,199 @@
+"""
+后台测试任务
+
+耗时的模型调用在 Celery worker 中执行，任务状态和结果写入 Redis 的 task:{task_id} 键，
+HTTP 接口只负责入队并立即返回 task_id。
+
+启动 worker:
+    celery -A app.tasks.celery_app worker --loglevel=info
+"""
+
+import asyncio
+import logging
+import os
+import threading
+import uuid
+from typing import Any, Dict, Optional
+
+import orjson
+import redis
+from celery import Celery
+from dotenv import load_dotenv
+from fastapi import HTTPException
+from kombu.exceptions import OperationalError
+from sqlalchemy import text
+
+from app.cache import DASHBOARD_CACHE_PATTERN, REDIS_URL
+from app.database import SessionLocal, engine
+from app.models.test_models import TestCase, TestResult, MV_MODEL_PERFORMANCE_REFRESH
+from app.services.llm_clients import create_llm_clients
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# 任务状态在Redis中的保留时间（秒）
+TASK_STATUS_TTL = 24 * 60 * 60
+
+# 物化视图刷新间隔（秒）
+MV_REFRESH_INTERVAL = int(os.getenv("MV_REFRESH_INTERVAL", 300))
+
+celery_app = Celery("ai_test_platform", broker=REDIS_URL)
+celery_app.conf.update(
+    task_serializer="json",
+    accept_content=["json"],
+    task_acks_late=True,
+    worker_prefetch_multiplier=1,
+    beat_schedule={
+        "refresh-materialized-views": {
+            "task": "app.tasks.refresh_materialized_views",
+            "schedule": MV_REFRESH_INTERVAL
+        }
+    }
+)
+
+redis_client = redis.Redis.from_url(REDIS_URL, decode_responses=True)
+
+def set_task_status(task_id: str, status: str, **fields: Any) -> None:
+    """写入任务状态"""
+    payload = {"task_id": task_id, "status": status, **fields}
+    redis_client.setex(f"task:{task_id}", TASK_STATUS_TTL, orjson.dumps(payload, default=str))
+
+def get_task_status(task_id: str) -> Optional[Dict[str, Any]]:
+    """读取任务状态，不存在时返回None"""
+    payload = redis_client.get(f"task:{task_id}")
+    return orjson.loads(payload) if payload else None
+
+_worker_state = threading.local()
+
+def _get_worker_state():
+    """每个worker线程持有一个事件循环和在其上使用的LLM客户端，跨任务复用连接"""
+    if not hasattr(_worker_state, "loop"):
+        _worker_state.loop = asyncio.new_event_loop()
+        _worker_state.llm_clients = create_llm_clients()
+        _worker_state.services = {}
+    return _worker_state
+
+def get_worker_service(service_class):
+    """worker线程内每种服务只创建一个实例"""
+    state = _get_worker_state()
+    if service_class not in state.services:
+        state.services[service_class] = service_class(state.llm_clients)
+    return state.services[service_class]
+
+def invalidate_dashboard_cache() -> None:
+    """worker写入测试结果后清除仪表板缓存，Redis出错时只记录日志"""
+    try:
+        keys = list(redis_client.scan_iter(match=DASHBOARD_CACHE_PATTERN, count=500))
+        if keys:
+            redis_client.delete(*keys)
+    except redis.RedisError as e:
+        logger.warning("清除仪表板缓存失败: %s", e)
+
+def _enqueue_test(task, test_case_id: int, model_name: str, use_cache: bool) -> str:
+    task_id = str(uuid.uuid4())
+    set_task_status(task_id, "pending", test_case_id=test_case_id, model_name=model_name)
+    task.delay(task_id, test_case_id, model_name, use_cache)
+    return task_id
+
+async def enqueue_test(task, test_case_id: int, model_name: str, use_cache: bool = True) -> str:
+    """将测试任务放入队列，返回task_id；同步的Redis和broker调用放到线程池中执行，不可用时返回503"""
+    try:
+        return await asyncio.to_thread(_enqueue_test, task, test_case_id, model_name, use_cache)
+    except (redis.RedisError, OperationalError) as e:
+        logger.warning("测试任务入队失败: %s", e)
+        raise HTTPException(status_code=503, detail="任务队列不可用，请稍后重试")
+
+def _run_test(task, task_id: str, test_case_id: int, execute, build_response) -> None:
+    """在worker中执行测试并保存结果"""
+    set_task_status(task_id, "running", test_case_id=test_case_id)
+
+    db = SessionLocal()
+    try:
+        test_case = db.get(TestCase, test_case_id)
+        if not test_case:
+            set_task_status(task_id, "failed", error="测试用例不存在")
+            return
+
+        result_data = _get_worker_state().loop.run_until_complete(execute(test_case))
+
+        test_result = TestResult(**result_data)
+        db.add(test_result)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        if task.request.retries >= task.max_retries:
+            set_task_status(task_id, "failed", error=str(e))
+            raise
+        raise task.retry(exc=e, countdown=2 ** task.request.retries)
+    finally:
+        db.close()
+
+    # 结果已提交，之后的Redis写入失败只记录日志，不再重试，避免重复执行测试并写入重复的结果
+    invalidate_dashboard_cache()
+    try:
+        if result_data["status"] == "failed":
+            set_task_status(task_id, "failed", error=f"测试执行失败: {result_data['error_message']}")
+        else:
+            set_task_status(task_id, "completed", result=build_response(test_result.id, result_data))
+    except redis.RedisError as e:
+        logger.warning("测试结果 %s 已保存，更新任务 %s 的状态失败: %s", test_result.id, task_id, e)
+
+@celery_app.task(bind=True, max_retries=3)
+def run_agent_task(self, task_id: str, test_case_id: int, model_name: str, use_cache: bool = True) -> None:
+    """执行Agent任务测试"""
+    from app.routers.agent import _execute_agent_test, _build_test_response
+    from app.services.agent_service import AgentService
+    
+    agent_service = get_worker_service(AgentService)
+
+    _run_test(
+        self, task_id, test_case_id,
+        lambda test_case: _execute_agent_test(
+            test_case, model_name, "autonomous", 300, False, agent_service, use_cache=use_cache
+        ),
+        _build_test_response
+    )
+
+@celery_app.task(bind=True, max_retries=3)
+def run_classification_task(self, task_id: str, test_case_id: int, model_name: str, use_cache: bool = True) -> None:
+    """执行分类任务测试"""
+    from app.routers.classification import _execute_classification_test, _build_test_response
+    from app.services.classification_service import ClassificationService
+    
+    classification_service = get_worker_service(ClassificationService)
+
+    _run_test(
+        self, task_id, test_case_id,
+        lambda test_case: _execute_classification_test(
+            test_case, model_name, classification_service, use_cache=use_cache
+        ),
+        _build_test_response
+    )
+
+@celery_app.task(bind=True, max_retries=3)
+def run_correction_task(self, task_id: str, test_case_id: int, model_name: str, use_cache: bool = True) -> None:
+    """执行纠错任务测试"""
+    from app.routers.correction import _execute_correction_test, _build_test_response
+    from app.services.correction_service import CorrectionService
+    
+    correction_service = get_worker_service(CorrectionService)
+
+    _run_test(
+        self, task_id, test_case_id,
+        lambda test_case: _execute_correction_test(
+            test_case, model_name, "balanced", correction_service, use_cache=use_cache
+        ),
+        _build_test_response
+    )
+
+@celery_app.task
+def refresh_materialized_views() -> None:
+    """刷新仪表板使用的物化视图，仅PostgreSQL需要"""
+    if engine.dialect.name != "postgresql":
+        return
+    
+    with engine.begin() as conn:
+        conn.execute(text(MV_MODEL_PERFORMANCE_REFRESH))
+    
+    invalidate_dashboard_cache()
@@ -10,22 +10,51 @@ from dotenv import load_dotenv
 # 加载环境变量
 load_dotenv()
 
+from app.database import create_tables
+
 if __name__ == "__main__":
     # 获取配置
     host = os.getenv("HOST", "0.0.0.0")
     port = int(os.getenv("PORT", 12000))
     debug = os.getenv("DEBUG", "True").lower() == "true"
+    # 热重载需要显式开启，文件监视进程会持续扫描目录
+    reload = os.getenv("DEV_RELOAD", "False").lower() == "true"
+    # 访问日志默认关闭，由前置的反向代理记录
+    access_log = os.getenv("ACCESS_LOG", "False").lower() == "true"
+    # 调试模式和热重载（与多worker不兼容）使用单进程，否则默认每个CPU核心一个worker
+    workers = 1 if debug or reload else int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1))
     
     print(f"🚀 启动AI任务自动化测试平台")
     print(f"📍 地址: http://{host}:{port}")
     print(f"🔧 调试模式: {'开启' if debug else '关闭'}")
+    print(f"👷 Worker数: {workers}")
+    
+    # 数据表只在启动脚本中创建和迁移一次，而不是在每个worker导入应用时执行
+    if os.getenv("AUTO_CREATE_TABLES", "1") == "1":
+        create_tables()
+    
+    # 优先使用uvloop事件循环和httptools解析器，未安装或不支持的平台（Windows）回退到asyncio和h11
+    try:
+        import uvloop  # noqa: F401
+        loop = "uvloop"
+    except ImportError:
+        loop = "asyncio"
+    
+    try:
+        import httptools  # noqa: F401
+        http = "httptools"
+    except ImportError:
+        http = "h11"
     
     # 启动服务器
     uvicorn.run(
         "app.main:app",
         host=host,
         port=port,
-        reload=debug,
-        access_log=True,
-        log_level="info" if not debug else "debug"
+        reload=reload,
+        workers=workers,
+        access_log=access_log,
+        log_level="info" if not debug else "debug",
+        loop=loop,
+        http=http
     )
\ No newline at end of file
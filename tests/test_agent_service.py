@@ -0,0 +1,77 @@
+import ast
+import asyncio
+import unittest
+
+from app.services.agent_service import AgentService, _MAX_INTEGER_BITS, _check_integer_size, _safe_eval
+
+class SafeEvalTest(unittest.TestCase):
+    def test_arithmetic(self):
+        self.assertEqual(_safe_eval("1 + 2 * 3"), 7)
+        self.assertEqual(_safe_eval("(1 + 2) * 3"), 9)
+        self.assertEqual(_safe_eval("7 // 2"), 3)
+        self.assertEqual(_safe_eval("-2 ** 2"), -4)
+        self.assertAlmostEqual(_safe_eval("10 / 4"), 2.5)
+        self.assertAlmostEqual(_safe_eval(" 1.5 * 2 "), 3.0)
+
+    def test_power_within_limit(self):
+        self.assertEqual(_safe_eval("2 ** 100"), 2 ** 100)
+        self.assertEqual(_safe_eval("2 ** -1"), 0.5)
+
+    def test_rejects_calls(self):
+        with self.assertRaisesRegex(ValueError, "不支持的运算"):
+            _safe_eval("__import__('os').system('true')")
+
+    def test_rejects_attribute_access(self):
+        with self.assertRaisesRegex(ValueError, "不支持的运算"):
+            _safe_eval("(1).__class__")
+
+    def test_rejects_names_and_strings(self):
+        for expression in ("x + 1", "'a' * 3", "[1, 2]", "7 % 4"):
+            with self.assertRaisesRegex(ValueError, "不支持的运算"):
+                _safe_eval(expression)
+
+    def test_rejects_huge_power(self):
+        with self.assertRaisesRegex(ValueError, "计算结果过大"):
+            _safe_eval("2 ** 100000")
+
+    def test_rejects_nested_huge_power(self):
+        with self.assertRaisesRegex(ValueError, "计算结果过大"):
+            _safe_eval("9 ** 9 ** 9")
+
+    def test_rejects_huge_literal(self):
+        with self.assertRaisesRegex(ValueError, "数字过大"):
+            _safe_eval(str(2 ** (_MAX_INTEGER_BITS + 1)))
+
+    def test_float_overflow_raises(self):
+        # 浮点乘方不做位数估算，溢出时由Python抛出 OverflowError
+        with self.assertRaises(OverflowError):
+            _safe_eval("2.5 ** 1000")
+
+class CheckIntegerSizeTest(unittest.TestCase):
+    def test_allows_results_within_limit(self):
+        _check_integer_size(ast.Pow(), 2, _MAX_INTEGER_BITS // 2 - 1)
+        _check_integer_size(ast.Mult(), 2 ** 100, 2 ** 100)
+
+    def test_rejects_large_multiplication(self):
+        with self.assertRaises(ValueError):
+            _check_integer_size(ast.Mult(), 2 ** 3000, 2 ** 3000)
+
+    def test_ignores_trivial_bases_and_floats(self):
+        _check_integer_size(ast.Pow(), 1, 10 ** 9)
+        _check_integer_size(ast.Pow(), -1, 10 ** 9)
+        _check_integer_size(ast.Pow(), 2.0, 10 ** 9)
+        _check_integer_size(ast.Add(), 2 ** 4000, 2 ** 4000)
+
+class CalculatorTest(unittest.TestCase):
+    def setUp(self):
+        self.service = AgentService.__new__(AgentService)
+
+    def test_result(self):
+        self.assertEqual(asyncio.run(self.service._calculator("6 * 7")), "6 * 7 = 42")
+
+    def test_errors_are_reported(self):
+        for expression in ("2 ** 100000", "2.5 ** 1000", "__import__('os')"):
+            self.assertTrue(asyncio.run(self.service._calculator(expression)).startswith("计算错误"))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,40 @@
+import unittest
+
+from app.services.classification_service import ClassificationService
+
+LABELS = ["positive", "negative", "neutral"]
+
+class ParseResultTest(unittest.TestCase):
+    def setUp(self):
+        self.service = ClassificationService.__new__(ClassificationService)
+
+    def test_label_in_set(self):
+        result = self.service._parse_result({"predicted_label": "negative", "confidence": 0.8}, LABELS)
+        self.assertEqual(result.predicted_label, "negative")
+        self.assertEqual(result.confidence, 0.8)
+        self.assertEqual(result.probabilities, {"negative": 0.8})
+
+    def test_label_normalized_to_set(self):
+        result = self.service._parse_result({"predicted_label": " Positive ", "confidence": 0.9}, LABELS)
+        self.assertEqual(result.predicted_label, "positive")
+        self.assertEqual(result.confidence, 0.9)
+
+    def test_label_outside_set_is_unknown(self):
+        with self.assertLogs("app.services.classification_service", level="WARNING"):
+            result = self.service._parse_result({"predicted_label": "happy", "confidence": 0.95}, LABELS)
+        self.assertEqual(result.predicted_label, "unknown")
+        self.assertEqual(result.confidence, 0.0)
+
+    def test_missing_label_is_unknown(self):
+        with self.assertLogs("app.services.classification_service", level="WARNING"):
+            result = self.service._parse_result({"confidence": 0.7}, LABELS)
+        self.assertEqual(result.predicted_label, "unknown")
+        self.assertEqual(result.confidence, 0.0)
+
+    def test_no_labels_passes_through(self):
+        result = self.service._parse_result({"predicted_label": "spam", "confidence": 0.6})
+        self.assertEqual(result.predicted_label, "spam")
+        self.assertIsNone(result.probabilities)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,54 @@
+import unittest
+
+import orjson
+
+from app.services.correction_service import CorrectionService, _extract_corrected_text, _load_json_object
+
+class LoadJsonObjectTest(unittest.TestCase):
+    def test_plain_json(self):
+        self.assertEqual(_load_json_object('{"corrected_text": "ok"}'), {"corrected_text": "ok"})
+
+    def test_fenced_json(self):
+        reply = '```json\n{"corrected_text": "I went.", "confidence": 0.9}\n```'
+        self.assertEqual(_load_json_object(reply), {"corrected_text": "I went.", "confidence": 0.9})
+
+    def test_text_wrapped_json(self):
+        reply = '纠错结果如下：{"corrected_text": "I went."} 希望对你有帮助。'
+        self.assertEqual(_load_json_object(reply), {"corrected_text": "I went."})
+
+    def test_braces_inside_strings(self):
+        reply = '结果 {"corrected_text": "use {x} and \\"}\\"", "corrections": []} 结束'
+        self.assertEqual(_load_json_object(reply), {"corrected_text": 'use {x} and "}"', "corrections": []})
+
+    def test_skips_invalid_candidate(self):
+        reply = '{not json} 然后 {"corrected_text": "ok"}'
+        self.assertEqual(_load_json_object(reply), {"corrected_text": "ok"})
+
+    def test_unbalanced_braces(self):
+        for reply in ('{"corrected_text": "I went."', '没有JSON', '}{', '[1, 2]'):
+            with self.assertRaises(orjson.JSONDecodeError):
+                _load_json_object(reply)
+
+class ParseReplyTest(unittest.TestCase):
+    def setUp(self):
+        self.service = CorrectionService.__new__(CorrectionService)
+
+    def test_missing_corrections_are_generated(self):
+        result = self.service._parse_reply('{"corrected_text": "I went home"}', "I goed home")
+        self.assertEqual(result.corrected_text, "I went home")
+        self.assertTrue(result.corrections)
+
+    def test_truncated_json_keeps_corrected_text(self):
+        reply = '```json\n{"corrected_text": "I went home", "corrections": ['
+        self.assertEqual(_extract_corrected_text(reply, "I goed home"), "I went home")
+        result = self.service._parse_reply(reply, "I goed home")
+        self.assertEqual(result.corrected_text, "I went home")
+        self.assertTrue(result.corrections)
+
+    def test_unparseable_reply_keeps_original(self):
+        result = self.service._parse_reply("无法处理", "I goed home")
+        self.assertEqual(result.corrected_text, "I goed home")
+        self.assertEqual(result.corrections, [])
+
+if __name__ == "__main__":
+    unittest.main()
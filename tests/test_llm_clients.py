@@ -0,0 +1,35 @@
+import asyncio
+import unittest
+
+from app.services.llm_clients import InflightRequests
+
+class InflightRequestsTest(unittest.TestCase):
+    def _run_concurrently(self, params):
+        inflight = InflightRequests()
+        calls = []
+
+        async def call():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return len(calls)
+
+        async def main():
+            return await asyncio.gather(*(inflight.run("openai", params, call) for _ in range(3)))
+
+        return asyncio.run(main()), len(calls)
+
+    def test_deterministic_requests_are_coalesced(self):
+        results, calls = self._run_concurrently({"model": "gpt-4o", "temperature": 0})
+        self.assertEqual(calls, 1)
+        self.assertEqual(results, [1, 1, 1])
+
+    def test_sampled_requests_are_not_coalesced(self):
+        _, calls = self._run_concurrently({"model": "gpt-4o", "temperature": 0.7})
+        self.assertEqual(calls, 3)
+
+    def test_default_temperature_is_not_coalesced(self):
+        _, calls = self._run_concurrently({"model": "gpt-4o"})
+        self.assertEqual(calls, 3)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,25 @@
+import unittest
+
+import numpy as np
+
+from app.services.rag_service import _top_k_indices
+
+def _stable_top_k(scores, top_k):
+    """改为 argpartition 之前的实现：稳定排序后取前k个"""
+    return sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)[:top_k]
+
+class TopKIndicesTest(unittest.TestCase):
+    def test_matches_stable_sort_with_ties(self):
+        rng = np.random.default_rng(0)
+        for _ in range(2000):
+            n = int(rng.integers(1, 40))
+            scores = rng.integers(0, 4, size=n).astype(np.float64)
+            top_k = int(rng.integers(1, 10))
+            self.assertEqual(_top_k_indices(scores, top_k).tolist(), _stable_top_k(scores.tolist(), top_k))
+
+    def test_empty(self):
+        self.assertEqual(_top_k_indices(np.array([]), 5).tolist(), [])
+        self.assertEqual(_top_k_indices(np.array([1.0, 2.0]), 0).tolist(), [])
+
+if __name__ == "__main__":
+    unittest.main()